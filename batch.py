@@ -0,0 +1,326 @@
+"""
+Batch mode: turn every blog of a manifest into PDFs in one process.
+
+    python batch.py --manifest blogs.json [OPTIONS]
+
+The manifest is a JSON list of blogs (or an object with a "blogs" list):
+
+    [
+        {"url": "https://example.substack.com", "type": "substack", "title": "Example", "author": "Jane Doe"},
+        {"url": "https://example.com", "type": "wordpress", "variants": ["text"]},
+        {"url": "https://photos.example.com", "type": "wordpress", "image_profiles": ["ereader", "print"]}
+    ]
+
+`title`, `author`, `image` (a custom frontispiece), `variants` and
+`image_profiles` are optional, as on the command line.
+"""
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import click
+from dotenv import load_dotenv
+
+from scrapers.crawl_journal import CrawlJournal
+from scrapers.http_cache import HTTPCache
+from scrapers.http_client import HTTPClient
+from scrapers.metrics import metrics
+from scrapers.post_store import PostStore, blog_dir_name
+from scrapers.rate_limiter import HostRateLimiters
+from pdf_generator.file_cache import FragmentCache
+from pdf_generator.generator import RenderJob, run_render_job
+from pdf_generator.image_optimizer import ImageOptimizer
+from pdf_generator.image_profiles import DEFAULT_PROFILE, PROFILES
+from pipeline import (OUTPUT_DIR, VARIANTS, Blog, incomplete_crawl, make_scraper, render_jobs, scraped_posts,
+                      spool_blog)
+
+# Load environment variables from .env file
+load_dotenv()
+
+BLOG_TYPES = ('wordpress', 'substack')
+
+
+class BatchSettings(NamedTuple):
+    """Settings shared by every blog of a batch."""
+    workers: int = 1
+    rate: Optional[float] = None
+    max_rate: Optional[float] = None
+    max_retries: int = 4
+    index_lookahead: int = 2
+    archive_page_size: int = 50
+    archive_workers: int = 1
+    fetch_mode: str = 'api'
+    incremental: bool = False
+    store_dir: str = '.post_store'
+    resume: bool = False
+    checkpoint_dir: str = '.checkpoints'
+    chunk_size: int = 0
+    chunk_by_year: bool = False
+    fragment_cache_dir: Optional[str] = None
+    output_dir: str = OUTPUT_DIR
+
+
+class BlogResult(NamedTuple):
+    """How one blog of a batch went."""
+    url: str
+    ok: bool
+    posts: int = 0
+    output_files: Tuple[str, ...] = ()
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+class _PreparedBlog(NamedTuple):
+    jobs: List[RenderJob]
+    post_count: int
+    spool_dir: tempfile.TemporaryDirectory
+    journal: CrawlJournal
+    start: float
+    # Why the crawl can be resumed, or None when it completed
+    incomplete: Optional[str] = None
+
+
+def load_manifest(path: str, image_profiles: Tuple[str, ...] = (DEFAULT_PROFILE,)) -> List[Blog]:
+    """
+    Read the blogs of a manifest; raises ValueError when an entry is invalid.
+    Entries without image profiles get `image_profiles`.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    entries = data.get('blogs') if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        raise ValueError("the manifest must be a list of blogs, or an object with a \"blogs\" list")
+
+    blogs = []
+    seen = set()
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get('url'):
+            raise ValueError(f"blog {number} has no url")
+        blog_type = str(entry.get('type', '')).lower()
+        if blog_type not in BLOG_TYPES:
+            raise ValueError(f"blog {number} ({entry['url']}): type must be one of {', '.join(BLOG_TYPES)}")
+        variants = tuple(entry.get('variants') or VARIANTS)
+        if not set(variants) <= set(VARIANTS):
+            raise ValueError(f"blog {number} ({entry['url']}): variants must be among {', '.join(VARIANTS)}")
+        profiles = tuple(dict.fromkeys(entry.get('image_profiles') or image_profiles))
+        if not set(profiles) <= set(PROFILES):
+            raise ValueError(f"blog {number} ({entry['url']}): image_profiles must be among {', '.join(PROFILES)}")
+        # Blogs share their checkpoint, store and output directories by URL
+        if entry['url'] in seen:
+            raise ValueError(f"blog {number} ({entry['url']}) is listed twice")
+        seen.add(entry['url'])
+        blogs.append(Blog(entry['url'], blog_type, entry.get('title'), entry.get('author'), entry.get('image'),
+                          variants, profiles, entry.get('rest_url')))
+    return blogs
+
+
+def run_batch(blogs: List[Blog], settings: BatchSettings, http_client: HTTPClient, optimizer: ImageOptimizer,
+              http_cache: Optional[HTTPCache] = None, parallel_blogs: int = 4,
+              render_processes: Optional[int] = None) -> List[BlogResult]:
+    """
+    Scrape, optimize and render every blog, sharing the pools between them.
+
+    Up to `parallel_blogs` blogs are scraped and spooled at once, each with
+    `settings.workers` fetch threads. They share one HTTP client, the image
+    optimizer's download threads and Pillow processes, and one rate limiter
+    per host, so blogs of the same host together stay within that host's
+    limit. A blog's PDFs go to one pool of `render_processes` layout
+    processes as soon as it is spooled, while the next blogs are scraped.
+    A failing blog is reported and doesn't stop the others.
+    Returns the results in manifest order.
+    """
+    render_processes = render_processes or os.cpu_count() or 1
+    limiters = HostRateLimiters()
+    fragment_cache = FragmentCache(settings.fragment_cache_dir) if settings.fragment_cache_dir else None
+    results: Dict[str, BlogResult] = {}
+    renders = []
+    try:
+        with ProcessPoolExecutor(max_workers=render_processes) as layout, \
+                ThreadPoolExecutor(max_workers=parallel_blogs) as scrapes, \
+                ThreadPoolExecutor(max_workers=max(1, 2 * len(blogs))) as drivers:
+            futures = {scrapes.submit(_prepare_blog, blog, settings, http_client, http_cache, optimizer,
+                                      limiters): blog for blog in blogs}
+            for future in as_completed(futures):
+                blog = futures[future]
+                try:
+                    prepared = future.result()
+                except Exception as e:
+                    click.echo(f"Failed to scrape {blog.url}: {e}")
+                    results[blog.url] = BlogResult(blog.url, False, error=str(e))
+                    continue
+                click.echo(f"Scraped {prepared.post_count} posts from {blog.url}, "
+                           f"rendering {len(prepared.jobs)} PDF(s)...")
+                # Chunked jobs are driven from a thread and lay their chunks out in the shared pool
+                job_futures = [drivers.submit(run_render_job, job, layout, render_processes, fragment_cache)
+                               if job.chunked else layout.submit(run_render_job, job)
+                               for job in prepared.jobs]
+                finished = _track_finish(job_futures)
+                renders.append((blog, prepared, job_futures, finished))
+
+            for blog, prepared, job_futures, finished in renders:
+                results[blog.url] = _collect_renders(blog, prepared, job_futures, finished)
+    finally:
+        for _, prepared, _, _ in renders:
+            prepared.spool_dir.cleanup()
+            prepared.journal.close()
+        if fragment_cache:
+            fragment_cache.close()
+    return [results[blog.url] for blog in blogs]
+
+
+def _prepare_blog(blog: Blog, settings: BatchSettings, http_client: HTTPClient, http_cache: Optional[HTTPCache],
+                  optimizer: ImageOptimizer, limiters: HostRateLimiters) -> _PreparedBlog:
+    """Scrape and spool one blog and return its render jobs."""
+    start = time.monotonic()
+    click.echo(f"Scraping {blog.url} as {blog.type}...")
+    post_store = PostStore.for_blog(settings.store_dir, blog.url) if settings.incremental else None
+    journal = CrawlJournal.for_blog(settings.checkpoint_dir, blog.url, resume=settings.resume)
+    spool_dir = tempfile.TemporaryDirectory(prefix='blogscraper-')
+    try:
+        scraper = make_scraper(blog.url, blog.type, settings.workers, settings.rate, settings.max_rate,
+                               settings.max_retries, settings.index_lookahead, settings.archive_page_size,
+                               settings.archive_workers, settings.fetch_mode, http_cache, post_store, http_client,
+                               journal, rate_limiters=limiters, rest_url=blog.rest_url)
+        with metrics.stage('scrape'):
+            posts = scraped_posts(scraper, post_store)
+        spooled = spool_blog(blog, posts, optimizer if 'images' in blog.variants else None, spool_dir.name)
+        if not spooled.post_count:
+            raise RuntimeError("no posts found")
+        # Titles and authors may repeat across blogs, so every blog gets its own directory
+        jobs = render_jobs(blog, spooled, settings.chunk_size, settings.chunk_by_year,
+                           settings.fragment_cache_dir, os.path.join(settings.output_dir, blog_dir_name(blog.url)))
+    except BaseException:
+        spool_dir.cleanup()
+        journal.close()
+        raise
+    return _PreparedBlog(jobs, spooled.post_count, spool_dir, journal, start, incomplete_crawl(scraper))
+
+
+def _track_finish(futures: List[Future]) -> Dict[str, float]:
+    """Record when the last of `futures` finished, since they are collected later."""
+    finished = {'at': time.monotonic()}
+
+    def done(_):
+        finished['at'] = time.monotonic()
+
+    for future in futures:
+        future.add_done_callback(done)
+    return finished
+
+
+def _collect_renders(blog: Blog, prepared: _PreparedBlog, job_futures: List[Future],
+                     finished: Dict[str, float]) -> BlogResult:
+    output_files = []
+    errors = []
+    for future in job_futures:
+        try:
+            output_files.append(future.result())
+        except Exception as e:
+            errors.append(str(e))
+    seconds = finished['at'] - prepared.start
+    if errors:
+        click.echo(f"Failed to render {blog.url}: {'; '.join(errors)}")
+        return BlogResult(blog.url, False, prepared.post_count, tuple(output_files), seconds, '; '.join(errors))
+    for output_file in output_files:
+        click.echo(f"Generated {output_file}")
+    if prepared.incomplete:
+        # The PDFs lack the posts that failed; keep the checkpoint for --resume
+        click.echo(f"{blog.url}: {prepared.incomplete}.")
+        return BlogResult(blog.url, False, prepared.post_count, tuple(output_files), seconds, prepared.incomplete)
+    # The blog completed, nothing left to resume
+    prepared.journal.remove()
+    return BlogResult(blog.url, True, prepared.post_count, tuple(output_files), seconds)
+
+
+@click.command()
+@click.option('--manifest', required=True, type=click.Path(exists=True, dir_okay=False), help='JSON file listing the blogs (url, type, and optionally title, author, image, variants, image_profiles).')
+@click.option('--image-profile', 'image_profiles', multiple=True, type=click.Choice(list(PROFILES)), default=(DEFAULT_PROFILE,), show_default=True, help='Image profile of the images PDFs of blogs that set none; repeat for one PDF per profile.')
+@click.option('--parallel-blogs', type=click.IntRange(min=1), default=4, show_default=True, help='Blogs scraped at the same time.')
+@click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True, help='Posts fetched concurrently per blog.')
+@click.option('--rate', type=click.FloatRange(min=0, min_open=True), default=None, help='Initial requests per second per host (Substack defaults to 0.5, WordPress is unlimited until throttled).')
+@click.option('--max-rate', type=click.FloatRange(min=0, min_open=True), default=None, help='Requests per second per host the rate may ramp up to (Substack defaults to 4x --rate).')
+@click.option('--max-retries', type=click.IntRange(min=0), default=4, show_default=True, help='Retries of a throttled or failed request.')
+@click.option('--per-host-connections', type=click.IntRange(min=1), default=8, show_default=True, help='Most connections open to one host at a time, across all blogs (image CDNs included).')
+@click.option('--fetch', 'fetch_mode', type=click.Choice(['api', 'html']), default='api', show_default=True, help='Read posts from the blogs\' JSON APIs, or always scrape the HTML pages.')
+@click.option('--timeout', type=click.FloatRange(min=0, min_open=True), default=60, show_default=True, help='Seconds to wait for a server to respond.')
+@click.option('--http2', is_flag=True, help='Use HTTP/2 connections (needs the http2 extra: httpx[http2]).')
+@click.option('--cache-dir', default='.http_cache', show_default=True, help='Directory of the on-disk HTTP cache.')
+@click.option('--cache-size', type=click.IntRange(min=1), default=1024, show_default=True, help='HTTP cache size cap in MB.')
+@click.option('--no-cache', is_flag=True, help='Disable the HTTP cache.')
+@click.option('--image-workers', type=click.IntRange(min=1), default=8, show_default=True, help='Images downloaded concurrently, across all blogs.')
+@click.option('--image-cache-dir', default='.image_cache', show_default=True, help='Directory of the persistent optimized image cache.')
+@click.option('--image-cache-size', type=click.IntRange(min=1), default=2048, show_default=True, help='Optimized image cache size cap in MB.')
+@click.option('--max-image-size', type=click.IntRange(min=0), default=20, show_default=True, help='Skip images larger than this many MB (0 = no limit).')
+@click.option('--image-dedup', is_flag=True, help='Also share one optimized image between images that look the same (same aspect ratio, close perceptual hash and matching pixels).')
+@click.option('--incremental', is_flag=True, help='Only fetch posts newer than the last run of each blog and build its PDFs from the local post store.')
+@click.option('--store-dir', default='.post_store', show_default=True, help='Directory of the local post stores used by --incremental.')
+@click.option('--resume', is_flag=True, help='Continue the blogs of an interrupted batch from their checkpoints.')
+@click.option('--checkpoint-dir', default='.checkpoints', show_default=True, help='Directory of the crawl checkpoints used by --resume.')
+@click.option('--chunk-size', type=click.IntRange(min=0), default=0, show_default=True, help='Render the PDFs in chunks of this many posts and merge them (0 renders one document).')
+@click.option('--chunk-by-year', is_flag=True, help='Start a new render chunk for every publication year.')
+@click.option('--fragment-cache-dir', default=None, help='Cache each rendered post in this directory and only lay out new or changed posts (renders in chunks).')
+@click.option('--render-processes', type=click.IntRange(min=1), default=None, help='Processes used for PDF layout, shared by all blogs (defaults to the CPU count).')
+@click.option('--output-dir', default=OUTPUT_DIR, show_default=True, help='Directory the PDFs are written to, in one subdirectory per blog.')
+@click.option('--summary', 'summary_file', default=None, help='Write the per-blog results to this JSON file.')
+@click.option('--report', 'report_file', default=None, help='Write per-stage, per-host and per-post metrics to this file (.json or .csv).')
+def batch(manifest, image_profiles, parallel_blogs, workers, rate, max_rate, max_retries, per_host_connections, fetch_mode, timeout,
+          http2, cache_dir, cache_size, no_cache, image_workers, image_cache_dir, image_cache_size, max_image_size,
+          image_dedup, incremental, store_dir, resume, checkpoint_dir, chunk_size, chunk_by_year, fragment_cache_dir,
+          render_processes, output_dir, summary_file, report_file):
+    """Scrape every blog of a manifest and generate their PDFs."""
+    try:
+        blogs = load_manifest(manifest, tuple(image_profiles))
+    except (ValueError, json.JSONDecodeError) as e:
+        raise click.BadParameter(str(e), param_hint='--manifest')
+    settings = BatchSettings(workers=workers, rate=rate, max_rate=max_rate, max_retries=max_retries,
+                             fetch_mode=fetch_mode, incremental=incremental, store_dir=store_dir, resume=resume,
+                             checkpoint_dir=checkpoint_dir, chunk_size=chunk_size, chunk_by_year=chunk_by_year,
+                             fragment_cache_dir=fragment_cache_dir, output_dir=output_dir)
+
+    http_cache = None if no_cache else HTTPCache(cache_dir, max_bytes=cache_size * 1024 * 1024)
+    # One client for every blog: keep-alive connections to shared hosts (e.g. image CDNs) are reused,
+    # and no host gets more than per_host_connections at once
+    http_client = HTTPClient(pool_maxsize=max(workers + 1, image_workers), pool_connections=max(10, 2 * len(blogs)),
+                             timeout=(10, timeout), http2=http2, per_host_limit=per_host_connections)
+    optimizer = ImageOptimizer(output_dir=image_cache_dir, http_cache=http_cache, download_workers=image_workers,
+                               cache_size=image_cache_size * 1024 * 1024, http_client=http_client,
+                               max_image_bytes=max_image_size * 1024 * 1024 or None,
+                               dedup_distance=ImageOptimizer.DEDUP_DISTANCE if image_dedup else None)
+    start = time.monotonic()
+    try:
+        click.echo(f"Processing {len(blogs)} blogs, {parallel_blogs} at a time...")
+        results = run_batch(blogs, settings, http_client, optimizer, http_cache, parallel_blogs, render_processes)
+    finally:
+        optimizer.close()
+        http_client.close()
+        if http_cache:
+            http_cache.close()
+        if report_file:
+            metrics.write_report(report_file)
+            click.echo(f"Wrote metrics to {report_file}")
+
+    _print_summary(results, time.monotonic() - start)
+    if summary_file:
+        with open(summary_file, 'w') as f:
+            json.dump([result._asdict() for result in results], f, indent=2)
+        click.echo(f"Wrote the summary to {summary_file}")
+    if not all(result.ok for result in results):
+        raise SystemExit(1)
+
+
+def _print_summary(results: List[BlogResult], seconds: float):
+    click.echo()
+    click.echo(f"{'status':<8}{'posts':>7}{'seconds':>9}  blog")
+    for result in results:
+        click.echo(f"{'ok' if result.ok else 'FAILED':<8}{result.posts:>7}{result.seconds:>9.1f}  {result.url}")
+        if result.error:
+            click.echo(f"{'':<26}{result.error}")
+    ok = sum(result.ok for result in results)
+    click.echo(f"{ok} of {len(results)} blogs done in {seconds:.1f}s.")
+
+
+if __name__ == '__main__':
+    batch()
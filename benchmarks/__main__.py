@@ -0,0 +1,111 @@
+"""
+Offline benchmarks: python -m benchmarks [OPTIONS]
+
+Generates a synthetic blog, serves it from a local HTTP server and times
+the scrapers, the image optimizer and the whole pipeline against it.
+"""
+import json
+import time
+
+import click
+
+from .fixtures import FixtureBlog, FixtureConfig
+from .server import FixtureServer
+from .suite import BENCHMARKS, BenchmarkOptions, compare, run_benchmark
+
+
+def _parse_size(ctx, param, value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise click.BadParameter("expected WIDTHxHEIGHT, e.g. 1600x1000")
+    return width, height
+
+
+@click.command()
+@click.option('--only', 'names', multiple=True, type=click.Choice(list(BENCHMARKS)), help='Benchmark to run; repeat for several (default: all).')
+@click.option('--posts', type=click.IntRange(min=1), default=100, show_default=True, help='Posts in the synthetic blog.')
+@click.option('--paragraphs', type=click.IntRange(min=1), default=6, show_default=True, help='Paragraphs per post.')
+@click.option('--images-per-post', type=click.IntRange(min=0), default=2, show_default=True, help='Images per post.')
+@click.option('--image-size', callback=_parse_size, default='1600x1000', show_default=True, help='Size of the served images, WIDTHxHEIGHT.')
+@click.option('--page-size', type=click.IntRange(min=1), default=10, show_default=True, help='Posts per WordPress index page.')
+@click.option('--latency', type=click.FloatRange(min=0), default=0.02, show_default=True, help='Seconds the server waits before every response.')
+@click.option('--throttle', type=click.FloatRange(min=0, max=1), default=0.0, show_default=True, help='Fraction of page and API requests answered with 429.')
+@click.option('--retry-after', type=click.FloatRange(min=0), default=0.1, show_default=True, help='Retry-After of the 429 responses, in seconds.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Seed of the synthetic blog and of the 429 injection.')
+@click.option('--workers', type=click.IntRange(min=1), default=4, show_default=True, help='Post (and Substack archive) workers.')
+@click.option('--image-workers', type=click.IntRange(min=1), default=8, show_default=True, help='Concurrent image downloads.')
+@click.option('--rate', type=click.FloatRange(min=0, min_open=True), default=None, help='Initial requests per second of the scrapers (default: unlimited until throttled).')
+@click.option('--render-processes', type=click.IntRange(min=1), default=None, help='Processes used for PDF layout in the pipeline benchmark.')
+@click.option('--chunk-size', type=click.IntRange(min=0), default=0, show_default=True, help='Render chunk size in the pipeline benchmark.')
+@click.option('--output', 'output_file', default=None, help='Write the results to this JSON file.')
+@click.option('--baseline', 'baseline_file', default=None, help='Compare with the results of an earlier run (a file written by --output).')
+@click.option('--threshold', type=click.FloatRange(min=0), default=0.1, show_default=True, help='Slowdown against the baseline reported as a regression (0.1 = 10%).')
+@click.option('--verbose', is_flag=True, help='Show the output of the code under test.')
+@click.pass_context
+def cli(ctx, names, posts, paragraphs, images_per_post, image_size, page_size, latency, throttle, retry_after, seed,
+        workers, image_workers, rate, render_processes, chunk_size, output_file, baseline_file, threshold, verbose):
+    """Benchmark the scrapers, the image optimizer and PDF generation against a local fixture server."""
+    config = FixtureConfig(posts=posts, paragraphs=paragraphs, images_per_post=images_per_post,
+                           image_width=image_size[0], image_height=image_size[1], page_size=page_size, seed=seed)
+    options = BenchmarkOptions(workers=workers, image_workers=image_workers, rate=rate,
+                               render_processes=render_processes, chunk_size=chunk_size, verbose=verbose)
+
+    click.echo(f"Generating {posts} posts with {posts * images_per_post} images...")
+    start = time.perf_counter()
+    blog = FixtureBlog(config)
+    click.echo(f"Generated the fixture in {time.perf_counter() - start:.1f}s "
+               f"({blog.image_bytes / 1024 / 1024:.1f} MB of images).")
+
+    server = FixtureServer(blog, latency=latency, throttle=throttle, retry_after=retry_after, seed=seed).start()
+    results = {}
+    try:
+        for name in names or BENCHMARKS:
+            click.echo(f"Running {name}...")
+            results[name] = run_benchmark(name, server, options)
+    finally:
+        server.stop()
+
+    click.echo()
+    click.echo(f"{'benchmark':<16}{'items':>8}{'seconds':>10}{'per second':>12}{'peak MB':>10}{'child MB':>10}"
+               f"{'requests':>10}{'429s':>7}{'retries':>9}")
+    for name, result in results.items():
+        if 'items' not in result:
+            click.echo(f"{name:<16}  failed: {result['error']}")
+            continue
+        click.echo(f"{name:<16}{result['items']:>8}{result['seconds']:>10.2f}{result['throughput']:>12.1f}"
+                   f"{_megabytes(result['peak_rss_mb']):>10}{_megabytes(result['peak_child_rss_mb']):>10}"
+                   f"{result['requests']:>10}{result['throttled']:>7}{result['retries']:>9}")
+        if 'error' in result:
+            click.echo(f"{'':<16}  warning: {result['error']}")
+        if len(result['stages']) > 1:
+            stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in result['stages'].items())
+            click.echo(f"{'':<16}  stages: {stages}")
+
+    if output_file:
+        with open(output_file, 'w') as f:
+            json.dump({'config': config._asdict(), 'options': options._asdict(),
+                       'server': {'latency': latency, 'throttle': throttle, 'retry_after': retry_after},
+                       'results': results}, f, indent=2)
+        click.echo(f"Wrote results to {output_file}")
+
+    if baseline_file:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config._asdict():
+            click.echo("Warning: the baseline was measured on a different fixture.")
+        regressions = 0
+        click.echo()
+        for name, change, regressed in compare(results, baseline.get('results', {}), threshold):
+            regressions += regressed
+            click.echo(f"{name:<16}{change:>+9.1%}{'  REGRESSION' if regressed else ''}")
+        if regressions:
+            ctx.exit(1)
+
+
+def _megabytes(value) -> str:
+    return '-' if value is None else f"{value:.0f}"
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,213 @@
+import json
+import math
+import random
+from datetime import datetime, timedelta
+from html import escape
+from io import BytesIO
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs
+
+from PIL import Image, ImageDraw
+
+# (status, headers, body)
+Response = Tuple[int, Dict[str, str], bytes]
+
+WORDS = ('the', 'of', 'blog', 'post', 'archive', 'reader', 'page', 'image', 'essay', 'notes', 'week', 'letter',
+         'history', 'market', 'story', 'question', 'answer', 'city', 'river', 'winter', 'summer', 'light')
+
+
+class FixtureConfig(NamedTuple):
+    """Shape of a synthetic blog."""
+    posts: int = 100
+    paragraphs: int = 6
+    images_per_post: int = 2
+    image_width: int = 1600
+    image_height: int = 1000
+    # Posts per WordPress index page
+    page_size: int = 10
+    seed: int = 0
+
+
+class FixturePost(NamedTuple):
+    number: int
+    slug: str
+    title: str
+    date: datetime
+    body: str
+
+
+def make_image(width: int, height: int, seed: int) -> bytes:
+    """
+    A JPEG that is cheap to make but not trivial to compress or resize:
+    a gradient with seeded shapes, so every image is visually distinct.
+    """
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        size = rng.randrange(max(1, width // 20), max(2, width // 4))
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.ellipse((x, y, x + size, y + size), fill=color)
+        else:
+            draw.rectangle((x, y, x + size, y + size // 2), fill=color)
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+class FixtureBlog:
+    """
+    A synthetic blog that answers like both a WordPress and a Substack site.
+
+    Posts, their index pages and API responses are generated from a seeded
+    random source, so every run of a benchmark sees the same blog. Served
+    paths:
+    - WordPress: `/` and `/page/N/` index pages, `/YYYY/MM/DD/<slug>/`
+      post pages and the `/wp-json/wp/v2/posts` REST API
+    - Substack: the `/api/v1/archive` and `/api/v1/posts` listings,
+      `/api/v1/posts/<slug>` and `/p/<slug>` post pages
+    - `/images/N.jpg` for the images of every post
+    """
+
+    def __init__(self, config: FixtureConfig = FixtureConfig()):
+        self.config = config
+        rng = random.Random(config.seed)
+        newest = datetime(2024, 12, 31, 9, 0)
+        # Newest first, like the listings
+        self.posts: List[FixturePost] = []
+        for number in range(config.posts):
+            slug = f'post-{number}'
+            title = ' '.join(rng.choice(WORDS) for _ in range(5)).capitalize()
+            self.posts.append(FixturePost(number, slug, title, newest - timedelta(days=number),
+                                          self._make_body(number, rng)))
+        self._by_slug = {post.slug: post for post in self.posts}
+        self.images: Dict[str, bytes] = {
+            f'{number}.jpg': make_image(config.image_width, config.image_height, config.seed * 100003 + number)
+            for number in range(config.posts * config.images_per_post)}
+
+    @property
+    def image_bytes(self) -> int:
+        return sum(len(data) for data in self.images.values())
+
+    def image_urls(self, base_url: str) -> List[str]:
+        return [f"{base_url.rstrip('/')}/images/{name}" for name in self.images]
+
+    def response(self, base_url: str, path: str, query: str) -> Optional[Response]:
+        """The response for a GET of `path` with `query`, or None for a 404."""
+        params = {key: values[0] for key, values in parse_qs(query).items()}
+        base_url = base_url.rstrip('/')
+        parts = [part for part in path.split('/') if part]
+
+        if parts[:1] == ['images'] and len(parts) == 2 and parts[1] in self.images:
+            return 200, {'Content-Type': 'image/jpeg'}, self.images[parts[1]]
+        if parts == ['wp-json', 'wp', 'v2', 'posts']:
+            return self._rest_page(base_url, params)
+        if parts[:2] == ['api', 'v1']:
+            return self._substack_api(base_url, parts[2:], params)
+        if not parts:
+            return self._index_page(base_url, 1)
+        if len(parts) == 2 and parts[0] == 'page' and parts[1].isdigit():
+            return self._index_page(base_url, int(parts[1]))
+        if len(parts) == 2 and parts[0] == 'p' and parts[1] in self._by_slug:
+            return self._html(self._substack_page(self._by_slug[parts[1]]))
+        if len(parts) == 4 and parts[3] in self._by_slug:
+            return self._html(self._wordpress_page(self._by_slug[parts[3]]))
+        return None
+
+    def _make_body(self, number: int, rng: random.Random) -> str:
+        paragraphs = []
+        for index in range(self.config.paragraphs):
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(60, 140)))
+            paragraphs.append(f'<p>{words.capitalize()}.</p>')
+        # Spread the images through the text, linked to themselves like both platforms do
+        step = max(1, math.ceil(self.config.paragraphs / max(1, self.config.images_per_post)))
+        for image in range(self.config.images_per_post):
+            src = f'/images/{number * self.config.images_per_post + image}.jpg'
+            figure = f'<figure><a href="{src}"><img src="{src}" alt=""></a></figure>'
+            paragraphs.insert(min(len(paragraphs), image * step + image), figure)
+        return '\n'.join(paragraphs)
+
+    @staticmethod
+    def _html(html: str) -> Response:
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, html.encode()
+
+    @staticmethod
+    def _json(data: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+        return 200, {'Content-Type': 'application/json', **(headers or {})}, json.dumps(data).encode()
+
+    def _wordpress_link(self, base_url: str, post: FixturePost) -> str:
+        return f"{base_url}/{post.date:%Y/%m/%d}/{post.slug}/"
+
+    # WordPress
+
+    def _index_page(self, base_url: str, page: int) -> Optional[Response]:
+        size = self.config.page_size
+        posts = self.posts[(page - 1) * size:page * size]
+        if not posts and page > 1:
+            return None
+        articles = '\n'.join(
+            f'<article class="post"><h2 class="entry-title"><a href="{self._wordpress_link(base_url, post)}">'
+            f'{escape(post.title)}</a></h2><div class="entry-summary"><p>{escape(post.title)}...</p></div></article>'
+            for post in posts)
+        older = ''
+        if page * size < len(self.posts):
+            older = f'<nav><div class="nav-previous"><a href="{base_url}/page/{page + 1}/">Older posts</a></div></nav>'
+        return self._html(f'<html><head><title>Fixture Blog</title>'
+                          f'<link rel="https://api.w.org/" href="{base_url}/wp-json/"></head>'
+                          f'<body>{articles}{older}</body></html>')
+
+    def _wordpress_page(self, post: FixturePost) -> str:
+        return (f'<html><head><title>{escape(post.title)} – Fixture Blog</title></head><body><article>'
+                f'<h1 class="entry-title">{escape(post.title)}</h1>'
+                f'<time class="entry-date" datetime="{post.date.isoformat()}">{post.date:%B %d, %Y}</time>'
+                f'<div class="entry-content">{post.body}<div class="sharedaddy">Share this</div></div>'
+                f'</article></body></html>')
+
+    def _rest_page(self, base_url: str, params: Dict[str, str]) -> Optional[Response]:
+        per_page = int(params.get('per_page', 10))
+        page = int(params.get('page', 1))
+        total_pages = max(1, math.ceil(len(self.posts) / per_page))
+        if page > total_pages:
+            return 400, {'Content-Type': 'application/json'}, b'{"code": "rest_post_invalid_page_number"}'
+        items = [{
+            'link': self._wordpress_link(base_url, post),
+            'title': {'rendered': escape(post.title)},
+            'content': {'rendered': f'{post.body}<div class="sharedaddy">Share this</div>'},
+            'date': post.date.isoformat(),
+        } for post in self.posts[(page - 1) * per_page:page * per_page]]
+        return self._json(items, {'X-WP-Total': str(len(self.posts)), 'X-WP-TotalPages': str(total_pages)})
+
+    # Substack
+
+    def _substack_entry(self, base_url: str, post: FixturePost, with_body: bool) -> Dict[str, Any]:
+        entry = {
+            'id': post.number,
+            'slug': post.slug,
+            'title': post.title,
+            'canonical_url': f"{base_url}/p/{post.slug}",
+            'post_date': post.date.isoformat() + '.000Z',
+            'audience': 'everyone',
+        }
+        if with_body:
+            entry['body_html'] = f'{post.body}<div class="subscribe-widget">Subscribe</div>'
+        return entry
+
+    def _substack_api(self, base_url: str, parts: List[str], params: Dict[str, str]) -> Optional[Response]:
+        if parts == ['archive'] or parts == ['posts']:
+            offset = int(params.get('offset', 0))
+            # Substack caps its pages, whatever limit is asked for
+            limit = min(int(params.get('limit', 12)), 50)
+            posts = self.posts[offset:offset + limit]
+            return self._json([self._substack_entry(base_url, post, parts == ['posts']) for post in posts])
+        if len(parts) == 2 and parts[0] == 'posts' and parts[1] in self._by_slug:
+            return self._json(self._substack_entry(base_url, self._by_slug[parts[1]], True))
+        return None
+
+    def _substack_page(self, post: FixturePost) -> str:
+        return (f'<html><head><title>{escape(post.title)}</title></head><body>'
+                f'<h1 class="post-title">{escape(post.title)}</h1>'
+                f'<div class="post-date">{post.date:%b %d, %Y}</div>'
+                f'<div class="available-content"><div class="body markup">{post.body}'
+                f'<div class="subscribe-widget">Subscribe</div></div></div></body></html>')
@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from .fixtures import FixtureBlog
+
+
+class FixtureServer:
+    """
+    Serves a `FixtureBlog` over HTTP on localhost, in a background thread.
+
+    Every response is delayed by `latency` seconds to stand in for a real
+    server's round trip, and a `throttle` fraction of page and API requests
+    (chosen by a seeded random source) is answered with 429 and a
+    Retry-After of `retry_after` seconds instead, to exercise the retry and
+    rate limiting paths. Images are never throttled, since image downloads
+    are not retried. `stats` counts what was served since the last
+    `reset_stats`.
+    """
+
+    def __init__(self, blog: FixtureBlog, latency: float = 0.0, throttle: float = 0.0,
+                 retry_after: float = 0.1, seed: int = 0):
+        """
+        Args:
+            blog: The fixture to serve
+            latency: Seconds added to every response
+            throttle: Fraction of page and API requests answered with 429 (0 to 1)
+            retry_after: Retry-After of the 429 responses, in seconds
+            seed: Seed choosing which requests are throttled
+        """
+        self.blog = blog
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        self.reset_stats()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> 'FixtureServer':
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                fixture._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {'requests': 0, 'throttled': 0, 'not_found': 0, 'bytes': 0}
+
+    def _handle(self, request: BaseHTTPRequestHandler):
+        if self.latency:
+            time.sleep(self.latency)
+        parts = urlsplit(request.path)
+        with self._lock:
+            self.stats['requests'] += 1
+            throttled = (self.throttle > 0 and not parts.path.startswith('/images/')
+                         and self._random.random() < self.throttle)
+            if throttled:
+                self.stats['throttled'] += 1
+
+        if throttled:
+            self._send(request, 429, {'Retry-After': f'{self.retry_after:g}'}, b'')
+            return
+        response = self.blog.response(self.url, parts.path, parts.query)
+        if response is None:
+            with self._lock:
+                self.stats['not_found'] += 1
+            self._send(request, 404, {'Content-Type': 'text/plain'}, b'Not found')
+            return
+        status, headers, body = response
+        with self._lock:
+            self.stats['bytes'] += len(body)
+        self._send(request, status, headers, body)
+
+    @staticmethod
+    def _send(request: BaseHTTPRequestHandler, status: int, headers: Dict[str, str], body: bytes):
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
@@ -0,0 +1,208 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .server import FixtureServer
+
+# The command line, started by the startup benchmark
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+# Modules starting the command line must not import
+HEAVY_MODULES = ('weasyprint', 'PIL', 'bs4', 'requests')
+# Starts of every command line timed by the startup benchmark
+STARTUP_RUNS = 5
+
+# ru_maxrss is only available on Unix
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class BenchmarkOptions(NamedTuple):
+    """Settings of the code under test, the same knobs as main.py's options."""
+    workers: int = 4
+    image_workers: int = 8
+    rate: Optional[float] = None
+    render_processes: Optional[int] = None
+    chunk_size: int = 0
+    verbose: bool = False
+
+
+# (URL of the fixture server, its image URLs, options) -> (items done, unit)
+Benchmark = Callable[[str, List[str], BenchmarkOptions], Tuple[int, str]]
+
+
+def _scrape(scraper) -> Tuple[int, str]:
+    posts = sum(1 for post in scraper.get_posts() if post and post.get('content'))
+    return posts, 'posts'
+
+
+def bench_wordpress_rest(url: str, image_urls: List[str], options: BenchmarkOptions) -> Tuple[int, str]:
+    from scrapers.wordpress import WordPressScraper
+    return _scrape(WordPressScraper(url, workers=options.workers, requests_per_second=options.rate,
+                                    fetch_mode='api'))
+
+
+def bench_wordpress_html(url: str, image_urls: List[str], options: BenchmarkOptions) -> Tuple[int, str]:
+    from scrapers.wordpress import WordPressScraper
+    return _scrape(WordPressScraper(url, workers=options.workers, requests_per_second=options.rate,
+                                    fetch_mode='html'))
+
+
+def bench_substack_api(url: str, image_urls: List[str], options: BenchmarkOptions) -> Tuple[int, str]:
+    from scrapers.substack import SubstackScraper
+    return _scrape(SubstackScraper(url, workers=options.workers, requests_per_second=options.rate,
+                                   archive_workers=options.workers, fetch_mode='api'))
+
+
+def bench_substack_html(url: str, image_urls: List[str], options: BenchmarkOptions) -> Tuple[int, str]:
+    from scrapers.substack import SubstackScraper
+    return _scrape(SubstackScraper(url, workers=options.workers, requests_per_second=options.rate,
+                                   archive_workers=options.workers, fetch_mode='html'))
+
+
+def bench_images(url: str, image_urls: List[str], options: BenchmarkOptions) -> Tuple[int, str]:
+    from pdf_generator.image_optimizer import ImageOptimizer
+    with tempfile.TemporaryDirectory(prefix='bench-images-') as cache_dir:
+        optimizer = ImageOptimizer(output_dir=cache_dir, download_workers=options.image_workers)
+        try:
+            local_paths = optimizer.optimize_images(image_urls)
+            return sum(1 for path in local_paths.values() if path), 'images'
+        finally:
+            optimizer.close()
+            optimizer.http_client.close()
+
+
+def bench_pipeline(url: str, image_urls: List[str], options: BenchmarkOptions) -> Tuple[int, str]:
+    """The whole of main.py on the WordPress fixture: scrape, optimize, render both variants."""
+    import main
+    from scrapers.metrics import metrics
+    with tempfile.TemporaryDirectory(prefix='bench-pipeline-') as work_dir:
+        args = ['--url', url, '--type', 'wordpress', '--title', 'Fixture Blog', '--author', 'Benchmark',
+                '--workers', str(options.workers), '--image-workers', str(options.image_workers),
+                '--chunk-size', str(options.chunk_size), '--no-cache',
+                '--image-cache-dir', os.path.join(work_dir, 'images'),
+                '--checkpoint-dir', os.path.join(work_dir, 'checkpoints')]
+        if options.rate:
+            args += ['--rate', str(options.rate)]
+        if options.render_processes:
+            args += ['--render-processes', str(options.render_processes)]
+        # main.py writes the PDFs under ./output
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            main.main(args=args, standalone_mode=False)
+        finally:
+            os.chdir(cwd)
+    return int(metrics.report()['stages'].get('scrape', {}).get('posts', 0)), 'posts'
+
+
+def bench_startup(url: str, image_urls: List[str], options: BenchmarkOptions) -> Tuple[int, str]:
+    """
+    Start main.py for the --help of every command, as often as batch
+    wrappers start it for short runs; fails if importing it loads a heavy module.
+    """
+    from scrapers.metrics import metrics
+    check = f"import sys, main; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, '-c', check], cwd=os.path.dirname(MAIN), check=True,
+                            capture_output=True, text=True).stdout.split()
+    if loaded:
+        raise RuntimeError(f"importing main loads {', '.join(loaded)}")
+
+    runs = 0
+    for command in ([], ['all'], ['scrape'], ['optimize'], ['render']):
+        with metrics.timer('seconds', stage=' '.join(command) or 'help'):
+            for _ in range(STARTUP_RUNS):
+                subprocess.run([sys.executable, MAIN, *command, '--help'], check=True, stdout=subprocess.DEVNULL)
+                runs += 1
+    return runs, 'starts'
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    'wordpress-rest': bench_wordpress_rest,
+    'wordpress-html': bench_wordpress_html,
+    'substack-api': bench_substack_api,
+    'substack-html': bench_substack_html,
+    'images': bench_images,
+    'pipeline': bench_pipeline,
+    'startup': bench_startup,
+}
+
+
+def _peak_rss_mb(children: bool = False) -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _run_in_child(name: str, url: str, image_urls: List[str], options: BenchmarkOptions) -> Dict[str, Any]:
+    """Run one benchmark in a fresh process, so its imports, memory and metrics are its own."""
+    from scrapers.metrics import metrics
+    output = None if options.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output or sys.stdout):
+        start = time.perf_counter()
+        items, unit = BENCHMARKS[name](url, image_urls, options)
+        seconds = time.perf_counter() - start
+    report = metrics.report()
+    return {
+        'items': items,
+        'unit': unit,
+        'seconds': seconds,
+        'peak_rss_mb': _peak_rss_mb(),
+        # The largest of the pools' processes (image encoders, layout)
+        'peak_child_rss_mb': _peak_rss_mb(children=True),
+        'retries': sum(host.get('retries', 0) for host in report['hosts'].values()),
+        'stages': {stage: values.get('seconds', 0) for stage, values in report['stages'].items()},
+    }
+
+
+def run_benchmark(name: str, server: FixtureServer, options: BenchmarkOptions) -> Dict[str, Any]:
+    """
+    Run benchmark `name` against `server` and return its measurements.
+
+    The benchmark runs in a spawned process while the server keeps
+    answering from this one, so the two don't compete for the GIL. Failures
+    are returned as {'error': ...} so one broken benchmark doesn't stop the
+    others.
+    """
+    server.reset_stats()
+    image_urls = server.blog.image_urls(server.url)
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        try:
+            result = executor.submit(_run_in_child, name, server.url, image_urls, options).result()
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}"}
+    result.update(server.stats)
+    result['throughput'] = result['items'] / result['seconds'] if result['seconds'] else 0.0
+    expected = {'images': len(image_urls), 'posts': len(server.blog.posts)}.get(result['unit'])
+    if expected is not None and result['items'] != expected:
+        result['error'] = f"expected {expected} {result['unit']}, got {result['items']}"
+    return result
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float) -> List[Tuple[str, float, bool]]:
+    """
+    Compare the wall time of every benchmark with a baseline run.
+
+    Returns (name, relative change, regressed) for the benchmarks both runs
+    completed; a benchmark regressed when it got slower by more than
+    `threshold` (e.g. 0.1 for 10%).
+    """
+    changes = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or 'error' in result or 'error' in before or not before.get('seconds'):
+            continue
+        change = result['seconds'] / before['seconds'] - 1
+        changes.append((name, change, change > threshold))
+    return changes
@@ -1,151 +1,314 @@
-import click
-from scrapers.wordpress import WordPressScraper
-from scrapers.substack import SubstackScraper
-from pdf_generator.generator import PDFGenerator
-from pdf_generator.image_optimizer import ImageOptimizer
-from bs4 import BeautifulSoup
+"""
+Scrape a blog and turn it into PDFs.
+
+    python main.py [all] --url URL --type TYPE [OPTIONS]
+
+`all` (the default command) runs every stage in one go. The stages can also
+run on their own, each picking up where the previous one left off:
+
+    python main.py scrape --url URL --type TYPE   # new posts into the post store
+    python main.py optimize --url URL             # images and posts into the work directory
+    python main.py render --url URL               # PDFs from the work directory
+
+WeasyPrint, Pillow, BeautifulSoup and the HTTP stack are only imported by
+the stages that use them, so --help, bad options and scrape-only runs start
+quickly.
+"""
 import os
-import hashlib
-import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import click
 from dotenv import load_dotenv
 
+from scrapers.crawl_journal import CrawlJournal
+from scrapers.metrics import metrics
+from scrapers.post_store import PostStore, blog_dir_name
+from pdf_generator.image_profiles import DEFAULT_PROFILE, PROFILES
+from pipeline import (VARIANTS, Blog, incomplete_crawl, load_spooled, make_scraper, render_jobs, save_spooled,
+                      scraped_posts, spool_blog)
+
 # Load environment variables from .env file
 load_dotenv()
 
 
-@click.command()
-@click.option('--url', prompt='Blog URL', help='The URL of the blog to scrape.')
-@click.option('--type', prompt='Blog Type (wordpress/substack)', type=click.Choice(['wordpress', 'substack'], case_sensitive=False), help='The type of the blog.')
-@click.option('--image', help='Path to a custom image for the frontispiece.', default=None)
-@click.option('--title', help='Custom title for the PDF.', default=None)
-@click.option('--author', help='Custom author for the PDF.', default=None)
-def main(url, type, image, title, author):
-    """Scrape a blog and generate a PDF."""
-    click.echo(f"Scraping {url} as {type}...")
-    
-    if type == 'wordpress':
-        scraper = WordPressScraper(url)
-    else:
-        # For Substack, check for authentication credentials in environment
-        session_cookies = {}
-        substack_sid = os.getenv('SUBSTACK_SID')
-        substack_lli = os.getenv('SUBSTACK_LLI')
-        
-        if substack_sid and substack_lli:
-            session_cookies = {
-                'substack.sid': substack_sid,
-                'substack.lli': substack_lli
-            }
-        
-        scraper = SubstackScraper(url, session_cookies=session_cookies)
-
-    
-    posts = list(scraper.get_posts())
-    posts = [p for p in posts if p and p.get('content')] # Filter empty posts and ensure content exists
-    posts.reverse() # Make chronological (Oldest -> Newest)
-    click.echo(f"Found {len(posts)} valid posts.")
-    
-    # Create output directory
-    output_dir = "output"
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Determine blog title if not provided
-    blog_title = title if title else (posts[0]['title'] if posts else "Blog Posts")
-    
-    # Determine author for filename
-    pdf_author = author if author else "Unknown"
-    
-    # Sanitize title and author for filename
-    def sanitize_filename(text):
-        # Remove or replace characters that are invalid in filenames
-        text = re.sub(r'[<>:"/\\|?*]', '', text)
-        # Replace spaces with underscores
-        text = text.replace(' ', '_')
-        # Remove multiple underscores
-        text = re.sub(r'_+', '_', text)
-        # Trim underscores from start/end
-        text = text.strip('_')
-        # Limit length to avoid filesystem issues
-        return text[:100]
-    
-    safe_title = sanitize_filename(blog_title)
-    safe_author = sanitize_filename(pdf_author)
-    
-    # Get first image from any post for frontispiece if available
-    front_image = image
-    if not front_image and posts:
-        for post in posts:
-            # Simple check for img tag in post content
-            content = post.get('content')
-            if content:
-                soup = BeautifulSoup(content, 'html.parser')
-                img = soup.find('img')
-                if img:
-                    front_image = img.get('src')
-                    break
-    
-    # --- Generate Optimized PDF (with images) ---
-    click.echo("Optimizing images for PDF...")
-    optimizer = ImageOptimizer()
-    optimized_posts = []
-    for post in posts:
-        # Create a copy to avoid modifying original for text-only version
-        post_copy = post.copy()
-        if post_copy.get('content'):
-            post_copy['content'] = optimizer.optimize_html_content(post_copy['content'], url)
-        optimized_posts.append(post_copy)
-        
-    # Optimize front image if it's a URL
-    optimized_front_image = front_image
-    if front_image and front_image.startswith('http'):
-        # We can reuse the optimizer's download logic manually or just let it be if it's just one image
-        # But for consistency, let's optimize it too.
+URL_OPTION = click.option('--url', prompt='Blog URL', help='The URL of the blog to scrape.')
+TYPE_OPTION = click.option('--type', prompt='Blog Type (wordpress/substack)', type=click.Choice(['wordpress', 'substack'], case_sensitive=False), help='The type of the blog.')
+SCRAPE_OPTIONS = (
+    click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True, help='Number of posts fetched concurrently.'),
+    click.option('--rate', type=click.FloatRange(min=0, min_open=True), default=None, help='Initial requests per second, shared by all workers (Substack defaults to 0.5, WordPress is unlimited until throttled).'),
+    click.option('--max-rate', type=click.FloatRange(min=0, min_open=True), default=None, help='Requests per second the rate may ramp up to while the server responds normally (Substack defaults to 4x --rate).'),
+    click.option('--max-retries', type=click.IntRange(min=0), default=4, show_default=True, help='Retries of a throttled or failed request, with exponential backoff or the server\'s Retry-After.'),
+    click.option('--index-lookahead', type=click.IntRange(min=1), default=2, show_default=True, help='WordPress: index pages fetched ahead of the post workers.'),
+    click.option('--archive-page-size', type=click.IntRange(min=1), default=50, show_default=True, help='Substack: posts requested per archive API page.'),
+    click.option('--archive-workers', type=click.IntRange(min=1), default=1, show_default=True, help='Substack: archive pages fetched concurrently, ahead of the post workers.'),
+    click.option('--fetch', 'fetch_mode', type=click.Choice(['api', 'html']), default='api', show_default=True, help='Read posts from the blog\'s JSON API (Substack posts API, WordPress REST API), scraping HTML pages only as a fallback, or always scrape the HTML pages.'),
+    click.option('--rest-url', default=None, help='WordPress: root of the REST API, when the blog\'s pages don\'t link to it (e.g. https://example.com/blog/wp-json/).'),
+)
+HTTP_OPTIONS = (
+    click.option('--timeout', type=click.FloatRange(min=0, min_open=True), default=60, show_default=True, help='Seconds to wait for a server to respond.'),
+    click.option('--http2', is_flag=True, help='Use HTTP/2 connections (needs the http2 extra: httpx[http2]).'),
+    click.option('--cache-dir', default='.http_cache', show_default=True, help='Directory of the on-disk HTTP cache.'),
+    click.option('--cache-size', type=click.IntRange(min=1), default=1024, show_default=True, help='HTTP cache size cap in MB (least recently used entries are evicted).'),
+    click.option('--no-cache', is_flag=True, help='Disable the HTTP cache.'),
+    click.option('--offline', is_flag=True, help='Serve every request from the HTTP cache and never touch the network.'),
+)
+IMAGE_OPTIONS = (
+    click.option('--image', help='Path to a custom image for the frontispiece.', default=None),
+    click.option('--image-workers', type=click.IntRange(min=1), default=8, show_default=True, help='Number of images downloaded concurrently.'),
+    click.option('--image-cache-dir', default='.image_cache', show_default=True, help='Directory of the persistent optimized image cache.'),
+    click.option('--image-cache-size', type=click.IntRange(min=1), default=2048, show_default=True, help='Optimized image cache size cap in MB (least recently used images are evicted).'),
+    click.option('--max-image-size', type=click.IntRange(min=0), default=20, show_default=True, help='Skip images larger than this many MB (0 = no limit).'),
+    click.option('--image-dedup', is_flag=True, help='Also share one optimized image between images that look the same (same aspect ratio, close perceptual hash and matching pixels).'),
+    click.option('--variant', 'variants', multiple=True, type=click.Choice(VARIANTS), default=VARIANTS, show_default=True, help='PDF variant to produce; repeat for several.'),
+    click.option('--image-profile', 'image_profiles', multiple=True, type=click.Choice(list(PROFILES)), default=(DEFAULT_PROFILE,), show_default=True, help='Image profile of the images PDF (screen, print, low-dpi, ereader); repeat for one PDF per profile.'),
+)
+STORE_DIR_OPTION = click.option('--store-dir', default='.post_store', show_default=True, help='Directory of the local post stores.')
+RESUME_OPTIONS = (
+    click.option('--resume', is_flag=True, help='Continue an interrupted run from its checkpoint, retrying only the posts that failed.'),
+    click.option('--checkpoint-dir', default='.checkpoints', show_default=True, help='Directory of the crawl checkpoints used by --resume.'),
+)
+WORK_DIR_OPTION = click.option('--work-dir', default='.work', show_default=True, help='Directory the optimize command leaves the posts of each blog in for the render command.')
+RENDER_OPTIONS = (
+    click.option('--title', help='Custom title for the PDF.', default=None),
+    click.option('--author', help='Custom author for the PDF.', default=None),
+    click.option('--chunk-size', type=click.IntRange(min=0), default=0, show_default=True, help='Render the PDFs in chunks of this many posts and merge them (0 renders one document).'),
+    click.option('--chunk-by-year', is_flag=True, help='Start a new render chunk for every publication year.'),
+    click.option('--fragment-cache-dir', default=None, help='Cache each rendered post in this directory and only lay out new or changed posts (renders in chunks).'),
+    click.option('--render-processes', type=click.IntRange(min=1), default=None, help='Processes used for PDF layout (defaults to one per variant, or the CPU count when rendering in chunks).'),
+)
+REPORT_OPTIONS = (
+    click.option('--report', 'report_file', default=None, help='Write per-stage, per-host and per-post metrics to this file (.json or .csv).'),
+    click.option('--profile', 'profile_dir', default=None, help='Profile every stage with cProfile and write <stage>.prof files to this directory.'),
+)
+
+
+def _options(*options):
+    """Apply click options, listed in the order --help shows them."""
+    def decorator(f):
+        for option in reversed(options):
+            f = option(f)
+        return f
+    return decorator
+
+
+class _DefaultGroup(click.Group):
+    """Runs `all` when no command is named, so `main.py --url ...` keeps working."""
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args = ['all', *args]
+        return super().parse_args(ctx, args)
+
+    def list_commands(self, ctx):
+        # In the order the stages run
+        return list(self.commands)
+
+
+@click.group(cls=_DefaultGroup)
+def main():
+    """Scrape a blog and generate PDFs, in one go (all) or one stage at a time (scrape, optimize, render)."""
+
+
+@main.command('all')
+@_options(URL_OPTION, TYPE_OPTION, *RENDER_OPTIONS[:2], *SCRAPE_OPTIONS, *HTTP_OPTIONS, *IMAGE_OPTIONS,
+          click.option('--incremental', is_flag=True, help='Only fetch posts newer than the last run and build the PDF from the local post store.'),
+          STORE_DIR_OPTION, *RESUME_OPTIONS, *RENDER_OPTIONS[2:], *REPORT_OPTIONS)
+def run_all(url, type, image, title, author, workers, rate, max_rate, max_retries, index_lookahead, archive_page_size, archive_workers, fetch_mode, rest_url, timeout, http2, cache_dir, cache_size, no_cache, offline,
+            image_workers, image_cache_dir, image_cache_size, max_image_size, image_dedup, incremental, store_dir, resume, checkpoint_dir, chunk_size, chunk_by_year,
+            variants, image_profiles, fragment_cache_dir, render_processes, report_file, profile_dir):
+    """Scrape a blog and generate its PDFs (the default command)."""
+    with _reporting(report_file, profile_dir):
+        http_cache, http_client = _http(cache_dir, cache_size, no_cache, offline, timeout, http2,
+                                        pool_size=max(workers + 1, image_workers))
+        post_store = PostStore.for_blog(store_dir, url) if incremental else None
+        journal = _journal(checkpoint_dir, url, resume)
+        optimizer = None
         try:
-            # Hacky way to use the internal method, or we could expose it.
-            # Let's just use the optimizer instance
-            import hashlib
-            hash_name = hashlib.md5(front_image.encode()).hexdigest()
-            local_path = os.path.join(optimizer.output_dir, f"front_{hash_name}.jpg")
-            if not os.path.exists(local_path):
-                optimizer._download_and_optimize(front_image, local_path)
-            optimized_front_image = f"file://{os.path.abspath(local_path)}"
-        except Exception as e:
-            print(f"Failed to optimize front image: {e}")
-
-    images_pdf = os.path.join(output_dir, f"{safe_title}_{safe_author}_with_images.pdf")
-    generator = PDFGenerator(images_pdf)
-    generator.generate(optimized_posts, blog_title, optimized_front_image, author)
-    click.echo(f"Generated {images_pdf}")
-
-    # --- Generate Text-Only PDF ---
-    click.echo("Generating text-only PDF...")
-    text_only_posts = []
-    for post in posts:
-        post_copy = post.copy()
-        if post_copy.get('content'):
-            # Remove images
-            soup = BeautifulSoup(post_copy['content'], 'html.parser')
-            for img in soup.find_all('img'):
-                img.decompose()
-            for figure in soup.find_all('figure'): # Also remove figures if they contain images
-                figure.decompose()
-            post_copy['content'] = str(soup)
-        text_only_posts.append(post_copy)
-    
-    # For text-only, we might still want the frontispiece? 
-    # User said "one with images and one without". Usually text-only implies NO images at all.
-    # But maybe the cover is okay? Let's assume NO images for strict text-only.
-    
-    text_only_pdf = os.path.join(output_dir, f"{safe_title}_{safe_author}_without_images.pdf")
-    generator = PDFGenerator(text_only_pdf)
-    generator.generate(text_only_posts, blog_title, None, author) # No front image
-    click.echo(f"Generated {text_only_pdf}")
-    
-    # Clean up temporary optimized images
-    import shutil
-    if os.path.exists(optimizer.output_dir):
-        shutil.rmtree(optimizer.output_dir)
-        click.echo("Cleaned up temporary optimized images.")
+            click.echo(f"Scraping {url} as {type}...")
+            blog = Blog(url, type, title, author, image, tuple(variants), tuple(dict.fromkeys(image_profiles)))
+            scraper = make_scraper(url, type, workers, rate, max_rate, max_retries, index_lookahead, archive_page_size,
+                                   archive_workers, fetch_mode, http_cache, post_store, http_client, journal,
+                                   rest_url=rest_url)
+            with metrics.stage('scrape'):
+                posts = scraped_posts(scraper, post_store)
+
+            if 'images' in variants:
+                optimizer = _image_optimizer(http_cache, http_client, image_workers, image_cache_dir, image_cache_size,
+                                             max_image_size, image_dedup)
+            with tempfile.TemporaryDirectory(prefix='blogscraper-') as spool_dir:
+                if optimizer:
+                    click.echo("Optimizing images for PDF...")
+                spooled = spool_blog(blog, posts, optimizer, spool_dir)
+                click.echo(f"Found {spooled.post_count} valid posts.")
+                _echo_cleaning_hits(scraper)
+                incomplete = incomplete_crawl(scraper)
+                if optimizer:
+                    # Optimized images are kept in a persistent cache and reused by the next run
+                    optimizer.close()
+                    optimizer = None
+
+                _generate(blog, spooled, chunk_size, chunk_by_year, fragment_cache_dir, render_processes)
+            _finish_journal(journal, incomplete)
+        finally:
+            if optimizer:
+                optimizer.close()
+            journal.close()
+            _close_http(http_cache, http_client)
+    if incomplete:
+        raise SystemExit(1)
+
+
+@main.command()
+@_options(URL_OPTION, TYPE_OPTION, *SCRAPE_OPTIONS, *HTTP_OPTIONS, STORE_DIR_OPTION, *RESUME_OPTIONS, *REPORT_OPTIONS)
+def scrape(url, type, workers, rate, max_rate, max_retries, index_lookahead, archive_page_size, archive_workers, fetch_mode, rest_url,
+           timeout, http2, cache_dir, cache_size, no_cache, offline, store_dir, resume, checkpoint_dir, report_file, profile_dir):
+    """Fetch the posts newer than the stored ones into the local post store."""
+    with _reporting(report_file, profile_dir):
+        http_cache, http_client = _http(cache_dir, cache_size, no_cache, offline, timeout, http2, pool_size=workers + 1)
+        post_store = PostStore.for_blog(store_dir, url)
+        journal = _journal(checkpoint_dir, url, resume)
+        try:
+            click.echo(f"Scraping {url} as {type}...")
+            scraper = make_scraper(url, type, workers, rate, max_rate, max_retries, index_lookahead, archive_page_size,
+                                   archive_workers, fetch_mode, http_cache, post_store, http_client, journal,
+                                   rest_url=rest_url)
+            with metrics.stage('scrape'):
+                scraped_posts(scraper, post_store)
+            _echo_cleaning_hits(scraper)
+            incomplete = incomplete_crawl(scraper)
+            _finish_journal(journal, incomplete)
+        finally:
+            journal.close()
+            _close_http(http_cache, http_client)
+    if incomplete:
+        raise SystemExit(1)
+
+
+@main.command()
+@_options(URL_OPTION, *IMAGE_OPTIONS, *HTTP_OPTIONS, STORE_DIR_OPTION, WORK_DIR_OPTION, *REPORT_OPTIONS)
+def optimize(url, image, image_workers, image_cache_dir, image_cache_size, max_image_size, image_dedup, variants,
+             image_profiles, timeout, http2, cache_dir, cache_size, no_cache, offline, store_dir, work_dir, report_file,
+             profile_dir):
+    """Optimize the images of the stored posts and leave the posts of each PDF in the work directory."""
+    post_store = PostStore.for_blog(store_dir, url)
+    if not len(post_store):
+        raise click.ClickException(f"No stored posts for {url}; run the scrape command first.")
+    blog = Blog(url, None, image=image, variants=tuple(variants), image_profiles=tuple(dict.fromkeys(image_profiles)))
+    blog_work_dir = os.path.join(work_dir, blog_dir_name(url))
+    shutil.rmtree(blog_work_dir, ignore_errors=True)
+    os.makedirs(blog_work_dir)
+
+    with _reporting(report_file, profile_dir):
+        http_cache, http_client = _http(cache_dir, cache_size, no_cache, offline, timeout, http2, pool_size=image_workers)
+        optimizer = None
+        try:
+            if 'images' in variants:
+                optimizer = _image_optimizer(http_cache, http_client, image_workers, image_cache_dir, image_cache_size,
+                                             max_image_size, image_dedup)
+                click.echo("Optimizing images for PDF...")
+            spooled = spool_blog(blog, post_store.posts(), optimizer, blog_work_dir)
+            save_spooled(spooled, blog_work_dir)
+            click.echo(f"Prepared {spooled.post_count} posts in {blog_work_dir}.")
+        finally:
+            if optimizer:
+                optimizer.close()
+            _close_http(http_cache, http_client)
+
+
+@main.command()
+@_options(URL_OPTION, *RENDER_OPTIONS, WORK_DIR_OPTION, *REPORT_OPTIONS)
+def render(url, title, author, chunk_size, chunk_by_year, fragment_cache_dir, render_processes, work_dir, report_file,
+           profile_dir):
+    """Generate the PDFs from the posts the optimize command left in the work directory."""
+    try:
+        spooled = load_spooled(os.path.join(work_dir, blog_dir_name(url)))
+    except FileNotFoundError:
+        raise click.ClickException(f"Nothing to render for {url}; run the optimize command first.")
+    with _reporting(report_file, profile_dir):
+        _generate(Blog(url, None, title, author), spooled, chunk_size, chunk_by_year, fragment_cache_dir,
+                  render_processes)
+
+
+@contextmanager
+def _reporting(report_file, profile_dir):
+    """Profile the stages if asked to, and write the metrics and profiles at the end."""
+    if profile_dir:
+        metrics.enable_profiling(profile_dir)
+    try:
+        yield
+    finally:
+        # Written even when the run failed, since that is often when it is wanted
+        if report_file:
+            metrics.write_report(report_file)
+            click.echo(f"Wrote metrics to {report_file}")
+        if profile_dir:
+            metrics.write_profiles()
+            click.echo(f"Wrote profiles to {profile_dir}")
+
+
+def _http(cache_dir, cache_size, no_cache, offline, timeout, http2, pool_size):
+    """The HTTP cache (None with --no-cache) and the client of a command."""
+    from scrapers.http_cache import HTTPCache
+    from scrapers.http_client import HTTPClient
+
+    if no_cache and offline:
+        raise click.UsageError("--offline needs the HTTP cache; drop --no-cache.")
+    http_cache = None if no_cache else HTTPCache(cache_dir, max_bytes=cache_size * 1024 * 1024, offline=offline)
+    # One pool of keep-alive connections per host, shared by the scraper and the image downloads
+    http_client = HTTPClient(pool_maxsize=pool_size, timeout=(10, timeout), http2=http2)
+    return http_cache, http_client
+
+
+def _close_http(http_cache, http_client):
+    http_client.close()
+    if http_cache:
+        http_cache.close()
+
+
+def _journal(checkpoint_dir, url, resume) -> CrawlJournal:
+    # Every crawl is checkpointed, so an interrupted run can be resumed
+    journal = CrawlJournal.for_blog(checkpoint_dir, url, resume=resume)
+    if resume and not len(journal):
+        click.echo("No checkpoint to resume from, starting from scratch.")
+    return journal
+
+
+def _finish_journal(journal, incomplete):
+    """Delete the journal of a completed crawl; keep it for --resume otherwise."""
+    if incomplete:
+        click.echo(f"Kept the checkpoint: {incomplete}.")
+    else:
+        journal.remove()
+
+
+def _image_optimizer(http_cache, http_client, image_workers, image_cache_dir, image_cache_size, max_image_size,
+                     image_dedup):
+    from pdf_generator.image_optimizer import ImageOptimizer
+
+    return ImageOptimizer(output_dir=image_cache_dir, http_cache=http_cache,
+                          download_workers=image_workers, cache_size=image_cache_size * 1024 * 1024,
+                          http_client=http_client, max_image_bytes=max_image_size * 1024 * 1024 or None,
+                          dedup_distance=ImageOptimizer.DEDUP_DISTANCE if image_dedup else None)
+
+
+def _echo_cleaning_hits(scraper):
+    hits = ', '.join(f"{name} {count}" for name, count in scraper.cleaner.hits.items())
+    click.echo(f"Cleaning rule hits: {hits}")
+
+
+def _generate(blog, spooled, chunk_size, chunk_by_year, fragment_cache_dir, render_processes):
+    from pdf_generator.generator import PDFGenerator
+
+    jobs = render_jobs(blog, spooled, chunk_size, chunk_by_year, fragment_cache_dir)
+    # The variants (and chunks, if any) are independent, so they are laid out in parallel processes
+    click.echo(f"Generating {len(jobs)} PDF(s)...")
+    with metrics.stage('render'):
+        output_files = PDFGenerator.run_jobs(jobs, processes=render_processes)
+    for output_file in output_files:
+        click.echo(f"Generated {output_file}")
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class FileCache:
+    """
+    Persistent, content-addressed store of generated files.
+
+    An `index.json` records every file with its size, last access time and
+    any metadata given to `add`: lookups never touch the file system, and the
+    total size is kept under a disk budget by evicting the least recently
+    used files. Files used during the current run are never evicted.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_use = set()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._total = sum(entry['size'] for entry in self._index.values())
+
+    @staticmethod
+    def key(source: str, **params) -> str:
+        """Cache key for a file generated from `source` with `params`."""
+        parts = [source] + [f"{name}={params[name]}" for name in sorted(params)]
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Return the path of a cached file, or None."""
+        with self._lock:
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            entry['accessed'] = time.time()
+            self._in_use.add(key)
+            return os.path.join(self.cache_dir, entry['file'])
+
+    def metadata(self, key: str) -> Dict[str, Any]:
+        """Return the metadata stored with `key` by `add`."""
+        with self._lock:
+            return dict(self._index[key].get('metadata', {}))
+
+    def path_for(self, key: str, extension: str) -> str:
+        """Where a new file for `key` should be written before calling `add`."""
+        return os.path.join(self.cache_dir, f"{key}.{extension}")
+
+    def add(self, key: str, path: str, **metadata):
+        """Register a file written to `path` (from `path_for`)."""
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._index:
+                self._total -= self._index[key]['size']
+            self._index[key] = {
+                'file': os.path.basename(path),
+                'metadata': metadata,
+                'size': size,
+                'accessed': time.time(),
+            }
+            self._total += size
+            self._in_use.add(key)
+            self._evict()
+
+    def close(self):
+        """Write the index to disk."""
+        with self._lock:
+            path = os.path.join(self.cache_dir, self.INDEX_FILE)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self._index, f)
+            os.replace(path + '.tmp', path)
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k]['accessed']):
+            if self._total <= self.max_bytes:
+                break
+            if key in self._in_use:
+                continue
+            entry = self._index.pop(key)
+            self._total -= entry['size']
+            try:
+                os.remove(os.path.join(self.cache_dir, entry['file']))
+            except FileNotFoundError:
+                pass
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+class ImageCache(FileCache):
+    """
+    Optimized images, keyed by source URL plus the optimization parameters,
+    so changing e.g. the width or quality produces new entries instead of
+    reusing stale ones.
+    """
+
+    def __init__(self, cache_dir: str = '.image_cache', max_bytes: int = 2 * 1024 * 1024 * 1024):
+        super().__init__(cache_dir, max_bytes)
+
+
+class FragmentCache(FileCache):
+    """
+    One rendered PDF per post, keyed by the post's rendered HTML (which
+    embeds the template and its CSS), so unchanged posts skip layout.
+    """
+
+    def __init__(self, cache_dir: str = '.fragment_cache', max_bytes: int = 1024 * 1024 * 1024):
+        super().__init__(cache_dir, max_bytes)
@@ -1,18 +1,280 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, NamedTuple, Tuple
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+import weasyprint
 from weasyprint import HTML
 from jinja2 import Environment, FileSystemLoader
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Link
 import os
+import tempfile
+from scrapers.metrics import metrics
+from .file_cache import FragmentCache
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# WeasyPrint measures pages in CSS pixels, PDF in points
+PX_TO_PT = 0.75
+
+class RenderJob(NamedTuple):
+    """One PDF to render. `posts` must be picklable to run in a process pool (e.g. a closed PostSpool)."""
+    output_file: str
+    posts: Iterable[Dict[str, Any]]
+    blog_title: str
+    front_image: Optional[str] = None
+    author: Optional[str] = None
+    chunk_size: int = 0
+    split_by_year: bool = False
+    fragment_cache_dir: Optional[str] = None
+
+    @property
+    def chunked(self) -> bool:
+        return bool(self.chunk_size or self.split_by_year or self.fragment_cache_dir)
+
+
+def run_render_job(job: RenderJob, executor: Optional[Executor] = None, processes: int = 1,
+                   fragment_cache: Optional[FragmentCache] = None) -> str:
+    """Render one job; module-level so it can run in a process pool."""
+    generator = PDFGenerator(job.output_file)
+    if job.chunked:
+        generator.generate_chunked(job.posts, job.blog_title, job.front_image, job.author,
+                                   chunk_size=job.chunk_size, split_by_year=job.split_by_year,
+                                   processes=processes, executor=executor, fragment_cache=fragment_cache)
+    else:
+        generator.generate(list(job.posts), job.blog_title, job.front_image, job.author)
+    return job.output_file
+
+
+def render_chunk(html_content: str, output_file: str) -> Tuple[int, Dict[int, int]]:
+    """
+    Lay out one chunk of posts and write it to `output_file`.
+
+    Module-level so it can run in a process pool. Returns the number of
+    pages and, for every post number, the chunk page it starts on.
+    """
+    document = HTML(string=html_content).render()
+    post_pages = {}
+    for page_index, page in enumerate(document.pages):
+        for anchor in page.anchors:
+            if anchor.startswith('post-'):
+                post_pages.setdefault(int(anchor[len('post-'):]), page_index)
+    document.write_pdf(output_file)
+    return len(document.pages), post_pages
+
 
 class PDFGenerator:
     def __init__(self, output_file: str):
         self.output_file = output_file
-        self.env = Environment(loader=FileSystemLoader('pdf_generator/templates'))
+        self.env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+
+    @staticmethod
+    def run_jobs(jobs: List[RenderJob], processes: Optional[int] = None) -> List[str]:
+        """
+        Render independent jobs (e.g. the with-images and text-only PDFs) in
+        parallel processes, since each WeasyPrint layout is single-threaded.
+
+        Chunked jobs are driven from threads instead, and all of them share
+        one pool of `processes` layout processes (and one fragment cache
+        per cache directory).
+        Returns the output files in job order.
+        """
+        if any(job.chunked for job in jobs):
+            processes = processes or os.cpu_count() or 1
+            fragment_caches = {job.fragment_cache_dir: FragmentCache(job.fragment_cache_dir)
+                               for job in jobs if job.fragment_cache_dir}
+            try:
+                with ProcessPoolExecutor(max_workers=processes) as layout, \
+                        ThreadPoolExecutor(max_workers=len(jobs)) as drivers:
+                    futures = [drivers.submit(run_render_job, job, layout, processes,
+                                              fragment_caches.get(job.fragment_cache_dir))
+                               for job in jobs]
+                    return [future.result() for future in futures]
+            finally:
+                for fragment_cache in fragment_caches.values():
+                    fragment_cache.close()
+
+        processes = min(processes or len(jobs), len(jobs))
+        if processes <= 1:
+            return [run_render_job(job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(run_render_job, jobs))
 
     def generate(self, posts: List[Dict[str, Any]], blog_title: str, front_image: str = None, author: str = None):
         template = self.env.get_template('base.html')
         html_content = template.render(posts=posts, blog_title=blog_title, front_image=front_image, author=author)
-        
+
         print(f"Generating PDF to {self.output_file}...")
         HTML(string=html_content).write_pdf(self.output_file)
         print("PDF generation complete.")
 
+    def generate_chunked(self, posts: Iterable[Dict[str, Any]], blog_title: str, front_image: str = None,
+                         author: str = None, chunk_size: int = 50, split_by_year: bool = False,
+                         processes: int = 1, executor: Optional[Executor] = None,
+                         fragment_cache: Optional[FragmentCache] = None):
+        """
+        Render the posts in chunks and merge them into one PDF.
+
+        Chunks are laid out independently, in up to `processes` processes (or
+        on `executor`), with at most two chunks per process in flight so
+        memory stays flat however large the blog is. Chunks are rendered
+        without page numbers; once every chunk's page count is known, the
+        footers are stamped from a cheap overlay of numbered blank pages,
+        and the table of contents is rendered with the real page numbers.
+        Its links are re-created in the merged file.
+
+        With a `fragment_cache`, every post is its own chunk, cached by its
+        rendered HTML: unchanged posts reuse their PDF and skip layout.
+
+        `posts` is iterated twice (titles, then content), so it must be
+        re-iterable, e.g. a list or a PostSpool.
+        """
+        print(f"Generating PDF to {self.output_file} in chunks...")
+        template = self.env.get_template('base.html')
+        toc = [{'title': post['title']} for post in posts]
+
+        own_executor = None
+        if executor is None and processes > 1:
+            executor = own_executor = ProcessPoolExecutor(max_workers=processes)
+        try:
+            with tempfile.TemporaryDirectory(prefix='pdf-chunks-') as tmp_dir:
+                if fragment_cache:
+                    chunk_size, split_by_year = 1, False
+                chunk_files = []
+                results = []
+                pending = deque()
+                first_index = 1
+                for chunk in self._iter_chunks(posts, chunk_size, split_by_year):
+                    # Chunks are always rendered as if they started at post 1, so
+                    # their HTML doesn't depend on their position in the blog
+                    html_content = template.render(posts=chunk, body_only=True)
+                    key = None
+                    if fragment_cache:
+                        key = FragmentCache.key(html_content, weasyprint=weasyprint.__version__)
+                        chunk_file = fragment_cache.lookup(key)
+                        pages = fragment_cache.metadata(key).get('pages') if chunk_file else None
+                        if pages is not None:
+                            metrics.add('cached_fragments', stage='render')
+                            future = self._submit(None, lambda pages=pages: (pages, {1: 0}))
+                            key = None
+                        else:
+                            chunk_file = fragment_cache.path_for(key, 'pdf')
+                            future = self._submit(executor, render_chunk, html_content, chunk_file)
+                    else:
+                        chunk_file = os.path.join(tmp_dir, f"chunk_{len(chunk_files):05d}.pdf")
+                        future = self._submit(executor, render_chunk, html_content, chunk_file)
+                    chunk_files.append(chunk_file)
+                    pending.append((future, first_index, key, chunk_file))
+                    first_index += len(chunk)
+                    while len(pending) > 2 * processes:
+                        results.append(self._collect(pending.popleft(), fragment_cache))
+                        print(f"  Rendered chunk {len(results)}/{len(chunk_files)}")
+
+                # Lay out the front matter once to know how many pages it takes
+                placeholders = ['9999'] * len(toc)
+                front_pages = len(self._render_front(template, toc, placeholders, blog_title,
+                                                     front_image, author).pages)
+
+                while pending:
+                    results.append(self._collect(pending.popleft(), fragment_cache))
+                    print(f"  Rendered chunk {len(results)}/{len(chunk_files)}")
+
+                post_pages = {}
+                page_offset = front_pages
+                for page_count, chunk_post_pages in results:
+                    for number, page_index in chunk_post_pages.items():
+                        post_pages[number] = page_offset + page_index + 1
+                    page_offset += page_count
+                body_pages = page_offset - front_pages
+                metrics.add('chunks', len(chunk_files), stage='render')
+                metrics.add('pages', page_offset, stage='render')
+
+                toc_pages = [post_pages.get(number, '') for number in range(1, len(toc) + 1)]
+                front = self._render_front(template, toc, toc_pages, blog_title, front_image, author)
+                if len(front.pages) != front_pages:
+                    print("Warning: table of contents changed length, page numbers may be off.")
+                front_file = os.path.join(tmp_dir, 'front.pdf')
+                front.write_pdf(front_file)
+
+                numbers_file = None
+                if body_pages:
+                    numbers_file = os.path.join(tmp_dir, 'page_numbers.pdf')
+                    html_content = template.render(page_numbers=body_pages, first_page=front_pages + 1)
+                    HTML(string=html_content).write_pdf(numbers_file)
+
+                with metrics.timer('merge_seconds', stage='render'):
+                    self._merge(front, front_file, chunk_files, numbers_file, post_pages)
+        finally:
+            if own_executor:
+                own_executor.shutdown()
+        print("PDF generation complete.")
+
+    @staticmethod
+    def _collect(item: Tuple, fragment_cache: Optional[FragmentCache]) -> Tuple[int, Dict[int, int]]:
+        """Wait for a chunk and map its post numbers to the posts' real numbers."""
+        future, first_index, key, chunk_file = item
+        page_count, post_pages = future.result()
+        if key is not None:
+            fragment_cache.add(key, chunk_file, pages=page_count)
+        return page_count, {first_index + number - 1: page for number, page in post_pages.items()}
+
+    @staticmethod
+    def _submit(executor: Optional[Executor], fn, *args) -> Future:
+        if executor is not None:
+            return executor.submit(fn, *args)
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def _render_front(self, template, toc: List[Dict[str, Any]], toc_pages: List, blog_title: str,
+                      front_image: Optional[str], author: Optional[str]):
+        html_content = template.render(posts=toc, front_only=True, toc_pages=toc_pages, blog_title=blog_title,
+                                       front_image=front_image, author=author)
+        return HTML(string=html_content).render()
+
+    @staticmethod
+    def _iter_chunks(posts: Iterable[Dict[str, Any]], chunk_size: int,
+                     split_by_year: bool) -> Iterator[List[Dict[str, Any]]]:
+        chunk = []
+        year = None
+        for post in posts:
+            post_year = (post.get('published') or '')[:4]
+            if chunk and ((chunk_size and len(chunk) >= chunk_size) or (split_by_year and post_year != year)):
+                yield chunk
+                chunk = []
+            chunk.append(post)
+            year = post_year
+        if chunk:
+            yield chunk
+
+    def _merge(self, front, front_file: str, chunk_files: List[str], numbers_file: Optional[str],
+               post_pages: Dict[int, int]):
+        writer = PdfWriter()
+        writer.append(front_file)
+        front_pages = len(writer.pages)
+        for path in chunk_files:
+            writer.append(path)
+
+        # Stamp the page numbers onto the body pages
+        if numbers_file:
+            numbers = PdfReader(numbers_file)
+            for offset, number_page in enumerate(numbers.pages):
+                writer.pages[front_pages + offset].merge_page(number_page)
+
+        # The TOC links point to anchors in other files, so WeasyPrint could
+        # not resolve them; add them back as links to the merged pages.
+        for page_index, page in enumerate(front.pages):
+            page_height = page.height * PX_TO_PT
+            for link in page.links:
+                link_type, target, (x, y, width, height) = link[0], link[1], link[2]
+                if link_type != 'internal' or not target.startswith('post-'):
+                    continue
+                page_number = post_pages.get(int(target[len('post-'):]))
+                if page_number is None:
+                    continue
+                rect = (x * PX_TO_PT, page_height - (y + height) * PX_TO_PT,
+                        (x + width) * PX_TO_PT, page_height - y * PX_TO_PT)
+                writer.add_annotation(page_index, Link(rect=rect, target_page_index=page_number - 1))
+
+        with open(self.output_file, 'wb') as f:
+            writer.write(f)
+        writer.close()
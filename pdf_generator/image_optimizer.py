@@ -1,74 +1,438 @@
 import os
+import threading
+import time
 import requests
-from PIL import Image
 from io import BytesIO
-import hashlib
-from bs4 import BeautifulSoup
+from PIL import Image, ImageChops, ImageStat
 from urllib.parse import urljoin
+from typing import Optional, Iterable, Iterator, List, Dict, Any, NamedTuple, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from scrapers.http_cache import HTTPCache
+from scrapers.http_client import HTTPClient
+from scrapers.metrics import metrics
+from .file_cache import ImageCache
+from .image_profiles import DEFAULT_PROFILE, PROFILES, ImageProfile
+from .image_urls import canonical_image_url
+from .post_document import PostDocument
+
+
+# Side of the perceptual hash grid: HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+# Images whose grays vary less than this (blank, or a solid color) are never shared
+MIN_CONTRAST = 2.0
+# Two images with close hashes are only the same when, at the smaller one's size, their
+# pixels differ by at most this much on average and no pixel by more than MAX_PIXEL_DIFFERENCE
+# (recompressed photos differ by about 2 on average, a changed word in a screenshot by over 96)
+PIXEL_DIFFERENCE = 2.5
+MAX_PIXEL_DIFFERENCE = 96
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image download exceeds the optimizer's byte limit."""
+
+
+class EncodedImage(NamedTuple):
+    """What `optimize_image` reports back from its process."""
+    seconds: float
+    phash: int
+    # Width / height
+    aspect: float
+    # Standard deviation of the grays
+    contrast: float
+
+
+def optimize_image(source_path: str, output_path: str, profile: ImageProfile) -> EncodedImage:
+    """
+    Decode, flatten, resize and re-encode one image file as JPEG for `profile`.
+
+    JPEGs wider than the profile's width are decoded at 1/2, 1/4 or 1/8
+    scale straight away (the smallest still at least that wide), so a
+    multi-megapixel photo never exists at full resolution in memory.
+    Module-level so it can run in a process pool. Returns the seconds spent,
+    since the pool's processes can't record metrics themselves, and what
+    deduplication compares: the image's perceptual hash, aspect ratio and
+    contrast.
+    """
+    start = time.perf_counter()
+    max_width = profile.max_width
+    image = Image.open(source_path)
+    if image.format == 'JPEG' and (image.width > max_width or profile.grayscale):
+        width = min(image.width, max_width)
+        # The decoder can produce grayscale directly, too
+        image.draft('L' if profile.grayscale else image.mode,
+                    (width, max(1, image.height * width // image.width)))
+
+    # Convert to RGB or grayscale (handle PNG transparency by making white background or just dropping alpha)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        bg = Image.new('RGB', image.size, (255, 255, 255))
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        bg.paste(image, mask=image.split()[3])
+        image = bg
+    mode = 'L' if profile.grayscale else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    # Resize if too large
+    if image.width > max_width:
+        ratio = max_width / image.width
+        new_height = int(image.height * ratio)
+        # Other formats are reduced by box filtering first, which is much cheaper than LANCZOS on the full image
+        image = image.resize((max_width, new_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    # Save as JPEG with optimization
+    data = _encode(image, profile.quality)
+    if profile.max_bytes and len(data) > profile.max_bytes:
+        data = _fit_budget(image, profile)
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return EncodedImage(time.perf_counter() - start, perceptual_hash(image), image.width / image.height,
+                        ImageStat.Stat(image.convert('L')).stddev[0])
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    Difference hash: the image shrunk to (HASH_SIZE + 1) x HASH_SIZE grays,
+    with one bit per pair of horizontally adjacent pixels telling which is
+    brighter. Resizing and re-encoding barely change it.
+    """
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            i = row * (HASH_SIZE + 1) + column
+            bits = bits << 1 | (pixels[i] > pixels[i + 1])
+    return bits
+
+
+def same_pixels(path: str, other_path: str) -> bool:
+    """Whether two image files show the same picture, compared at the smaller one's size."""
+    with Image.open(path) as image, Image.open(other_path) as other:
+        if other.width < image.width:
+            image, other = other, image
+        image = image.convert(other.mode)
+        other = other.resize(image.size, Image.Resampling.LANCZOS)
+        histogram = ImageChops.difference(image, other).histogram()
+    # One histogram of differences per band
+    counts = [sum(histogram[value::256]) for value in range(256)]
+    mean = sum(value * count for value, count in enumerate(counts)) / sum(counts)
+    return mean <= PIXEL_DIFFERENCE and not any(counts[MAX_PIXEL_DIFFERENCE + 1:])
+
+
+def _encode(image: Image.Image, quality: int) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _fit_budget(image: Image.Image, profile: ImageProfile) -> bytes:
+    """
+    Binary search for the highest JPEG quality below the profile's whose
+    encoding fits its byte budget; falls back to `min_quality` when none does.
+    """
+    low, high = profile.min_quality, profile.quality - 1
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode(image, quality)
+        if len(data) <= profile.max_bytes:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best if best is not None else _encode(image, profile.min_quality)
+
 
 class ImageOptimizer:
-    def __init__(self, output_dir='optimized_images', max_width=1000, quality=80):
+    """
+    Downloads, downsizes and re-encodes post images for the PDF.
+
+    The download threads and the Pillow processes are started on first use
+    and kept until `close`, so the batches of a blog (or several blogs
+    sharing one optimizer from different threads) reuse them.
+    """
+
+    OUTPUT_FORMAT = 'JPEG'
+    # Bumped when canonical URLs change, so images cached under a key that
+    # other URLs no longer map to aren't served for them
+    URL_KEY_VERSION = 2
+    # Bytes read from the network at a time
+    CHUNK_SIZE = 64 * 1024
+    # Perceptual hash distance of resized copies, for `dedup_distance`; the pixels are compared too
+    DEDUP_DISTANCE = 8
+
+    def __init__(self, output_dir='.image_cache', profile: ImageProfile = PROFILES[DEFAULT_PROFILE],
+                 http_cache: Optional[HTTPCache] = None, download_workers: int = 8,
+                 process_workers: Optional[int] = None, cache_size: int = 2 * 1024 * 1024 * 1024,
+                 http_client: Optional[HTTPClient] = None, max_image_bytes: Optional[int] = 20 * 1024 * 1024,
+                 dedup_distance: Optional[int] = None):
+        """
+        Args:
+            output_dir: Persistent cache directory for the optimized JPEGs
+            profile: Size and encoding of the images, unless a call asks for another
+            http_cache: Optional on-disk cache for image downloads
+            download_workers: Concurrent downloads
+            process_workers: Processes for the Pillow work (defaults to the CPU count)
+            cache_size: Disk budget of the optimized image cache in bytes
+            http_client: Optional pooled client shared with the scraper (one
+                with `download_workers` connections per host is created otherwise)
+            max_image_bytes: Images larger than this are skipped and left
+                out of the PDF (None = no limit)
+            dedup_distance: Images with the same aspect ratio whose perceptual
+                hashes differ in at most this many of their 256 bits, and whose
+                pixels match, share one file (None = only identical URLs and
+                CDN variants do)
+        """
         self.output_dir = output_dir
-        self.max_width = max_width
-        self.quality = quality
-        os.makedirs(self.output_dir, exist_ok=True)
+        self.profile = profile
+        self.http_cache = http_cache
+        self.download_workers = max(1, download_workers)
+        self.process_workers = process_workers
+        self.max_image_bytes = max_image_bytes
+        self.dedup_distance = dedup_distance
+        self.cache = ImageCache(output_dir, max_bytes=cache_size)
+
+        self.http_client = http_client or HTTPClient(pool_maxsize=self.download_workers)
+        self._downloads: Optional[ThreadPoolExecutor] = None
+        self._encoders: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Perceptual hash, aspect ratio and file of every distinct image seen, per profile
+        self._hashes: Dict[ImageProfile, List[Tuple[int, float, str]]] = {}
 
     def optimize_html_content(self, html_content: str, base_url: str) -> str:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        for img in soup.find_all('img'):
-            src = img.get('src')
-            if not src:
+        return self.optimize_posts([{'content': html_content}], base_url)[0]['content']
+
+    def optimize_posts(self, posts: List[Dict[str, Any]], base_url: str) -> List[Dict[str, Any]]:
+        """Return copies of `posts` whose `<img>` tags point to optimized local files."""
+        documents = [PostDocument(post) for post in posts]
+        self.optimize_documents(documents, base_url)
+        return [document.to_post() for document in documents]
+
+    def optimize_documents(self, documents: List[PostDocument], base_url: str, profile: Optional[ImageProfile] = None):
+        """
+        Optimize the images of a batch of parsed posts for `profile`, rewriting them in place.
+
+        All image URLs are collected first so every distinct image is fetched
+        and optimized once, with downloads and Pillow work running in parallel.
+        """
+        urls = []
+        for document in documents:
+            for img in document.images():
+                src = img.get('src')
+                if src:
+                    # Handle relative URLs
+                    urls.append(urljoin(base_url, src))
+
+        local_paths = self.optimize_images(urls, profile)
+
+        for document in documents:
+            for img in document.images():
+                src = img.get('src')
+                url = urljoin(base_url, src) if src else None
+                local_path = local_paths.get(url) if url else None
+                if not local_path:
+                    if url in local_paths:
+                        # Too large: WeasyPrint must not download it either
+                        img.decompose()
+                    continue
+
+                # Update img src to point to local file
+                # WeasyPrint needs absolute path or file:// URI
+                img['src'] = f"file://{os.path.abspath(local_path)}"
+
+                # Remove srcset to force using the optimized image
+                if img.has_attr('srcset'):
+                    del img['srcset']
+
+    def optimize_images(self, urls: Iterable[str], profile: Optional[ImageProfile] = None) -> Dict[str, str]:
+        """
+        Download and optimize a batch of image URLs for `profile` (the optimizer's by default).
+
+        URLs are deduplicated by their cache key, which is built from the
+        canonical URL so CDN variants of one image (other formats, qualities
+        or proxies, but not other sizes or crops) are downloaded once, and images already in the persistent
+        cache are reused. Downloads share pooled connections with bounded
+        concurrency and are streamed to a file next to the cache, so only
+        the file's path is handed to the process pool that decodes and
+        re-encodes it. Downloads over `max_image_bytes` are abandoned as soon
+        as their size is known. Finally, images that look the same as one
+        optimized earlier are pointed at its file when `dedup_distance` is
+        set, so the PDF embeds it once.
+        Returns {url: local_path} for every image that is available locally,
+        and {url: None} for the images skipped as too large.
+        Safe to call from several threads at once.
+        """
+        profile = profile or self.profile
+        done = {}
+        todo = {}
+        variants = {}
+        for url in urls:
+            if url in done or url in variants:
                 continue
-                
-            # Handle relative URLs
-            full_url = urljoin(base_url, src)
-            
-            # Generate a unique filename based on URL
-            hash_name = hashlib.md5(full_url.encode()).hexdigest()
-            local_filename = f"{hash_name}.jpg"
-            local_path = os.path.join(self.output_dir, local_filename)
-            
-            # Check if already optimized
-            if not os.path.exists(local_path):
+            key = self._cache_key(canonical_image_url(url), profile)
+            local_path = self.cache.lookup(key)
+            if local_path:
+                metrics.add('cached_images', stage='optimize')
+                done[url] = self._deduplicate(profile, local_path, self.cache.metadata(key))
+            elif key in todo:
+                metrics.add('variant_urls', stage='optimize')
+                variants[url] = key
+            else:
+                todo[key] = url
+
+        if todo:
+            downloads, encoders = self._pools()
+            fetches = {downloads.submit(self._download, url, key): key for key, url in todo.items()}
+            encodes = {}
+            for future in as_completed(fetches):
+                key = fetches[future]
+                try:
+                    download_path, size = future.result()
+                except ImageTooLarge as e:
+                    print(f"Skipping image {todo[key]}: {e}")
+                    metrics.add('oversized_images', stage='optimize')
+                    done[todo[key]] = None
+                    continue
+                except Exception as e:
+                    print(f"Failed to download image {todo[key]}: {e}")
+                    metrics.add('failed_images', stage='optimize')
+                    continue
+                metrics.add('image_bytes', size, stage='optimize')
+                encode = encoders.submit(optimize_image, download_path, self.cache.path_for(key, 'jpg'), profile)
+                encodes[encode] = (key, download_path)
+
+            encoded = {}
+            for future in as_completed(encodes):
+                key, download_path = encodes[future]
                 try:
-                    self._download_and_optimize(full_url, local_path)
+                    result = future.result()
                 except Exception as e:
-                    print(f"Failed to optimize image {full_url}: {e}")
+                    print(f"Failed to optimize image {todo[key]}: {e}")
+                    metrics.add('failed_images', stage='optimize')
                     continue
-            
-            # Update img src to point to local file
-            # WeasyPrint needs absolute path or file:// URI
-            abs_path = os.path.abspath(local_path)
-            img['src'] = f"file://{abs_path}"
-            
-            # Remove srcset to force using the optimized image
-            if img.has_attr('srcset'):
-                del img['srcset']
-                
-        return str(soup)
-
-    def _download_and_optimize(self, url: str, output_path: str):
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        image = Image.open(BytesIO(response.content))
-        
-        # Convert to RGB (handle PNG transparency by making white background or just dropping alpha)
-        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
-            bg = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode != 'RGBA':
-                image = image.convert('RGBA')
-            bg.paste(image, mask=image.split()[3])
-            image = bg
-        elif image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        # Resize if too large
-        if image.width > self.max_width:
-            ratio = self.max_width / image.width
-            new_height = int(image.height * ratio)
-            image = image.resize((self.max_width, new_height), Image.Resampling.LANCZOS)
-            
-        # Save as JPEG with optimization
-        image.save(output_path, 'JPEG', quality=self.quality, optimize=True)
+                finally:
+                    os.remove(download_path)
+                metrics.add('images', stage='optimize')
+                metrics.add('image_seconds', result.seconds, stage='optimize')
+                fingerprint = {'phash': f'{result.phash:x}', 'aspect': result.aspect, 'contrast': result.contrast}
+                self.cache.add(key, self.cache.path_for(key, 'jpg'), url=todo[key], **fingerprint)
+                encoded[key] = fingerprint
+
+            # In URL order, so which copy is kept doesn't depend on which finished first
+            for key, url in todo.items():
+                if key in encoded:
+                    done[url] = self._deduplicate(profile, self.cache.path_for(key, 'jpg'), encoded[key])
+
+        for url, key in variants.items():
+            if todo[key] in done:
+                done[url] = done[todo[key]]
+        return done
+
+    def optimize_image_url(self, url: str, profile: Optional[ImageProfile] = None) -> Optional[str]:
+        """Optimize a single image URL and return its local path, or None on failure."""
+        return self.optimize_images([url], profile).get(url)
+
+    def close(self):
+        """Stop the download threads and Pillow processes and persist the optimized image cache index."""
+        with self._lock:
+            if self._downloads is not None:
+                self._downloads.shutdown()
+                self._encoders.shutdown()
+                self._downloads = self._encoders = None
+        self.cache.close()
+
+    def _pools(self):
+        with self._lock:
+            if self._downloads is None:
+                self._downloads = ThreadPoolExecutor(max_workers=self.download_workers)
+                self._encoders = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._downloads, self._encoders
+
+    def _deduplicate(self, profile: ImageProfile, path: str, fingerprint: Dict[str, Any]) -> str:
+        """The file of an earlier image that looks the same as the one at `path`, or `path`."""
+        # Blank images hash alike whatever their size or color
+        if self.dedup_distance is None or fingerprint.get('contrast', 0) < MIN_CONTRAST:
+            return path
+        phash = int(fingerprint['phash'], 16)
+        aspect = fingerprint['aspect']
+        checked = 0
+        while True:
+            with self._lock:
+                seen = self._hashes.setdefault(profile, [])
+                if checked == len(seen):
+                    # Nothing looks the same, and no image was recorded meanwhile
+                    seen.append((phash, aspect, path))
+                    return path
+                shortlist = []
+                for other_hash, other_aspect, other_path in seen[checked:]:
+                    if other_path == path:
+                        return path
+                    # A crop of an image is a different image
+                    if abs(aspect - other_aspect) <= 0.01 * other_aspect \
+                            and bin(phash ^ other_hash).count('1') <= self.dedup_distance:
+                        shortlist.append(other_path)
+                checked = len(seen)
+            # Hashes are only a shortlist: small text images differ in few bits. The pixels
+            # are compared without the lock, since that decodes both files
+            for other_path in shortlist:
+                if same_pixels(path, other_path):
+                    metrics.add('duplicate_images', stage='optimize')
+                    return other_path
+
+    def _cache_key(self, url: str, profile: ImageProfile) -> str:
+        return ImageCache.key(url, format=self.OUTPUT_FORMAT, urls=self.URL_KEY_VERSION, **profile.cache_params())
+
+    def _download(self, url: str, key: str) -> Tuple[str, int]:
+        """Download `url` to a temporary file next to the cache; returns its path and size."""
+        # Unique per thread, in case two callers fetch the same image at once
+        path = self.cache.path_for(key, f'{threading.get_ident()}.download')
+        f = open(path, 'wb')
+        try:
+            with f:
+                if self.http_cache:
+                    # The cache stores whole bodies, so this holds one (size-capped) image in memory
+                    response = self.http_cache.get(url, self._fetch)
+                    try:
+                        response.raise_for_status()
+                        # Bodies cached before the limit was set are checked too
+                        self._check_size(len(response.content))
+                        f.write(response.content)
+                    finally:
+                        response.close()
+                else:
+                    with self.http_client.get(url, stream=True) as response:
+                        response.raise_for_status()
+                        for chunk in self._iter_body(url, response):
+                            f.write(chunk)
+                return path, f.tell()
+        except BaseException:
+            os.remove(path)
+            raise
+
+    def _fetch(self, url: str, params=None, headers=None) -> requests.Response:
+        """Fetch for the HTTP cache: read the body, but no more than `max_image_bytes` of it."""
+        response = self.http_client.get(url, params=params, headers=headers, stream=True)
+        # Closing the response hands its connection back to the pool, which may be a blocking one
+        with response:
+            if response.status_code == 200:
+                response._content = b''.join(self._iter_body(url, response))
+            else:
+                # Error pages and 304s have no use here
+                response._content = b''
+        return response
+
+    def _iter_body(self, url: str, response: requests.Response) -> Iterator[bytes]:
+        """Stream the body in chunks, raising ImageTooLarge once it exceeds `max_image_bytes`."""
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit():
+            self._check_size(int(length))
+        size = 0
+        for chunk in response.iter_content(self.CHUNK_SIZE):
+            size += len(chunk)
+            self._check_size(size)
+            yield chunk
+
+    def _check_size(self, size: int):
+        if self.max_image_bytes and size > self.max_image_bytes:
+            raise ImageTooLarge(f"{size} bytes or more, over the {self.max_image_bytes} byte limit")
@@ -0,0 +1,53 @@
+"""
+Image profiles: how the images of a PDF are sized and encoded for the
+device it will be read on.
+"""
+from typing import Dict, NamedTuple, Optional
+
+# The page of the PDF template (A4 with 2.5cm margins); images span at most its text column
+PAGE_WIDTH_CM = 21.0
+PAGE_MARGIN_CM = 2.5
+
+
+class ImageProfile(NamedTuple):
+    """Target resolution and JPEG encoding of the images of one PDF."""
+    name: str
+    # Pixels per inch of an image spanning the text column
+    dpi: int
+    quality: int
+    grayscale: bool = False
+    # Byte budget per image: when an image is larger at `quality`, the
+    # highest quality down to `min_quality` that fits is searched for
+    max_bytes: Optional[int] = None
+    min_quality: int = 40
+    page_width_cm: float = PAGE_WIDTH_CM
+    page_margin_cm: float = PAGE_MARGIN_CM
+
+    @property
+    def max_width(self) -> int:
+        """Images wider than this many pixels are downscaled."""
+        return round((self.page_width_cm - 2 * self.page_margin_cm) / 2.54 * self.dpi)
+
+    def cache_params(self) -> Dict[str, object]:
+        """The settings that change the encoded image, for its cache key."""
+        params = {'max_width': self.max_width, 'quality': self.quality}
+        if self.grayscale:
+            params['grayscale'] = True
+        if self.max_bytes:
+            params['max_bytes'] = self.max_bytes
+            params['min_quality'] = self.min_quality
+        return params
+
+
+PROFILES: Dict[str, ImageProfile] = {profile.name: profile for profile in (
+    # Reading on a computer or tablet
+    ImageProfile('screen', dpi=150, quality=80),
+    # Printing: full resolution, little compression
+    ImageProfile('print', dpi=300, quality=90),
+    # Smallest files, for phones and slow syncs
+    ImageProfile('low-dpi', dpi=96, quality=70, max_bytes=60 * 1024),
+    # 6-8" e-ink screens show an A4 page at ~130 pixels per inch, in 16 grays
+    ImageProfile('ereader', dpi=130, quality=70, grayscale=True, max_bytes=80 * 1024),
+)}
+
+DEFAULT_PROFILE = 'screen'
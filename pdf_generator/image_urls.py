@@ -0,0 +1,52 @@
+"""
+Canonical image URLs: the same image served by a CDN in other formats,
+qualities or through a proxy maps to one URL.
+
+Parts of a URL that change the image's pixels (its size, crop or zoom)
+are kept, since e.g. `photo-150x150.jpg` is usually a square crop of
+`photo.jpg` rather than the same picture.
+"""
+import re
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit, urlunsplit
+
+# Substack's image CDN: /image/fetch/<transformations>/<URL-encoded original>
+_SUBSTACK_FETCH = re.compile(r'^/image/fetch/(?P<transformations>[^/]*)/(?P<source>https?(?::|%3A).+)$',
+                             re.IGNORECASE)
+# Substack transformations that only change the encoding: format, quality, progressive flags, signature
+_SUBSTACK_ENCODING = ('f_', 'q_', 'fl_', '$')
+# WordPress.com's image proxy (Photon): i0.wp.com/<host>/<path>
+_PHOTON_HOST = re.compile(r'^i\d\.wp\.com$', re.IGNORECASE)
+
+# Query parameters that re-encode the image without changing its pixels
+_ENCODING_PARAMS = {'q', 'quality', 'fm', 'format', 'auto', 'strip', 'lossy', 'ssl'}
+
+
+def canonical_image_url(url: str) -> str:
+    """
+    One URL for the encodings of an image: other formats or qualities, http
+    or https, and the Photon proxy of a WordPress upload.
+
+    Only used to recognize copies of one image; the canonical URL itself may
+    not exist, so images are always downloaded from one of the URLs found.
+    """
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    path = parts.path
+
+    match = _SUBSTACK_FETCH.match(path) if host == 'substackcdn.com' else None
+    if match:
+        source = canonical_image_url(unquote(match.group('source')))
+        transformations = [t for t in match.group('transformations').split(',')
+                           if t and not t.startswith(_SUBSTACK_ENCODING)]
+        if not transformations:
+            return source
+        return f"https://substackcdn.com/image/fetch/{','.join(transformations)}/{quote(source, safe='')}"
+    if _PHOTON_HOST.match(host) and '/' in path.lstrip('/'):
+        host, _, path = path.lstrip('/').partition('/')
+        host = host.lower()
+        path = '/' + path
+
+    query = urlencode([(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                       if name.lower() not in _ENCODING_PARAMS])
+    # The same file over http and https
+    return urlunsplit(('https', host, path, query, ''))
@@ -0,0 +1,37 @@
+from typing import Dict, Any, List, Optional
+from bs4 import Tag
+from scrapers.parsing import make_soup, fragment_html
+
+
+class PostDocument:
+    """
+    A post whose content is parsed once and then transformed in place.
+
+    Pipeline stages (front image lookup, image optimization, image
+    stripping) all work on the same tree, and the HTML is only serialized
+    when an output variant is needed via `to_post`.
+    """
+
+    def __init__(self, post: Dict[str, Any]):
+        self.post = post
+        self.tree = make_soup(post.get('content') or '')
+
+    def images(self) -> List[Tag]:
+        return self.tree.find_all('img')
+
+    def first_image_src(self) -> Optional[str]:
+        img = self.tree.find('img')
+        return img.get('src') if img else None
+
+    def strip_images(self):
+        """Remove images, and figures since they usually wrap an image."""
+        for img in self.tree.find_all('img'):
+            img.decompose()
+        for figure in self.tree.find_all('figure'):
+            figure.decompose()
+
+    def to_post(self) -> Dict[str, Any]:
+        """Return a copy of the post with the current tree serialized as its content."""
+        post = self.post.copy()
+        post['content'] = fragment_html(self.tree)
+        return post
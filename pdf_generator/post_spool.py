@@ -0,0 +1,65 @@
+import json
+from typing import Dict, Any, Iterator
+
+
+class PostSpool:
+    """
+    Append-only JSON-lines file of posts.
+
+    Posts are written to disk as they arrive, and only their byte offsets
+    are kept in memory, so a spool can be iterated any number of times (in
+    either order) without holding the blog in memory. Once closed, a spool
+    can be pickled and read from a worker process.
+    """
+
+    def __init__(self, path: str, reverse: bool = False):
+        """
+        Args:
+            path: File backing the spool (truncated on open)
+            reverse: Iterate posts in the opposite order they were appended
+        """
+        self.path = path
+        self.reverse = reverse
+        self._offsets = []
+        self._writer = open(path, 'wb')
+
+    @classmethod
+    def load(cls, path: str, reverse: bool = False) -> 'PostSpool':
+        """Open the file of a spool written earlier (e.g. by another run), read-only."""
+        spool = cls.__new__(cls)
+        spool.path = path
+        spool.reverse = reverse
+        spool._offsets = []
+        spool._writer = None
+        with open(path, 'rb') as f:
+            offset = 0
+            for line in f:
+                spool._offsets.append(offset)
+                offset += len(line)
+        return spool
+
+    def append(self, post: Dict[str, Any]):
+        self._offsets.append(self._writer.tell())
+        self._writer.write(json.dumps(post).encode() + b'\n')
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self._writer is not None and not self._writer.closed:
+            self._writer.flush()
+        offsets = list(reversed(self._offsets)) if self.reverse else list(self._offsets)
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __getstate__(self):
+        # A closed spool can be sent to another process as a read-only view
+        state = self.__dict__.copy()
+        state['_writer'] = None
+        return state
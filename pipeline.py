@@ -0,0 +1,298 @@
+"""
+The steps that turn one blog into PDFs, shared by the single-blog commands
+(main.py) and the batch command (batch.py).
+
+The scrapers, BeautifulSoup and WeasyPrint are imported by the steps that
+use them, so that importing this module stays cheap.
+"""
+import json
+import os
+import re
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+from scrapers.rate_limiter import HostRateLimiters
+from scrapers.metrics import metrics
+from pdf_generator.image_profiles import DEFAULT_PROFILE, PROFILES
+from pdf_generator.post_spool import PostSpool
+
+if TYPE_CHECKING:
+    from pdf_generator.generator import RenderJob
+
+# Posts are optimized and spooled in batches of this size, which bounds
+# how many parsed posts are held in memory at once.
+SPOOL_BATCH_SIZE = 25
+
+OUTPUT_DIR = 'output'
+
+VARIANTS = ('images', 'text')
+
+# Written next to the spools by `save_spooled`
+SPOOLED_BLOG_FILE = 'blog.json'
+
+
+class Blog(NamedTuple):
+    """One blog to turn into PDFs: a command line run, or an entry of a batch manifest."""
+    url: str
+    # Only needed to scrape
+    type: Optional[str]
+    title: Optional[str] = None
+    author: Optional[str] = None
+    # Custom frontispiece
+    image: Optional[str] = None
+    variants: Tuple[str, ...] = VARIANTS
+    # Image profiles of the images variant, one PDF each
+    image_profiles: Tuple[str, ...] = (DEFAULT_PROFILE,)
+    # WordPress REST API root, when the blog's pages don't link to it
+    rest_url: Optional[str] = None
+
+
+class SpooledBlog(NamedTuple):
+    """The posts of a blog, spooled to disk once per PDF."""
+    # By image profile
+    image_spools: Dict[str, PostSpool]
+    text_spool: Optional[PostSpool]
+    oldest_title: Optional[str]
+    first_image: Optional[str]
+    post_count: int
+    # Frontispiece of the images PDFs, by image profile
+    front_images: Dict[str, Optional[str]] = {}
+
+
+def make_scraper(url, type, workers, rate, max_rate, max_retries, index_lookahead, archive_page_size,
+                 archive_workers, fetch_mode, http_cache, post_store, http_client, journal,
+                 rate_limiters: Optional[HostRateLimiters] = None, rest_url: Optional[str] = None):
+    """
+    Create the scraper of a blog. With `rate_limiters`, the scraper shares
+    its rate limit with every other scraper of the same host. `rest_url`
+    is the WordPress REST API root, when the blog's pages don't link to it.
+    """
+    from scrapers.substack import SubstackScraper
+    from scrapers.wordpress import WordPressScraper
+
+    if type == 'wordpress':
+        rate_limiter = rate_limiters.for_url(url, rate, max_rate) if rate_limiters else None
+        return WordPressScraper(url, workers=workers, index_lookahead=index_lookahead,
+                                requests_per_second=rate, http_cache=http_cache, post_store=post_store,
+                                max_requests_per_second=max_rate, max_retries=max_retries,
+                                http_client=http_client, fetch_mode=fetch_mode, rest_url=rest_url, journal=journal,
+                                rate_limiter=rate_limiter)
+
+    # For Substack, check for authentication credentials in environment
+    session_cookies = {}
+    substack_sid = os.getenv('SUBSTACK_SID')
+    substack_lli = os.getenv('SUBSTACK_LLI')
+
+    if substack_sid and substack_lli:
+        session_cookies = {
+            'substack.sid': substack_sid,
+            'substack.lli': substack_lli
+        }
+
+    rate = rate or 0.5
+    max_rate = max(rate, max_rate or 4 * rate)
+    rate_limiter = rate_limiters.for_url(url, rate, max_rate) if rate_limiters else None
+    return SubstackScraper(url, session_cookies=session_cookies, workers=workers,
+                           requests_per_second=rate, http_cache=http_cache,
+                           post_store=post_store, max_requests_per_second=max_rate,
+                           max_retries=max_retries, http_client=http_client,
+                           archive_page_size=archive_page_size, archive_workers=archive_workers,
+                           fetch_mode=fetch_mode, journal=journal, rate_limiter=rate_limiter)
+
+
+def scraped_posts(scraper, post_store):
+    """Yield the valid posts to render, newest first."""
+    posts = (p for p in scraper.get_posts() if p and p.get('content')) # Filter empty posts and ensure content exists
+    if post_store is None:
+        return posts
+
+    new_posts = 0
+    for post in posts:
+        post_store.add(post)
+        new_posts += 1
+    if scraper.complete:
+        post_store.save()
+        print(f"Found {new_posts} new posts, {len(post_store)} stored in total.")
+    else:
+        # The next run stops at the newest stored post, so it would never fetch the ones missing now
+        print(f"Found {new_posts} new posts, not stored until the crawl is complete.")
+    return post_store.posts()
+
+
+def incomplete_crawl(scraper) -> Optional[str]:
+    """Why the scraper's last crawl can be resumed, or None when it completed."""
+    if scraper.complete:
+        return None
+    problems = []
+    if scraper.failed_posts:
+        problems.append(f"{len(scraper.failed_posts)} posts failed")
+    if scraper._listing_failed:
+        problems.append("the listing stopped early")
+    return f"the crawl is incomplete ({', '.join(problems)}), run again with --resume to continue it"
+
+
+def spool_blog(blog: Blog, posts, optimizer, spool_dir: str) -> SpooledBlog:
+    """
+    Spool the posts of `blog` into `spool_dir`, one file per PDF, and
+    optimize the frontispiece of the images PDFs (the optimizer is only used
+    for images).
+    """
+    # Scrapers yield newest first, the PDFs are chronological (Oldest -> Newest)
+    spools = {name: PostSpool(os.path.join(spool_dir, f'{name}.jsonl'), reverse=True)
+              for name in _spool_names(blog)}
+    image_spools = {profile: spools[f'images-{profile}'] for profile in blog.image_profiles
+                    if f'images-{profile}' in spools}
+    try:
+        oldest_title, first_image, post_count = spool_posts(posts, blog.url, optimizer, image_spools,
+                                                            spools.get('text'))
+    finally:
+        for spool in spools.values():
+            spool.close()
+    front_images = {profile: front_image(blog.image or first_image, optimizer, profile)
+                    for profile in image_spools}
+    return SpooledBlog(image_spools, spools.get('text'), oldest_title, first_image, post_count, front_images)
+
+
+def front_image(image: Optional[str], optimizer, profile: str) -> Optional[str]:
+    """The frontispiece for an images PDF: `image`, optimized for `profile` if it's a URL."""
+    if not image or not image.startswith('http'):
+        return image
+    # Usually already in the image cache, since it comes from the first post
+    with metrics.stage('optimize'):
+        local_path = optimizer.optimize_image_url(image, PROFILES[profile])
+    if not local_path:
+        print(f"Failed to optimize front image {image}")
+        return image
+    return f"file://{os.path.abspath(local_path)}"
+
+
+def save_spooled(spooled: SpooledBlog, spool_dir: str):
+    """Record how the spools in `spool_dir` were made, so `load_spooled` can reopen them in a later run."""
+    with open(os.path.join(spool_dir, SPOOLED_BLOG_FILE), 'w') as f:
+        json.dump({
+            'image_profiles': list(spooled.image_spools),
+            'text': spooled.text_spool is not None,
+            'oldest_title': spooled.oldest_title,
+            'first_image': spooled.first_image,
+            'post_count': spooled.post_count,
+            'front_images': spooled.front_images,
+        }, f)
+
+
+def load_spooled(spool_dir: str) -> SpooledBlog:
+    """Reopen the spools saved by `save_spooled`; raises FileNotFoundError when there are none."""
+    with open(os.path.join(spool_dir, SPOOLED_BLOG_FILE)) as f:
+        saved = json.load(f)
+
+    def load(name):
+        return PostSpool.load(os.path.join(spool_dir, f'{name}.jsonl'), reverse=True)
+
+    image_spools = {profile: load(f'images-{profile}') for profile in saved['image_profiles']}
+    text_spool = load('text') if saved['text'] else None
+    return SpooledBlog(image_spools, text_spool, saved['oldest_title'], saved['first_image'], saved['post_count'],
+                       saved['front_images'])
+
+
+def _spool_names(blog: Blog) -> List[str]:
+    names = [f'images-{profile}' for profile in blog.image_profiles] if 'images' in blog.variants else []
+    return names + (['text'] if 'text' in blog.variants else [])
+
+
+def spool_posts(posts, base_url, optimizer, image_spools, text_spool):
+    """
+    Optimize posts in batches and spool the requested PDFs to disk.
+
+    With one image profile, each post is parsed once: its images are
+    optimized in place, the tree is serialized for the images PDF, then
+    stripped of images and serialized for the text-only PDF. Every further
+    profile parses the post again, as optimizing rewrites the image sources.
+    `image_spools` maps image profile names to their spools and may be
+    empty (with no optimizer); the text spool may be None when that variant
+    is not produced.
+    Returns the title and the first image source of the oldest post, and
+    the number of posts spooled.
+    """
+    from pdf_generator.post_document import PostDocument
+
+    oldest_title = None
+    first_image = None
+    count = 0
+    posts = iter(posts)
+    while True:
+        # Pulling a batch is what drives the scraper
+        with metrics.stage('scrape'):
+            batch = list(islice(posts, SPOOL_BATCH_SIZE))
+        if not batch:
+            break
+        with metrics.stage('spool'):
+            documents = [PostDocument(post) for post in batch]
+
+            # Newest first, so the last image found belongs to the oldest post
+            for document in documents:
+                first_image = document.first_image_src() or first_image
+
+        for number, (profile, images_spool) in enumerate(image_spools.items(), 1):
+            # The last profile takes the documents the text variant strips afterwards
+            profile_documents = documents if number == len(image_spools) else [PostDocument(post) for post in batch]
+            with metrics.stage('optimize'):
+                optimizer.optimize_documents(profile_documents, base_url, PROFILES[profile])
+            with metrics.stage('spool'):
+                for document in profile_documents:
+                    images_spool.append(document.to_post())
+        with metrics.stage('spool'):
+            for document in documents:
+                if text_spool is not None:
+                    document.strip_images()
+                    text_spool.append(document.to_post())
+        oldest_title = batch[-1]['title']
+        count += len(batch)
+    return oldest_title, first_image, count
+
+
+def render_jobs(blog: Blog, spooled: SpooledBlog, chunk_size: int = 0, chunk_by_year: bool = False,
+                fragment_cache_dir: Optional[str] = None, output_dir: str = OUTPUT_DIR) -> List['RenderJob']:
+    """The render jobs of the PDFs of `blog`, writing to `output_dir`."""
+    from pdf_generator.generator import RenderJob
+
+    # Determine blog title if not provided
+    blog_title = blog.title if blog.title else (spooled.oldest_title or "Blog Posts")
+
+    # Determine author for filename
+    pdf_author = blog.author if blog.author else "Unknown"
+
+    safe_title = sanitize_filename(blog_title)
+    safe_author = sanitize_filename(pdf_author)
+
+    # Create output directory
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    for profile, images_spool in spooled.image_spools.items():
+        # The default profile keeps the plain name
+        suffix = '' if profile == DEFAULT_PROFILE else f'_{profile}'
+        images_pdf = os.path.join(output_dir, f"{safe_title}_{safe_author}_with_images{suffix}.pdf")
+        jobs.append(RenderJob(images_pdf, images_spool, blog_title, spooled.front_images.get(profile), blog.author,
+                              chunk_size, chunk_by_year, fragment_cache_dir))
+
+    if spooled.text_spool is not None:
+        # For text-only, we might still want the frontispiece?
+        # User said "one with images and one without". Usually text-only implies NO images at all.
+        # But maybe the cover is okay? Let's assume NO images for strict text-only.
+        text_only_pdf = os.path.join(output_dir, f"{safe_title}_{safe_author}_without_images.pdf")
+        jobs.append(RenderJob(text_only_pdf, spooled.text_spool, blog_title, None, blog.author, # No front image
+                              chunk_size, chunk_by_year, fragment_cache_dir))
+    return jobs
+
+
+def sanitize_filename(text):
+    """Make `text` safe to use in a file name."""
+    # Remove or replace characters that are invalid in filenames
+    text = re.sub(r'[<>:"/\\|?*]', '', text)
+    # Replace spaces with underscores
+    text = text.replace(' ', '_')
+    # Remove multiple underscores
+    text = re.sub(r'_+', '_', text)
+    # Trim underscores from start/end
+    text = text.strip('_')
+    # Limit length to avoid filesystem issues
+    return text[:100]
@@ -1,11 +1,57 @@
 from abc import ABC, abstractmethod
-from typing import Iterator, Dict, Any
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Dict, Any, List, Optional, Tuple
+import requests
+from .cleaning import Cleaner, Rule
+from .crawl_journal import CrawlJournal
+from .http_cache import HTTPCache
+from .http_client import HTTPClient
+from .metrics import metrics
+from .parsing import make_soup
+from .post_store import PostStore
+from .rate_limiter import RateLimiter
+from .request_scheduler import RequestScheduler
+
+# (post URL, listing entry, cursor). Entries with a URL are posts to fetch;
+# entries without one mark the end of a listing page and carry the cursor
+# to resume from once everything before them is done.
+Entry = Tuple[Optional[str], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
 
 class BaseScraper(ABC):
-    def __init__(self, start_url: str):
+    # The site's cleaning rules, applied to every post body
+    CLEANING_RULES: List[Rule] = []
+    # Class of the <div> holding a post's content on its page
+    CONTENT_CLASS = ''
+    FETCH_MODES = ('api', 'html')
+
+    def __init__(self, start_url: str, http_cache: Optional[HTTPCache] = None,
+                 post_store: Optional[PostStore] = None, http_client: Optional[HTTPClient] = None,
+                 workers: int = 1, journal: Optional[CrawlJournal] = None, fetch_mode: str = 'api',
+                 requests_per_second: Optional[float] = None, max_requests_per_second: Optional[float] = None,
+                 max_retries: int = 4, rate_limiter: Optional[RateLimiter] = None):
+        if fetch_mode not in self.FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode {fetch_mode!r}")
         self.start_url = start_url
+        self.http_cache = http_cache
+        # When a store is given, pagination stops at the first stored post
+        self.post_store = post_store
+        # Pooled connections, possibly shared with other components
+        self.http_client = http_client or HTTPClient()
+        self.workers = max(1, workers)
+        # When a journal is given, progress is checkpointed to it and a
+        # resumed journal is continued from where it stopped
+        self.journal = journal
+        self.fetch_mode = fetch_mode
+        # Requests of all workers share one rate, and back off together when throttled
+        self.rate_limiter = rate_limiter or RateLimiter(rate=requests_per_second, max_rate=max_requests_per_second)
+        self.scheduler = RequestScheduler(self.rate_limiter, max_retries=max_retries)
+        self.cleaner = Cleaner(self.CLEANING_RULES)
+        # Posts of the last `get_posts` that couldn't be fetched
+        self.failed_posts: List[str] = []
+        self._listing_failed = False
 
-    @abstractmethod
     def get_posts(self) -> Iterator[Dict[str, Any]]:
         """
         Yields post data.
@@ -13,6 +59,138 @@ class BaseScraper(ABC):
         - title: str
         - content: str (HTML)
         - date: str (optional)
+        - published: str (optional, ISO 8601 timestamp)
         - url: str
+
+        Posts are fetched by `workers` threads and yielded in listing order
+        (newest first). With a resumed journal, its completed posts are
+        yielded first, its failed posts are retried in place, and the
+        listing continues from its cursor.
+        """
+        self._listing_failed = False
+        self.failed_posts = []
+        if self.journal is not None and len(self.journal):
+            print(f"Resuming: {len(self.journal)} posts journaled, {len(self.journal.failed)} to retry.")
+            yield from self._fetch_and_record(self._journaled_entries(), self._fetch_journaled)
+            if self.journal.complete:
+                return
+
+        cursor = self.journal.cursor if self.journal is not None else None
+        yield from self._fetch_and_record(self._iter_entries(cursor), self._fetch_listed)
+        if self.journal is not None and not self._listing_failed:
+            self.journal.record_end()
+
+    @property
+    def complete(self) -> bool:
+        """Whether the last `get_posts` walked the whole listing and fetched every post it listed."""
+        return not self._listing_failed and not self.failed_posts
+
+    @abstractmethod
+    def _iter_entries(self, cursor: Optional[Dict[str, Any]]) -> Iterator[Entry]:
+        """Walk the listing from `cursor` (None = the beginning), newest first."""
+
+    @abstractmethod
+    def _fetch_entry(self, url: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Fetch one listed post; {} on failure."""
+
+    def _fetch_listed(self, url: str, entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.journal is not None and url in self.journal:
+            # Listed again after a resume (e.g. posts shifted across pages)
+            return None
+        with metrics.timer('fetch_seconds', post=url):
+            return self._fetch_entry(url, entry)
+
+    def _fetch_journaled(self, url: str, entry: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        if entry is None:
+            return self.journal.read(url)['post']
+        print(f"Retrying {url}...")
+        with metrics.timer('fetch_seconds', post=url):
+            return self._fetch_entry(url, entry)
+
+    def _journaled_entries(self) -> Iterator[Entry]:
+        """The journaled posts; completed ones have no entry and are read back."""
+        for url, status in self.journal.records():
+            yield url, (None if status == 'post' else self.journal.read(url).get('entry', {})), None
+
+    def _fetch_and_record(self, entries: Iterator[Entry],
+                          fetch: Callable[[str, Any], Optional[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+        for url, entry, cursor, post in self._fetch_in_order(entries, fetch):
+            if post is not None:
+                metrics.add('posts' if post else 'failed_posts', stage='scrape')
+                if not post:
+                    self.failed_posts.append(url)
+                if self.journal is not None:
+                    if not post:
+                        self.journal.record_failure(url, entry)
+                    elif not self.journal.completed(url):
+                        self.journal.record_post(post)
+                yield post
+            if cursor is not None and self.journal is not None:
+                self.journal.record_cursor(cursor)
+
+    def _fetch_in_order(self, entries: Iterator[Entry], fetch: Callable[[str, Any], Optional[Dict[str, Any]]]):
         """
-        pass
+        Run `fetch(url, entry)` for every post entry with `workers` threads and
+        yield (url, entry, cursor, post) in listing order.
+
+        Page markers yield a None post. Up to `2 * workers` posts are in
+        flight, so the listing is walked lazily.
+        """
+        if self.workers == 1:
+            for url, entry, cursor in entries:
+                yield url, entry, cursor, fetch(url, entry) if url is not None else None
+            return
+
+        max_pending = self.workers * 2
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            try:
+                for url, entry, cursor in entries:
+                    future = executor.submit(fetch, url, entry) if url is not None else None
+                    pending.append((url, entry, cursor, future))
+                    while len(pending) > max_pending:
+                        url, entry, cursor, future = pending.popleft()
+                        yield url, entry, cursor, future.result() if future else None
+                while pending:
+                    url, entry, cursor, future = pending.popleft()
+                    yield url, entry, cursor, future.result() if future else None
+            finally:
+                # The consumer stopped early
+                for _, _, _, future in pending:
+                    if future:
+                        future.cancel()
+
+    def _listing_error(self, message: str):
+        """Report that the listing stopped early; a resumed run continues from the last cursor."""
+        self._listing_failed = True
+        print(message)
+        if self.journal is not None:
+            print("Run again with --resume to continue from here.")
+
+    def _is_known(self, url: str) -> bool:
+        """True if `url` was already scraped by a previous incremental run."""
+        return self.post_store is not None and self.post_store.known(url)
+
+    def _get(self, url: str, params: Optional[Dict] = None) -> requests.Response:
+        """GET `url`, going through the HTTP cache when one is configured."""
+        if self.http_cache:
+            return self.http_cache.get(url, self._fetch, params=params)
+        return self._fetch(url, params=params)
+
+    def _fetch(self, url: str, params: Optional[Dict] = None,
+               headers: Optional[Dict] = None) -> requests.Response:
+        """Perform the network request, rate limited and retried by the scheduler."""
+        return self.scheduler.send(url, lambda: self.http_client.get(url, params=params, headers=headers))
+
+    def _content_from_api(self, url: str, body: str) -> str:
+        """Clean a post body taken from an API rather than the post page."""
+        # Same wrapper as on the post page, so both modes produce the same content
+        with metrics.timer('parse_seconds', stage='scrape', post=url):
+            content_elem = make_soup(f'<div class="{self.CONTENT_CLASS}">{body}</div>').select_one(
+                f'div.{self.CONTENT_CLASS}')
+            return self._clean_content(content_elem)
+
+    def _clean_content(self, content_elem) -> str:
+        """Apply the site's cleaning rules to a post body and serialize it."""
+        self.cleaner.clean(content_elem)
+        return str(content_elem)
@@ -0,0 +1,129 @@
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from bs4 import NavigableString, Tag
+from bs4.element import PreformattedString, Script, Stylesheet, TemplateString
+
+# Strings that `get_text()` skips: comments and declarations, and the code of scripts, styles and templates
+NON_TEXT_STRINGS = (PreformattedString, Script, Stylesheet, TemplateString)
+
+
+class Rule(NamedTuple):
+    """
+    One cleaning rule.
+
+    An element matches when it has one of `tags` (if given), one of
+    `classes` (if given), all of `attrs`, and satisfies `when`:
+    - 'has_image': it contains an image
+    - 'empty': it has no text and no image
+    `action` is 'remove' (drop the element and its content) or 'unwrap'
+    (keep the content, drop the element).
+    """
+    name: str
+    action: str = 'remove'
+    tags: Tuple[str, ...] = ()
+    classes: Tuple[str, ...] = ()
+    attrs: Tuple[Tuple[str, str], ...] = ()
+    when: Optional[str] = None
+
+
+class Cleaner:
+    """
+    Applies a site's cleaning rules to a post body in a single traversal.
+
+    Rules are indexed by tag name and class, so each element is only
+    checked against the rules that could match it. Unconditional removals
+    are applied on the way down and skip the element's subtree; the other
+    rules are applied on the way up, once the element's content is clean,
+    using has-image/has-text flags returned by the traversal instead of
+    searching the subtree again. When several rules match an element, the
+    first one wins.
+
+    `hits` counts how many elements each rule removed or unwrapped, over
+    every post cleaned so far.
+    """
+
+    ACTIONS = ('remove', 'unwrap')
+    CONDITIONS = (None, 'has_image', 'empty')
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = list(rules)
+        for rule in self.rules:
+            if rule.action not in self.ACTIONS:
+                raise ValueError(f"Rule {rule.name!r}: unknown action {rule.action!r}")
+            if rule.when not in self.CONDITIONS:
+                raise ValueError(f"Rule {rule.name!r}: unknown condition {rule.when!r}")
+        self.hits: Counter = Counter({rule.name: 0 for rule in self.rules})
+        self._lock = threading.Lock()
+        # Removals that don't depend on content apply before descending
+        self._before = self._compile([rule for rule in self.rules if rule.action == 'remove' and rule.when is None])
+        self._after = self._compile([rule for rule in self.rules if rule.action != 'remove' or rule.when is not None])
+
+    def clean(self, root: Tag):
+        """Clean the content of `root` in place (`root` itself is kept)."""
+        hits = Counter()
+        self._visit(root, hits)
+        with self._lock:
+            self.hits.update(hits)
+
+    def _visit(self, tag: Tag, hits: Counter) -> Tuple[bool, bool]:
+        """Clean the children of `tag`; returns whether what is left has an image and text."""
+        has_image = has_text = False
+        for child in list(tag.contents):
+            if not isinstance(child, Tag):
+                if isinstance(child, NavigableString) and not isinstance(child, NON_TEXT_STRINGS):
+                    has_text = has_text or bool(child.strip())
+                continue
+
+            rule = self._match(self._before, child, False, False)
+            if rule:
+                hits[rule.name] += 1
+                child.decompose()
+                continue
+
+            child_image, child_text = self._visit(child, hits)
+            child_image = child_image or child.name == 'img'
+            rule = self._match(self._after, child, child_image, child_text)
+            if rule:
+                hits[rule.name] += 1
+                if rule.action == 'remove':
+                    child.decompose()
+                    continue
+                child.unwrap()
+            has_image = has_image or child_image
+            has_text = has_text or child_text
+        return has_image, has_text
+
+    @staticmethod
+    def _compile(rules: List[Rule]) -> Dict[str, List[Tuple[int, Rule]]]:
+        """Index rules by 'tag:<name>', 'class:<name>' or '*' (neither)."""
+        index: Dict[str, List[Tuple[int, Rule]]] = {}
+        for order, rule in enumerate(rules):
+            keys = [f'class:{name}' for name in rule.classes] or [f'tag:{name}' for name in rule.tags] or ['*']
+            for key in keys:
+                index.setdefault(key, []).append((order, rule))
+        return index
+
+    @staticmethod
+    def _match(index: Dict[str, List[Tuple[int, Rule]]], tag: Tag, has_image: bool,
+               has_text: bool) -> Optional[Rule]:
+        if not index:
+            return None
+        classes = tag.get('class') or ()
+        candidates = list(index.get(f'tag:{tag.name}', ())) + list(index.get('*', ()))
+        for name in classes:
+            candidates.extend(index.get(f'class:{name}', ()))
+        for _, rule in sorted(candidates, key=lambda candidate: candidate[0]):
+            if rule.tags and tag.name not in rule.tags:
+                continue
+            if rule.classes and not any(name in rule.classes for name in classes):
+                continue
+            if any(tag.get(attr) != value for attr, value in rule.attrs):
+                continue
+            if rule.when == 'has_image' and not has_image:
+                continue
+            if rule.when == 'empty' and (has_image or has_text):
+                continue
+            return rule
+        return None
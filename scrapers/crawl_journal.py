@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .post_store import blog_dir_name
+
+
+class CrawlJournal:
+    """
+    Append-only checkpoint of a crawl, one JSON record per line.
+
+    The scraper records every post it completes (with its content), every
+    post it failed to fetch, and after each listing page the cursor to
+    resume from (Substack offset, WordPress REST page or next index URL).
+    Everything listed before the last cursor is recorded, so a resumed
+    crawl replays the completed posts, retries only the failed ones and
+    continues listing from the cursor. Records are flushed as they are
+    written, so a crash loses at most the posts in flight.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+        Args:
+            path: Journal file
+            resume: Load the existing journal instead of starting a new one
+        """
+        self.path = path
+        self.cursor: Optional[Dict[str, Any]] = None
+        # The listing was walked to its end; only failed posts remain
+        self.complete = False
+        # url -> (status, offset of its latest record), in first-seen order
+        self._posts: Dict[str, Tuple[str, int]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if resume:
+            self._load()
+        self._file = open(path, 'ab' if resume else 'wb')
+
+    @classmethod
+    def for_blog(cls, checkpoint_dir: str, blog_url: str, resume: bool = False) -> 'CrawlJournal':
+        """Open the journal of one blog inside `checkpoint_dir`."""
+        return cls(os.path.join(checkpoint_dir, blog_dir_name(blog_url) + '.jsonl'), resume=resume)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._posts
+
+    def __len__(self) -> int:
+        return len(self._posts)
+
+    @property
+    def failed(self) -> List[str]:
+        return [url for url, (status, _) in self._posts.items() if status == 'failed']
+
+    def completed(self, url: str) -> bool:
+        return self._posts.get(url, ('',))[0] == 'post'
+
+    def records(self) -> Iterator[Tuple[str, str]]:
+        """Yield (url, status) for every journaled post, in crawl order."""
+        for url, (status, _) in list(self._posts.items()):
+            yield url, status
+
+    def read(self, url: str) -> Dict[str, Any]:
+        """Return the latest record of `url` (with its post or archive entry)."""
+        _, offset = self._posts[url]
+        with self._lock:
+            self._file.flush()
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def record_post(self, post: Dict[str, Any]):
+        self._append({'type': 'post', 'url': post['url'], 'post': post})
+
+    def record_failure(self, url: str, entry: Optional[Dict[str, Any]]):
+        self._append({'type': 'failed', 'url': url, 'entry': entry or {}})
+
+    def record_cursor(self, cursor: Dict[str, Any]):
+        self._append({'type': 'cursor', 'cursor': cursor})
+
+    def record_end(self):
+        self._append({'type': 'end'})
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        """Delete the journal once the run it protects has completed."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _append(self, record: Dict[str, Any]):
+        line = json.dumps(record).encode() + b'\n'
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            self._apply(record, offset)
+
+    def _apply(self, record: Dict[str, Any], offset: int):
+        kind = record.get('type')
+        if kind in ('post', 'failed'):
+            url = record['url']
+            # A post completed once stays completed
+            if kind == 'failed' and self.completed(url):
+                return
+            self._posts[url] = (kind, offset)
+        elif kind == 'cursor':
+            self.cursor = record['cursor']
+        elif kind == 'end':
+            self.complete = True
+
+    def _load(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            for line in f:
+                # Torn last line from a crash mid-write; without its newline even a
+                # complete record is dropped, or the next one would be appended to it
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(record, offset)
+                offset += len(line)
+        # Drop a torn tail so new records start on a clean line
+        if offset < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
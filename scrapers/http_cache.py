@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class OfflineCacheMiss(requests.ConnectionError):
+    """Raised in offline mode when a URL is not in the cache."""
+
+
+class HTTPCache:
+    """
+    On-disk HTTP response cache shared by the scrapers and the image optimizer.
+
+    Bodies are stored as one file per URL next to an `index.json` that keeps
+    the validators (ETag / Last-Modified) and access times. Stale entries are
+    revalidated with conditional GETs, the total body size is capped with LRU
+    eviction, and in offline mode only cached responses are served.
+    """
+
+    INDEX_FILE = 'index.json'
+    SAVE_EVERY = 50
+    # Response headers kept with each body (the WordPress REST API pages by its X-WP-* headers,
+    # and WordPress pages link to the API with a Link header)
+    STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Link', 'X-WP-Total', 'X-WP-TotalPages')
+
+    def __init__(self, cache_dir: str = '.http_cache', max_bytes: int = 1024 * 1024 * 1024,
+                 offline: bool = False, max_age: float = 0):
+        """
+        Args:
+            cache_dir: Directory holding the cached bodies and the index
+            max_bytes: Total size of cached bodies before LRU eviction kicks in
+            offline: Serve only from the cache and never touch the network
+            max_age: Seconds during which an entry is served without revalidation
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._dirty = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._total = sum(entry['size'] for entry in self._index.values())
+
+    def get(self, url: str, fetch: Callable[..., requests.Response],
+            params: Optional[Dict] = None) -> requests.Response:
+        """
+        Return the response for `url`, from the cache when possible.
+
+        `fetch(url, params=..., headers=...)` performs the actual network
+        request; it is only called on a miss or to revalidate a stale entry.
+        """
+        full_url = requests.Request('GET', url, params=params).prepare().url
+        key = hashlib.sha256(full_url.encode()).hexdigest()
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry and not os.path.exists(self._body_path(key)):
+                self._drop(key)
+                entry = None
+
+        if entry and (self.offline or time.time() - entry['stored'] < self.max_age):
+            response = self._hit(key, entry)
+            if response is not None:
+                return response
+            entry = None
+        if self.offline:
+            raise OfflineCacheMiss(f"{full_url} is not cached (offline mode)")
+
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = fetch(url, params=params, headers=headers)
+        if response.status_code == 304 and entry:
+            with self._lock:
+                entry['stored'] = time.time()
+            cached = self._hit(key, entry)
+            if cached is not None:
+                return cached
+            # Evicted while revalidating: fetch the body unconditionally
+            response = fetch(url, params=params, headers={})
+        if response.status_code == 200:
+            self._store(key, full_url, response)
+        return response
+
+    def close(self):
+        """Flush the index to disk."""
+        with self._lock:
+            self._save_index()
+
+    def _hit(self, key: str, entry: Dict) -> Optional[requests.Response]:
+        try:
+            with open(self._body_path(key), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            entry['accessed'] = time.time()
+            self._mark_dirty()
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict(entry.get('headers', {}))
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = body
+        return response
+
+    def _store(self, key: str, full_url: str, response: requests.Response):
+        body = response.content
+        tmp_path = self._body_path(key) + f'.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, self._body_path(key))
+
+        headers = {name: response.headers[name] for name in self.STORED_HEADERS
+                   if name in response.headers}
+        now = time.time()
+        with self._lock:
+            if key in self._index:
+                self._total -= self._index[key]['size']
+            self._index[key] = {
+                'url': full_url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'headers': headers,
+                'size': len(body),
+                'stored': now,
+                'accessed': now,
+            }
+            self._total += len(body)
+            self._evict()
+            self._mark_dirty()
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k]['accessed']):
+            if self._total <= self.max_bytes:
+                break
+            self._drop(key)
+            try:
+                os.remove(self._body_path(key))
+            except FileNotFoundError:
+                pass
+
+    def _drop(self, key: str):
+        entry = self._index.pop(key)
+        self._total -= entry['size']
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        self._dirty += 1
+        if self._dirty >= self.SAVE_EVERY:
+            self._save_index()
+
+    def _body_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_index(self):
+        path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._index, f)
+        os.replace(path + '.tmp', path)
+        self._dirty = 0
@@ -0,0 +1,207 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import EmptyPoolError
+from urllib3.util import make_headers
+from .metrics import metrics
+
+# HTTP/2 needs httpx with its h2 extra; without it the client stays on HTTP/1.1.
+try:
+    import httpx
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class _BlockingAdapter(HTTPAdapter):
+    """
+    An adapter whose pools make a request wait for a free connection, but
+    for no more than `pool_timeout` seconds (requests itself waits forever).
+    """
+
+    def __init__(self, pool_timeout: float, **kwargs):
+        self.pool_timeout = pool_timeout
+        super().__init__(pool_block=True, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: _timed_pool(pool_class, self.pool_timeout)
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+def _timed_pool(pool_class, pool_timeout: float):
+    class TimedPool(pool_class):
+        def urlopen(self, *args, **kwargs):
+            if kwargs.get('pool_timeout') is None:
+                kwargs['pool_timeout'] = pool_timeout
+            return super().urlopen(*args, **kwargs)
+
+    return TimedPool
+
+
+@contextmanager
+def _requests_errors():
+    """Map httpx errors onto the requests ones the callers handle."""
+    try:
+        yield
+    except httpx.TimeoutException as e:
+        raise requests.Timeout(str(e)) from e
+    except httpx.TransportError as e:
+        raise requests.ConnectionError(str(e)) from e
+
+
+class _HTTP2Body:
+    """
+    A streamed httpx body as the file-like `raw` of a `requests.Response`,
+    so `iter_content` reads it as it arrives instead of all at once.
+    """
+
+    def __init__(self, result: 'httpx.Response'):
+        self._result = result
+        self._chunks = result.iter_bytes()
+        self._buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        with _requests_errors():
+            while size < 0 or len(self._buffer) < size:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self._result.close()
+
+
+class HTTPClient:
+    """
+    Pooled HTTP client shared by the scrapers and the image optimizer.
+
+    Connections are kept alive in one pool per host, so the pages of a blog
+    and the thousands of images on its CDN each pay the TCP and TLS
+    handshake once per pooled connection instead of once per request.
+    Every request gets a timeout and advertises compressed encodings. With
+    `http2=True` (and httpx installed), requests are multiplexed over one
+    HTTP/2 connection per host instead.
+
+    Responses are always `requests.Response` objects, whatever the backend,
+    and `stream=True` leaves the body unread on both. Requests, response time and bytes received are recorded per host.
+    """
+
+    def __init__(self, pool_maxsize: int = 10, pool_connections: int = 10,
+                 timeout: Optional[Timeout] = (10, 60), http2: bool = False, compression: bool = True,
+                 user_agent: Optional[str] = None, per_host_limit: Optional[int] = None,
+                 pool_timeout: float = 300):
+        """
+        Args:
+            pool_maxsize: Connections kept alive per host; should be at least
+                the number of threads hitting one host
+            pool_connections: Number of hosts whose pools are kept
+            timeout: Seconds to connect and to wait for data, or one number
+                for both (None = wait forever)
+            http2: Use HTTP/2 when httpx is installed
+            compression: Advertise gzip/deflate (and brotli when installed)
+            user_agent: Optional User-Agent header
+            per_host_limit: Most connections open to one host at a time;
+                further requests wait for a free one (None = no limit).
+                Not enforced over HTTP/2, which uses one connection per host.
+            pool_timeout: Seconds a request waits for a free connection
+                under `per_host_limit` before failing with ConnectionError
+        """
+        self.timeout = timeout
+        self.headers = {
+            'Accept-Encoding': make_headers(accept_encoding=True)['accept-encoding'] if compression else 'identity',
+        }
+        if user_agent:
+            self.headers['User-Agent'] = user_agent
+
+        self.http2 = http2 and HTTP2_AVAILABLE
+        if http2 and not HTTP2_AVAILABLE:
+            print("HTTP/2 needs httpx[http2]; falling back to HTTP/1.1.")
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        if per_host_limit:
+            # A blocking pool of that size: a request waits until a connection is returned
+            adapter = _BlockingAdapter(pool_timeout, pool_connections=pool_connections, pool_maxsize=per_host_limit)
+        else:
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._http2_client = None
+        if self.http2:
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            self._http2_client = httpx.Client(
+                http2=True, headers=self.headers, follow_redirects=True,
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(max_connections=pool_maxsize * pool_connections,
+                                    max_keepalive_connections=pool_maxsize * pool_connections))
+
+    def get(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+            stream: bool = False) -> requests.Response:
+        """GET `url` over a pooled connection."""
+        host = urlparse(url).netloc
+        start = time.perf_counter()
+        if self._http2_client is not None:
+            response = self._get_http2(url, params, headers, stream)
+        else:
+            try:
+                response = self.session.get(url, params=params, headers=headers, stream=stream,
+                                            timeout=self.timeout)
+            except EmptyPoolError as e:
+                raise requests.ConnectionError(f"no free connection to {host}: {e}") from e
+        metrics.add('requests', host=host)
+        metrics.add('request_seconds', time.perf_counter() - start, host=host)
+        # Bytes on the wire; a streamed body is not read yet, so trust its Content-Length
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit():
+            metrics.add('bytes', int(length), host=host)
+        elif not stream:
+            metrics.add('bytes', len(response.content), host=host)
+        return response
+
+    def set_cookie(self, name: str, value: str, domain: str):
+        self.session.cookies.set(name, value, domain=domain)
+        if self._http2_client is not None:
+            self._http2_client.cookies.set(name, value, domain=domain)
+
+    def close(self):
+        self.session.close()
+        if self._http2_client is not None:
+            self._http2_client.close()
+
+    def _get_http2(self, url: str, params: Optional[Dict], headers: Optional[Dict],
+                   stream: bool) -> requests.Response:
+        with _requests_errors():
+            request = self._http2_client.build_request('GET', url, params=params, headers=headers)
+            result = self._http2_client.send(request, stream=stream)
+
+        response = requests.Response()
+        response.status_code = result.status_code
+        response.url = str(result.url)
+        response.reason = result.reason_phrase
+        response.headers = CaseInsensitiveDict(result.headers)
+        # httpx already decoded the body, so its encoding header no longer applies
+        response.headers.pop('Content-Encoding', None)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        if stream:
+            # Read (and the size caps of the callers enforced) chunk by chunk; closing the response closes the stream
+            response.raw = _HTTP2Body(result)
+        else:
+            response._content = result.content
+        return response
@@ -0,0 +1,106 @@
+import cProfile
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+SCOPES = ('stage', 'host', 'post')
+
+
+class Metrics:
+    """
+    Thread-safe counters and timers for one run, per stage, host and post.
+
+    Every value is a sum: `add('bytes', n, host=...)` adds to the bytes of
+    that host, and `timer('parse_seconds', post=url)` adds the time spent
+    in the block to that post. Stages can also be profiled with cProfile;
+    since a stage may be entered many times (scraping and image
+    optimization are interleaved), each stage keeps one profiler that is
+    switched on whenever the stage runs. cProfile only sees the thread that
+    enters the stage, not worker threads or processes.
+
+    The scrapers, the HTTP layer and the PDF pipeline all record into the
+    module-level `metrics` instance.
+    """
+
+    def __init__(self):
+        self._values: Dict[str, Dict[str, Dict[str, float]]] = {
+            scope: defaultdict(lambda: defaultdict(int)) for scope in SCOPES}
+        self._lock = threading.Lock()
+        self._profilers: Dict[str, cProfile.Profile] = {}
+        self.profile_dir: Optional[str] = None
+
+    def enable_profiling(self, profile_dir: str):
+        """Profile every stage from now on; `write_profiles` dumps them to `profile_dir`."""
+        self.profile_dir = profile_dir
+
+    def add(self, name: str, value: float = 1, stage: Optional[str] = None, host: Optional[str] = None,
+            post: Optional[str] = None):
+        """Add `value` to counter `name` of the given stage, host and/or post."""
+        with self._lock:
+            for scope, key in (('stage', stage), ('host', host), ('post', post)):
+                if key is not None:
+                    self._values[scope][key][name] += value
+
+    @contextmanager
+    def timer(self, name: str, stage: Optional[str] = None, host: Optional[str] = None,
+              post: Optional[str] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, stage=stage, host=host, post=post)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time (and profile, if enabled) a block as part of stage `name`."""
+        profiler = None
+        if self.profile_dir is not None:
+            with self._lock:
+                profiler = self._profilers.setdefault(name, cProfile.Profile())
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            self.add('seconds', time.perf_counter() - start, stage=name)
+
+    def report(self) -> Dict[str, Any]:
+        """The collected values as {'stages': ..., 'hosts': ..., 'posts': ...}."""
+        with self._lock:
+            return {f'{scope}s': {key: dict(values) for key, values in self._values[scope].items()}
+                    for scope in SCOPES}
+
+    def write_report(self, path: str):
+        """Write the report as CSV (scope,key,metric,value rows) if `path` ends in .csv, else as JSON."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        report = self.report()
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['scope', 'key', 'metric', 'value'])
+                for scope in SCOPES:
+                    for key, values in report[f'{scope}s'].items():
+                        for metric, value in sorted(values.items()):
+                            writer.writerow([scope, key, metric, value])
+        else:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    def write_profiles(self):
+        """Dump one `<stage>.prof` file per profiled stage (open with pstats or snakeviz)."""
+        if self.profile_dir is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for name, profiler in self._profilers.items():
+            profiler.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+
+
+metrics = Metrics()
@@ -0,0 +1,25 @@
+from bs4 import BeautifulSoup
+
+# lxml is several times faster than the stdlib parser; use it when installed.
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+
+def make_soup(markup) -> BeautifulSoup:
+    """Parse a page or an HTML fragment with the fastest available backend."""
+    return BeautifulSoup(markup, HTML_PARSER)
+
+
+def fragment_html(soup: BeautifulSoup) -> str:
+    """
+    Serialize a soup parsed from a fragment.
+
+    lxml wraps fragments in <html><body>, which must not end up inside the
+    PDF template, so only the body contents are returned in that case.
+    """
+    if HTML_PARSER == 'lxml' and soup.body is not None:
+        return soup.body.decode_contents()
+    return str(soup)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import re
+from typing import Iterator, Dict, Any, List
+from urllib.parse import urlparse
+
+
+def blog_dir_name(blog_url: str) -> str:
+    """File-system-safe name for the per-blog state of `blog_url`."""
+    parsed = urlparse(blog_url)
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', parsed.netloc + parsed.path).strip('_') or 'blog'
+
+
+class PostStore:
+    """
+    Local store of scraped posts, keyed by canonical URL.
+
+    Each post is kept in its own JSON file; `index.json` holds the archive
+    order (newest first) and the per-post metadata (title, date, published
+    timestamp and the raw archive fields), so the scrapers can tell which
+    posts they have already seen without loading any post body.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(os.path.join(self.directory, 'posts'), exist_ok=True)
+        index = self._load_index()
+        self._order: List[str] = index.get('order', [])
+        self._meta: Dict[str, Dict[str, Any]] = index.get('posts', {})
+        # The posts stored by earlier runs, which are all a listing may stop at:
+        # a post listed twice in this run (e.g. shifted pages) is not the end
+        self._known = frozenset(self._meta)
+        self._new: List[str] = []
+
+    @classmethod
+    def for_blog(cls, store_dir: str, blog_url: str) -> 'PostStore':
+        """Open the store of one blog inside `store_dir`."""
+        return cls(os.path.join(store_dir, blog_dir_name(blog_url)))
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._meta
+
+    def __len__(self) -> int:
+        return len(self._meta)
+
+    def known(self, url: str) -> bool:
+        """True if `url` was stored by an earlier run."""
+        return url in self._known
+
+    def add(self, post: Dict[str, Any]):
+        """Store a newly scraped post. Posts must be added newest first."""
+        url = post['url']
+        file_name = hashlib.sha1(url.encode()).hexdigest() + '.json'
+        with open(os.path.join(self.directory, 'posts', file_name), 'w') as f:
+            json.dump(post, f)
+
+        self._meta[url] = {
+            'file': file_name,
+            'title': post.get('title', ''),
+            'date': post.get('date', ''),
+            'published': post.get('published', ''),
+            'archive': post.get('archive', {}),
+        }
+        if url in self._new:
+            self._new.remove(url)
+        self._new.append(url)
+
+    def save(self):
+        """Merge this run's posts in front of the stored ones and write the index."""
+        self._order = self._merged_order()
+        self._new = []
+        path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'order': self._order, 'posts': self._meta}, f)
+        os.replace(path + '.tmp', path)
+
+    def posts(self) -> Iterator[Dict[str, Any]]:
+        """Yield the stored posts, this run's unsaved ones included, newest first."""
+        for url in self._merged_order():
+            with open(os.path.join(self.directory, 'posts', self._meta[url]['file'])) as f:
+                yield json.load(f)
+
+    def _merged_order(self) -> List[str]:
+        new = set(self._new)
+        return self._new + [url for url in self._order if url not in new]
+
+    def _load_index(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.directory, self.INDEX_FILE)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
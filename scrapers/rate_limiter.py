@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket shared by every worker of a scraper.
+
+    It also holds a shared backoff deadline, so a 429 seen by one worker
+    pauses all of them instead of only the one that was throttled.
+
+    The rate adapts AIMD-style: every healthy response adds a little to it
+    (up to `max_rate`), and every throttled response halves it (down to
+    `min_rate`). A limiter created with `rate=None` does not limit at all
+    until the server first pushes back; it then starts from half the rate
+    it was actually sending at, and ramps back up to at most that rate.
+    """
+
+    # Requests remembered to measure the actual request rate
+    HISTORY = 20
+
+    def __init__(self, rate: Optional[float] = 0.5, burst: int = 1, max_rate: Optional[float] = None,
+                 min_rate: float = 0.05, increase: float = 0.05, decrease: float = 0.5):
+        """
+        Args:
+            rate: Initial number of requests per second (None = unlimited)
+            burst: Maximum number of requests that may be issued back to back
+            max_rate: Highest rate reached by ramping up (None = never ramp up)
+            min_rate: Lowest rate reached by backing off
+            increase: Requests per second added for every second's worth of
+                healthy responses
+            decrease: Factor applied to the rate on a throttled response
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._history = deque(maxlen=self.HISTORY)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be issued."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self.rate is None:
+                    self._history.append(now)
+                    return
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self._history.append(now)
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self, seconds: float):
+        """Pause all workers for at least `seconds` (e.g. after a 429)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._last = self._blocked_until
+
+    def record_success(self):
+        """Additive increase: ramp the rate up after a healthy response."""
+        with self._lock:
+            if self.rate is None or self.max_rate is None or self.rate >= self.max_rate:
+                return
+            # Dividing by the rate makes the ramp linear in time rather than
+            # in requests, whatever the current rate.
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def record_throttle(self):
+        """Multiplicative decrease: slow down after a throttled response."""
+        with self._lock:
+            rate = self.rate
+            if rate is None:
+                rate = self._observed_rate()
+                if rate is None:
+                    return
+                # Ramp back up towards, but not past, the rate that was throttled
+                if self.max_rate is None:
+                    self.max_rate = rate
+            self.rate = max(self.min_rate, rate * self.decrease)
+            self._tokens = min(self._tokens, 1.0)
+
+    def _observed_rate(self) -> Optional[float]:
+        if len(self._history) < 2:
+            return None
+        elapsed = self._history[-1] - self._history[0]
+        return (len(self._history) - 1) / elapsed if elapsed > 0 else None
+
+
+class HostRateLimiters:
+    """
+    One `RateLimiter` per host, for scrapers running side by side.
+
+    Blogs served from the same host then share one request budget and one
+    backoff, so scraping several of them at once is no less polite than
+    scraping one.
+    """
+
+    def __init__(self):
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url: str, rate: Optional[float], max_rate: Optional[float] = None) -> RateLimiter:
+        """The limiter of `url`'s host, created with `rate` and `max_rate` by its first caller."""
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = RateLimiter(rate=rate, max_rate=max_rate)
+            return self._limiters[host]
@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+import requests
+from .metrics import metrics
+from .rate_limiter import RateLimiter
+
+
+class RequestScheduler:
+    """
+    Issues a scraper's requests through its rate limiter and retries the
+    ones that fail transiently.
+
+    Throttled responses (429, or 503 with a Retry-After header) pause every
+    worker through the shared limiter and lower its rate; other server
+    errors and connection errors only delay the request that hit them.
+    The wait is the server's Retry-After when it sends one, and exponential
+    backoff with jitter otherwise. Retries are capped per request and in
+    total, so a blog that keeps failing gives up instead of stalling.
+    Retries, rate limiter waits and backoff sleeps are recorded per host.
+    """
+
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, limiter: Optional[RateLimiter] = None, max_retries: int = 4,
+                 max_total_retries: int = 100, base_delay: float = 1.0, max_delay: float = 120.0):
+        """
+        Args:
+            limiter: Rate limiter shared by the workers (None = no limit and
+                no shared backoff)
+            max_retries: Retries of a single request
+            max_total_retries: Retries of all requests together
+            base_delay: Backoff before the first retry, doubled on every
+                further retry
+            max_delay: Longest wait; a longer Retry-After gives up instead
+        """
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.max_total_retries = max_total_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def send(self, url: str, request: Callable[[], requests.Response]) -> requests.Response:
+        """
+        Call `request()` until it succeeds or retries run out.
+
+        Returns the last response, so callers still see a final 429 or 5xx
+        through `raise_for_status`. A connection error is re-raised once
+        retries run out.
+        """
+        host = urlparse(url).netloc
+        attempt = 0
+        while True:
+            if self.limiter:
+                with metrics.timer('rate_limit_wait_seconds', host=host):
+                    self.limiter.acquire()
+            try:
+                response = request()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not self._take_retry(attempt):
+                    raise
+                delay = self._backoff(attempt)
+                print(f"Error fetching {url}: {e}. Retrying in {delay:.1f}s...")
+                metrics.add('retries', host=host)
+                with metrics.timer('retry_sleep_seconds', host=host):
+                    time.sleep(delay)
+                attempt += 1
+                continue
+
+            if response.status_code not in self.RETRY_STATUSES:
+                if self.limiter:
+                    self.limiter.record_success()
+                return response
+
+            retry_after = self._retry_after(response)
+            throttled = response.status_code == 429 or retry_after is not None
+            if throttled and self.limiter:
+                self.limiter.record_throttle()
+            if retry_after is not None and retry_after > self.max_delay:
+                print(f"{url} asked to retry after {retry_after:.0f}s, giving up.")
+                return response
+            if not self._take_retry(attempt):
+                print(f"Giving up on {url} after {attempt} retries (HTTP {response.status_code}).")
+                return response
+
+            delay = retry_after if retry_after is not None else self._backoff(attempt)
+            response.close()
+            metrics.add('retries', host=host)
+            if throttled:
+                metrics.add('throttled', host=host)
+            if throttled and self.limiter:
+                print(f"Rate limit hit for {url}. Backing off for {delay:.1f} seconds...")
+                self.limiter.backoff(delay)
+            else:
+                print(f"HTTP {response.status_code} for {url}. Retrying in {delay:.1f}s...")
+                with metrics.timer('retry_sleep_seconds', host=host):
+                    time.sleep(delay)
+            attempt += 1
+
+    def _take_retry(self, attempt: int) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        with self._lock:
+            if self.retries >= self.max_total_retries:
+                return False
+            self.retries += 1
+            return True
+
+    def _backoff(self, attempt: int) -> float:
+        # "Equal jitter": at least half the exponential delay, so workers
+        # that failed together spread out without retrying immediately.
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> Optional[float]:
+        """Parse Retry-After, which is either seconds or an HTTP date."""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
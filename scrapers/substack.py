@@ -1,67 +1,87 @@
-from .base_scraper import BaseScraper
-from typing import Iterator, Dict, Any
-import requests
-from bs4 import BeautifulSoup
-import time
-import random
+from .base_scraper import BaseScraper, Entry
+from .rate_limiter import RateLimiter
+from .http_cache import HTTPCache
+from .http_client import HTTPClient
+from .crawl_journal import CrawlJournal
+from .post_store import PostStore
+from typing import Iterator, Dict, Any, List, Optional, Tuple
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from .parsing import make_soup
+from .cleaning import Rule
+from .metrics import metrics
 
 class SubstackScraper(BaseScraper):
-    def __init__(self, start_url: str, session_cookies: dict = None):
+    CLEANING_RULES = [
+        # Remove share buttons, subscribe widgets, button wrappers
+        # Also remove "grey box" links (embedded posts/restacks)
+        Rule('widgets', classes=('share-dialog', 'subscribe-widget', 'button-wrapper', 'embedded-post-wrap',
+                                 'embedded-post', 'tweet-embed', 'instagram-media', 'image-link-expand',
+                                 'caption-is-link')),
+        # Remove elements that look like restack buttons (often just links with icons)
+        Rule('link-buttons', tags=('button',), attrs=(('aria-label', 'Link'),)),
+        Rule('image-buttons', tags=('button',), classes=('restack-image', 'view-image')),
+        # Unwrap images from links
+        # The user wants images to not be hyperlinks
+        Rule('image-links', action='unwrap', tags=('a',), when='has_image'),
+        # Remove empty links that might be left over (often the "grey boxes" are links wrapping nothing or SVGs)
+        Rule('empty-links', tags=('a',), when='empty'),
+    ]
+    CONTENT_CLASS = 'available-content'
+
+    def __init__(self, start_url: str, session_cookies: dict = None, workers: int = 1,
+                 requests_per_second: float = 0.5, http_cache: Optional[HTTPCache] = None,
+                 post_store: Optional[PostStore] = None, max_requests_per_second: Optional[float] = None,
+                 max_retries: int = 4, http_client: Optional[HTTPClient] = None,
+                 archive_page_size: int = 50, archive_workers: int = 1, fetch_mode: str = 'api',
+                 journal: Optional[CrawlJournal] = None, rate_limiter: Optional[RateLimiter] = None):
         """
         Initialize Substack scraper with optional authentication.
         
         Args:
             start_url: The base URL of the Substack blog
             session_cookies: Optional dict with 'substack.sid' and 'substack.lli' cookies
+            workers: Number of posts fetched concurrently (1 = sequential)
+            requests_per_second: Initial request rate shared by all workers
+            http_cache: Optional on-disk cache for archive and post responses
+            post_store: Optional store of previously scraped posts; the archive
+                walk stops at the first post found in it
+            max_requests_per_second: Rate the limiter may ramp up to while
+                responses are healthy (None = keep the initial rate)
+            max_retries: Retries of a throttled or failed request
+            http_client: Optional pooled client shared with other components
+            archive_page_size: Posts requested per archive API page
+            archive_workers: Archive pages fetched concurrently, ahead of
+                the post workers
+            fetch_mode: 'api' takes post bodies from the JSON posts API and
+                only scrapes a post's HTML page when its body is missing;
+                'html' always scrapes the post pages
+            journal: Optional checkpoint journal to record progress to and
+                resume from
+            rate_limiter: Optional limiter shared with other scrapers of the
+                same host; replaces the request rate arguments
         """
-        super().__init__(start_url)
+        super().__init__(start_url, http_cache=http_cache, post_store=post_store, http_client=http_client,
+                         workers=workers, journal=journal, fetch_mode=fetch_mode,
+                         requests_per_second=requests_per_second, max_requests_per_second=max_requests_per_second,
+                         max_retries=max_retries, rate_limiter=rate_limiter)
         self.session_cookies = session_cookies or {}
+        self.archive_page_size = max(1, archive_page_size)
+        self.archive_workers = max(1, archive_workers)
         
-        # Create a requests session to maintain cookies
-        self.session = requests.Session()
         if self.session_cookies:
             # Set cookies for authentication
             for cookie_name, cookie_value in self.session_cookies.items():
-                self.session.cookies.set(cookie_name, cookie_value, domain='.substack.com')
+                self.http_client.set_cookie(cookie_name, cookie_value, domain='.substack.com')
             print("✓ Using authenticated session for Substack")
         else:
             print("ℹ No authentication provided - paywalled content may be truncated")
     
 
-    def get_posts(self) -> Iterator[Dict[str, Any]]:
-        offset = 0
-        limit = 12
-        base_api_url = self.start_url.rstrip('/') + '/api/v1/archive'
-        
-        while True:
-            print(f"Fetching posts from offset {offset}...")
-            params = {
-                'sort': 'new',
-                'search': '',
-                'offset': offset,
-                'limit': limit
-            }
-            
-            try:
-                # Add delay
-                time.sleep(random.uniform(1, 3))
-                response = self.session.get(base_api_url, params=params)
-
-                
-                if response.status_code == 429:
-                    print("Rate limit hit. Sleeping for 30 seconds...")
-                    time.sleep(30)
-                    continue
-                    
-                response.raise_for_status()
-                data = response.json()
-            except Exception as e:
-                print(f"Error fetching API: {e}")
-                break
-            
-            if not data:
-                break
-                
+    def _iter_entries(self, cursor: Optional[Dict[str, Any]]) -> Iterator[Entry]:
+        """List the archive from the cursor's offset; each page ends with the next offset."""
+        for data, next_offset in self._iter_archive_pages(cursor['offset'] if cursor else 0):
             for post in data:
                 post_url = post.get('canonical_url')
                 if not post_url:
@@ -70,78 +90,151 @@ class SubstackScraper(BaseScraper):
                         post_url = f"{self.start_url.rstrip('/')}/p/{slug}"
                 
                 if post_url:
-                    yield self._scrape_single_post(post_url)
-            
-            if len(data) < limit:
-                break
-                
-            offset += limit
+                    if self._is_known(post_url):
+                        print(f"Reached already stored post {post_url}, stopping.")
+                        return
+                    yield post_url, post, None
+            yield None, None, {'offset': next_offset}
 
-    def _scrape_single_post(self, url: str) -> Dict[str, Any]:
-        print(f"Fetching {url}...")
-        retries = 3
-        while retries > 0:
+    def _fetch_entry(self, url: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return self._with_archive_metadata(self._fetch_post(url, entry), entry)
+
+    def _with_archive_metadata(self, post: Dict[str, Any], entry: Dict[str, Any]) -> Dict[str, Any]:
+        if post:
+            post['published'] = entry.get('post_date', '')
+            post['archive'] = {key: entry.get(key) for key in ('id', 'slug', 'post_date', 'audience')}
+        return post
+
+    def _iter_archive_pages(self, offset: int = 0) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+        """
+        Yield (posts, next offset) for the archive API pages from `offset` on.
+
+        In API mode the pages come from the posts endpoint, which takes the
+        same paging parameters but includes each post's `body_html`, so most
+        bodies arrive in batches with the listing. The first page is fetched
+        alone: the API may return fewer posts than asked for, and its length
+        is the real page size. After that, `archive_workers` offsets are
+        fetched concurrently, so listing a big archive doesn't wait on one
+        round trip per page.
+        """
+        first = self._fetch_archive_page(offset, self.archive_page_size)
+        if first is None:
+            self._listing_error(f"Stopped listing the archive at offset {offset}.")
+        if not first:
+            return
+        limit = len(first)
+        offset += limit
+        yield first, offset
+
+        with ThreadPoolExecutor(max_workers=self.archive_workers) as executor:
+            pending = deque()
+            next_offset = offset
             try:
-                time.sleep(random.uniform(1, 3))
-                response = self.session.get(url)
+                while True:
+                    while len(pending) < self.archive_workers:
+                        pending.append(executor.submit(self._fetch_archive_page, next_offset, limit))
+                        next_offset += limit
+                    data = pending.popleft().result()
+                    if data is None:
+                        self._listing_error(f"Stopped listing the archive at offset {offset}.")
+                    if not data:
+                        return
+                    offset += len(data)
+                    yield data, offset
+                    if len(data) < limit:
+                        return
+            finally:
+                # Stopping early (end of archive, error or known post)
+                for future in pending:
+                    future.cancel()
 
-                
-                if response.status_code == 429:
-                    print(f"Rate limit hit for {url}. Sleeping for 30 seconds...")
-                    time.sleep(30)
-                    retries -= 1
-                    continue
-                
+    def _fetch_archive_page(self, offset: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Fetch one archive API page; None on error."""
+        print(f"Fetching posts from offset {offset}...")
+        params = {
+            'sort': 'new',
+            'search': '',
+            'offset': offset,
+            'limit': limit
+        }
+        try:
+            endpoint = 'posts' if self.fetch_mode == 'api' else 'archive'
+            response = self._get(f"{self.start_url.rstrip('/')}/api/v1/{endpoint}", params=params)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            print(f"Error fetching API: {e}")
+            return None
+
+    def _fetch_post(self, url: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        if self.fetch_mode == 'api':
+            post = self._post_from_api(url, entry)
+            if post:
+                return post
+        return self._scrape_single_post(url)
+
+    def _post_from_api(self, url: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the post from its JSON, without loading the post page.
+
+        Uses the body from the listing when present, otherwise the single
+        post endpoint. Returns {} when neither has a body (e.g. a paywalled
+        post without a subscriber session), so the HTML page is scraped.
+        """
+        body = entry.get('body_html')
+        if not body and entry.get('slug'):
+            print(f"Fetching {url} from the API...")
+            try:
+                response = self._get(f"{self.start_url.rstrip('/')}/api/v1/posts/{entry['slug']}")
                 response.raise_for_status()
-                break
+                metrics.add('bytes', len(response.content), post=url)
+                entry = {**entry, **response.json()}
+                body = entry.get('body_html')
             except Exception as e:
-                print(f"Error fetching {url}: {e}")
+                print(f"Error fetching {url} from the API: {e}")
                 return {}
-        
-        if retries == 0:
-            print(f"Failed to fetch {url} after retries.")
+        if not body:
             return {}
 
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        title_elem = soup.select_one('h1.post-title, h1.pencraft-title')
-        title = title_elem.get_text(strip=True) if title_elem else "No Title"
-        
-        content_elem = soup.select_one('div.available-content, div.body, div.markup')
-        
-        if content_elem:
-            # Clean fluff
-            # Remove share buttons, subscribe widgets, button wrappers
-            # Also remove "grey box" links (embedded posts/restacks)
-            # Common classes: .embedded-post-wrap, .embedded-post, .tweet-embed, .instagram-media
-            # New additions: .image-link-expand, .caption-is-link, .image-link
-            for fluff in content_elem.select('.share-dialog, .subscribe-widget, .button-wrapper, .embedded-post-wrap, .embedded-post, .tweet-embed, .instagram-media, .image-link-expand, .caption-is-link'):
-                fluff.decompose()
-            
-            # Remove elements that look like restack buttons (often just links with icons)
-            # Sometimes they are in `a` tags with specific classes or SVG children
-            # Also remove buttons with aria-label="Link" or specific classes
-            for btn in content_elem.find_all('button'):
-                if btn.get('aria-label') == 'Link' or 'restack-image' in btn.get('class', []) or 'view-image' in btn.get('class', []):
-                    btn.decompose()
-            
-            # Unwrap images from links
-            # The user wants images to not be hyperlinks
-            for img_link in content_elem.find_all('a'):
-                if img_link.find('img'):
-                    img_link.unwrap()
-            
-            # Remove empty links that might be left over (often the "grey boxes" are links wrapping nothing or SVGs)
-            for link in content_elem.find_all('a'):
-                if not link.get_text(strip=True) and not link.find('img'):
-                    link.decompose()
-
-            content = str(content_elem)
-        else:
-            content = ""
-        
-        date_elem = soup.select_one('div.post-date, div.pencraft-subtitle')
-        date = date_elem.get_text(strip=True) if date_elem else ""
+        return {
+            'title': entry.get('title') or "No Title",
+            'content': self._content_from_api(url, body),
+            'date': self._display_date(entry.get('post_date')),
+            'url': url
+        }
+
+    @staticmethod
+    def _display_date(post_date: Optional[str]) -> str:
+        """Format an API timestamp the way post pages show the date."""
+        if not post_date:
+            return ""
+        try:
+            return datetime.fromisoformat(post_date.replace('Z', '+00:00')).strftime('%b %d, %Y')
+        except ValueError:
+            return post_date
+
+    def _scrape_single_post(self, url: str) -> Dict[str, Any]:
+        print(f"Fetching {url}...")
+        try:
+            # Throttling and transient errors are retried by the scheduler
+            response = self._get(url)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Error fetching {url}: {e}")
+            return {}
+
+        metrics.add('bytes', len(response.content), post=url)
+        with metrics.timer('parse_seconds', stage='scrape', post=url):
+            soup = make_soup(response.content)
+
+            title_elem = soup.select_one('h1.post-title, h1.pencraft-title')
+            title = title_elem.get_text(strip=True) if title_elem else "No Title"
+
+            content_elem = soup.select_one('div.available-content, div.body, div.markup')
+            content = self._clean_content(content_elem) if content_elem else ""
+
+            date_elem = soup.select_one('div.post-date, div.pencraft-subtitle')
+            date = date_elem.get_text(strip=True) if date_elem else ""
 
         return {
             'title': title,
@@ -149,4 +242,3 @@ class SubstackScraper(BaseScraper):
             'date': date,
             'url': url
         }
-
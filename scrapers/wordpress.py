@@ -1,31 +1,338 @@
-from .base_scraper import BaseScraper
-from typing import Iterator, Dict, Any
+from .base_scraper import BaseScraper, Entry
+from .http_cache import HTTPCache
+from .http_client import HTTPClient
+from .crawl_journal import CrawlJournal
+from .post_store import PostStore
+from .rate_limiter import RateLimiter
+from typing import Iterator, Dict, Any, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import html
+import queue
+import threading
 import requests
-from bs4 import BeautifulSoup
+from .parsing import make_soup
+from .cleaning import Rule
+from .metrics import metrics
 
 class WordPressScraper(BaseScraper):
-    def get_posts(self) -> Iterator[Dict[str, Any]]:
-        url = self.start_url
+    CLEANING_RULES = [
+        # Remove share buttons, likes, etc.
+        Rule('share-widgets', classes=('sharedaddy', 'jp-relatedposts', 'wpcnt')),
+        # Unwrap images from links
+        Rule('image-links', action='unwrap', tags=('a',), when='has_image'),
+    ]
+    CONTENT_CLASS = 'entry-content'
+
+    # Largest page the REST API serves
+    REST_PAGE_SIZE = 100
+    REST_FIELDS = 'link,title,content,date'
+    # Relation of the <link> (and Link header) pointing at the REST API root
+    REST_LINK_REL = 'https://api.w.org/'
+
+    def __init__(self, start_url: str, workers: int = 1, index_lookahead: int = 2,
+                 requests_per_second: Optional[float] = None, http_cache: Optional[HTTPCache] = None,
+                 post_store: Optional[PostStore] = None, max_requests_per_second: Optional[float] = None,
+                 max_retries: int = 4, http_client: Optional[HTTPClient] = None,
+                 fetch_mode: str = 'api', rest_url: Optional[str] = None,
+                 journal: Optional[CrawlJournal] = None, rate_limiter: Optional[RateLimiter] = None):
+        """
+        Args:
+            start_url: The first index page of the blog
+            workers: Number of post pages fetched concurrently (1 = sequential)
+            index_lookahead: How many index pages the pagination stage may run
+                ahead of the post workers
+            requests_per_second: Optional initial request rate shared by both
+                stages (None = unlimited until the server throttles us)
+            http_cache: Optional on-disk cache for index and post pages
+            post_store: Optional store of previously scraped posts; pagination
+                stops at the first (non-sticky) post found in it
+            max_requests_per_second: Rate the limiter may ramp up to while
+                responses are healthy
+            max_retries: Retries of a throttled or failed request
+            http_client: Optional pooled client shared with other components
+            fetch_mode: 'api' reads the posts from the REST API, 100 per
+                request, when `start_url` is the site's front page, and
+                crawls the HTML pages otherwise or when the API is not
+                available; 'html' always crawls
+            rest_url: Root of the REST API (discovered from the start page
+                by default)
+            journal: Optional checkpoint journal to record progress to and
+                resume from
+            rate_limiter: Optional limiter shared with other scrapers of the
+                same host; replaces the request rate arguments
+        """
+        super().__init__(start_url, http_cache=http_cache, post_store=post_store, http_client=http_client,
+                         workers=workers, journal=journal, fetch_mode=fetch_mode,
+                         requests_per_second=requests_per_second, max_requests_per_second=max_requests_per_second,
+                         max_retries=max_retries, rate_limiter=rate_limiter)
+        self.index_lookahead = max(1, index_lookahead)
+        self.rest_url = rest_url
+
+    def _iter_entries(self, cursor: Optional[Dict[str, Any]]) -> Iterator[Entry]:
+        """
+        List the posts from the REST API, or crawl the index pages when the
+        API is not available or the start URL is not the site's front page.
+        Cursors are the next REST page or index URL.
+        """
+        if cursor and 'url' in cursor:
+            yield from self._crawl_entries(cursor['url'])
+            return
+        if self.fetch_mode == 'api':
+            page = cursor['page'] if cursor else 1
+            use_api = self._use_rest_api()
+            first = self._fetch_rest_page(page) if use_api else None
+            if first is not None:
+                yield from self._rest_entries(page, *first)
+                return
+            if cursor:
+                self._listing_error(f"Stopped listing the REST API at page {page}.")
+                return
+            if use_api:
+                print("WordPress REST API not available, crawling the HTML pages instead.")
+        yield from self._crawl_entries(self.start_url)
+
+    def _use_rest_api(self) -> bool:
+        """
+        Whether to list the posts from the REST API, finding its root first.
+
+        The API lists every post of the site, so it's only used when the
+        start URL is the site's front page; a category, tag or author
+        archive is crawled instead.
+        """
+        if not self.rest_url:
+            self.rest_url = self._discover_rest_url()
+            if not self.rest_url:
+                print("WordPress REST API not found, crawling the HTML pages instead.")
+                return False
+        if not self._is_front_page(self.rest_url):
+            print(f"{self.start_url} is not the site's front page, crawling its HTML pages instead of the REST API.")
+            return False
+        return True
+
+    def _discover_rest_url(self) -> Optional[str]:
+        """
+        The REST API root the start page links to, or None.
+
+        WordPress advertises it as <link rel="https://api.w.org/"> (and a
+        Link header), which also covers installs in a subdirectory and
+        sites without pretty permalinks (`?rest_route=/`).
+        """
+        print(f"Looking up the REST API of {self.start_url}...")
+        try:
+            response = self._get(self.start_url)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"Error fetching {self.start_url}: {e}")
+            return None
+        link = response.links.get(self.REST_LINK_REL)
+        if link:
+            return urljoin(self.start_url, link['url'])
+        tag = make_soup(response.content).find('link', rel=self.REST_LINK_REL, href=True)
+        return urljoin(self.start_url, tag['href']) if tag else None
+
+    def _is_front_page(self, rest_url: str) -> bool:
+        """True if the start URL is the home of the site whose REST API is at `rest_url`."""
+        start = urlsplit(self.start_url)
+        root = urlsplit(rest_url)
+        if root.netloc.lower() != start.netloc.lower():
+            # An API on another host (e.g. WordPress.com's) serves sites at their domain's root
+            home = '/'
+        elif 'rest_route=' in root.query:
+            home = root.path
+        else:
+            # The API root is one path segment below the home: /blog/wp-json/
+            home = root.path.rstrip('/').rsplit('/', 1)[0]
+        return not start.query and start.path.rstrip('/') == home.rstrip('/')
+
+    def _rest_endpoint(self, route: str, params: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """URL and parameters of a REST route, for both forms of the API root."""
+        root = urlsplit(self.rest_url)
+        if 'rest_route=' in root.query:
+            return urlunsplit(root._replace(query='')), {'rest_route': f'/{route}', **params}
+        return urljoin(self.rest_url, route), params
+
+    def _fetch_entry(self, url: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        # REST entries already hold the post; crawled ones only the link
+        if 'content' in entry:
+            try:
+                return self._post_from_rest(entry)
+            except Exception as e:
+                print(f"Error reading post {url}: {e}")
+                return {}
+        return self._scrape_single_post(url)
+
+    def _rest_entries(self, first_number: int, first_items: List[Dict[str, Any]],
+                      total_pages: Optional[int]) -> Iterator[Entry]:
+        for number, items in self._iter_rest_pages(first_number, first_items, total_pages):
+            for item in items:
+                link = item.get('link')
+                if not link:
+                    continue
+                # The API lists sticky posts by date like the others, so the
+                # first stored post means the rest of the archive is known.
+                if self._is_known(link):
+                    print(f"Reached already stored post {link}, stopping.")
+                    return
+                yield link, item, None
+            yield None, None, {'page': number + 1}
+
+    def _iter_rest_pages(self, first_number: int, first_items: List[Dict[str, Any]],
+                         total_pages: Optional[int]) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        """
+        Yield (page number, posts) for the REST API pages in order.
+
+        The first response tells how many pages there are (X-WP-TotalPages),
+        so the rest are fetched `workers` at a time. Without that header,
+        pages are fetched one by one until a short one.
+        """
+        yield first_number, first_items
+        if total_pages is None:
+            number, items = first_number, first_items
+            while len(items) == self.REST_PAGE_SIZE:
+                number += 1
+                result = self._fetch_rest_page(number)
+                if result is None:
+                    self._listing_error(f"Stopped listing the REST API at page {number}.")
+                    return
+                items = result[0]
+                yield number, items
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            try:
+                for number in range(first_number + 1, total_pages + 1):
+                    pending.append((number, executor.submit(self._fetch_rest_page, number)))
+                    while len(pending) >= self.workers or (pending and number == total_pages):
+                        number_done, future = pending.popleft()
+                        result = future.result()
+                        if result is None:
+                            self._listing_error(f"Stopped listing the REST API at page {number_done}.")
+                            return
+                        yield number_done, result[0]
+            finally:
+                # Stopping early (error or known post)
+                for _, future in pending:
+                    future.cancel()
+
+    def _fetch_rest_page(self, page: int) -> Optional[Tuple[List[Dict[str, Any]], Optional[int]]]:
+        """Fetch one page of posts; returns (posts, total pages) or None on error."""
+        print(f"Fetching posts page {page} from the REST API...")
+        params = {
+            'per_page': self.REST_PAGE_SIZE,
+            'page': page,
+            '_fields': self.REST_FIELDS,
+        }
+        try:
+            response = self._get(*self._rest_endpoint('wp/v2/posts', params))
+            response.raise_for_status()
+            items = response.json()
+        except Exception as e:
+            print(f"Error fetching REST API page {page}: {e}")
+            return None
+        if not isinstance(items, list):
+            print(f"Unexpected REST API response for page {page}.")
+            return None
+        total_pages = response.headers.get('X-WP-TotalPages')
+        return items, int(total_pages) if total_pages and total_pages.isdigit() else None
+
+    def _post_from_rest(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        published = item.get('date') or ""
+        try:
+            date = datetime.fromisoformat(published).strftime('%B %d, %Y') if published else ""
+        except ValueError:
+            date = published
+        rendered = (item.get('content') or {}).get('rendered') or ""
+        return {
+            'title': html.unescape((item.get('title') or {}).get('rendered') or "") or "No Title",
+            'content': self._content_from_api(item.get('link'), rendered),
+            'date': date,
+            'published': published,
+            'url': item.get('link')
+        }
+
+    def _crawl_entries(self, url: str) -> Iterator[Entry]:
+        """Crawl the index pages from `url`; the post pages are scraped by `_fetch_entry`."""
+        pages = self._iter_index_pages(url) if self.workers == 1 else self._prefetch_index_pages(url)
+        for links, next_url in pages:
+            for link in links:
+                yield link, {}, None
+            if next_url:
+                yield None, None, {'url': next_url}
+
+    def _prefetch_index_pages(self, url: str) -> Iterator[Tuple[List[str], Optional[str]]]:
+        """
+        Pipeline: one thread walks pagination ahead into a bounded queue of
+        per-page link lists while the pool fetches the post pages.
+        """
+        pages = queue.Queue(maxsize=self.index_lookahead)
+        stop = threading.Event()
+        walker = threading.Thread(target=self._walk_index, args=(url, pages, stop), daemon=True)
+        walker.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    return
+                if isinstance(page, BaseException):
+                    raise page
+                yield page
+        finally:
+            stop.set()
+
+    def _walk_index(self, url: str, pages: queue.Queue, stop: threading.Event):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for page in self._iter_index_pages(url):
+                if not put(page):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(None)
+
+    def _iter_index_pages(self, url: str) -> Iterator[Tuple[List[str], Optional[str]]]:
+        """Walk the pagination from `url` and yield each index page's post links and the next page's URL."""
         while url:
             print(f"Fetching {url}...")
             try:
-                response = requests.get(url)
+                response = self._get(url)
                 response.raise_for_status()
             except requests.RequestException as e:
-                print(f"Error fetching {url}: {e}")
+                self._listing_error(f"Error fetching {url}: {e}")
                 break
 
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = make_soup(response.content)
             
             # Find all articles
+            links = []
             articles = soup.find_all('article')
             for article in articles:
                 title_elem = article.find(class_='entry-title')
                 if not title_elem:
                     continue
                 
-                title = title_elem.get_text(strip=True)
                 link = title_elem.find('a')['href'] if title_elem.find('a') else url
+
+                # Sticky posts stay on top of the first page, so only a stored
+                # regular post means the rest of the archive is known.
+                if self._is_known(link):
+                    if 'sticky' in article.get('class', []):
+                        continue
+                    print(f"Reached already stored post {link}, stopping.")
+                    yield links, None
+                    return
                 
                 # Fetch individual post page to get full content and avoid truncation
                 # Some themes show full content on index, others don't. Safer to fetch.
@@ -33,8 +340,7 @@ class WordPressScraper(BaseScraper):
                 # Let's check if the content is already full here. 
                 # Usually index pages have "Continue reading" or similar if truncated.
                 # For safety and quality, let's fetch the individual page.
-                
-                yield self._scrape_single_post(link)
+                links.append(link)
 
             # Pagination
             # Look for "Older posts" link
@@ -45,57 +351,53 @@ class WordPressScraper(BaseScraper):
             else:
                 url = None
 
+            yield links, url
+
     def _scrape_single_post(self, url: str) -> Dict[str, Any]:
         try:
-            response = requests.get(url)
+            response = self._get(url)
             response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
+            metrics.add('bytes', len(response.content), post=url)
+            with metrics.timer('parse_seconds', stage='scrape', post=url):
+                soup = make_soup(response.content)
             
-            # Try multiple selectors for title
-            title_elem = soup.select_one('.entry-title, h1.entry-title, h1.post-title')
-            if title_elem:
-                title = title_elem.get_text(strip=True)
-            else:
-                # Fallback to og:title
-                meta_title = soup.find('meta', property='og:title')
-                if meta_title:
-                    title = meta_title.get('content')
+                # Try multiple selectors for title
+                title_elem = soup.select_one('.entry-title, h1.entry-title, h1.post-title')
+                if title_elem:
+                    title = title_elem.get_text(strip=True)
                 else:
-                    # Fallback to page title
-                    page_title = soup.find('title')
-                    if page_title:
-                        title = page_title.get_text(strip=True).split('–')[0].strip() # Remove blog name if present
+                    # Fallback to og:title
+                    meta_title = soup.find('meta', property='og:title')
+                    if meta_title:
+                        title = meta_title.get('content')
                     else:
-                        # Fallback to URL slug
-                        title = url.split('/')[-2].replace('-', ' ').title()
+                        # Fallback to page title
+                        page_title = soup.find('title')
+                        if page_title:
+                            title = page_title.get_text(strip=True).split('–')[0].strip() # Remove blog name if present
+                        else:
+                            # Fallback to URL slug
+                            title = url.split('/')[-2].replace('-', ' ').title()
             
-            content_elem = soup.select_one('.entry-content')
+                content_elem = soup.select_one('.entry-content')
             
-            # Clean content
-            if content_elem:
-                # Remove share buttons, likes, etc.
-                for fluff in content_elem.select('.sharedaddy, .jp-relatedposts, .wpcnt'):
-                    fluff.decompose()
+                content = self._clean_content(content_elem) if content_elem else ""
                 
-                # Unwrap images from links
-                for img_link in content_elem.find_all('a'):
-                    if img_link.find('img'):
-                        img_link.unwrap()
-
-                content = str(content_elem)
-            else:
-                content = ""
-                
-            date_elem = soup.select_one('.entry-date')
-            date = date_elem.get_text(strip=True) if date_elem else ""
+                date_elem = soup.select_one('.entry-date')
+                date = date_elem.get_text(strip=True) if date_elem else ""
+                # Themes usually render the date as <time class="entry-date" datetime="...">
+                published = date_elem.get('datetime', '') if date_elem else ""
+                if not published:
+                    meta_published = soup.find('meta', property='article:published_time')
+                    published = meta_published.get('content', '') if meta_published else ""
 
             return {
                 'title': title,
                 'content': content,
                 'date': date,
+                'published': published,
                 'url': url
             }
         except Exception as e:
             print(f"Error scraping post {url}: {e}")
             return {}
-
@@ -0,0 +1,121 @@
+"""The rule-based Cleaner must clean post bodies exactly like the per-site code it replaced."""
+import pytest
+from bs4 import BeautifulSoup
+
+from scrapers.cleaning import Cleaner, Rule
+from scrapers.parsing import HTML_PARSER
+from scrapers.substack import SubstackScraper
+from scrapers.wordpress import WordPressScraper
+
+PARSERS = ['html.parser',
+           pytest.param('lxml', marks=pytest.mark.skipif(HTML_PARSER != 'lxml', reason='lxml is not installed'))]
+
+SUBSTACK_BODY = '''
+<div class="available-content"><div class="body markup">
+<h2 class="header-anchor-post">Intro<div class="pencraft"><div class="header-anchor-parent">
+<button aria-label="Link" class="pencraft"><svg><path d="M0"></path></svg></button></div></div></h2>
+<p>Some text with <a href="https://example.com">a link</a> and a note<a class="footnote-anchor" href="#footnote-1"
+id="footnote-anchor-1">1</a>.</p>
+<div class="captioned-image-container"><figure><a class="image-link image2 is-viewable-img" href="https://cdn/full.png">
+<div class="image2-inset"><picture><source srcset="https://cdn/a.webp 424w" type="image/webp">
+<img src="https://cdn/a.png" alt=""></picture><div class="image-link-expand"><div class="pencraft">
+<button class="pencraft restack-image"><svg></svg></button><button class="pencraft view-image"><svg></svg></button>
+</div></div></div></a><figcaption class="image-caption">A caption</figcaption></figure></div>
+<div class="subscription-widget-wrap"><div class="subscribe-widget"><form><input type="email"></form></div></div>
+<p class="button-wrapper"><a class="button primary" href="/subscribe"><span>Subscribe</span></a></p>
+<div class="embedded-post-wrap"><a class="embedded-post" href="/p/other"><div>Other post</div></a></div>
+<p><a href="https://example.com/empty"></a><a href="https://example.com/space"> <span> </span></a>
+<a href="https://example.com/icon"><svg><path d="M1"></path></svg></a><a href="x"><!-- only a comment --></a>
+<a href="y"><script>var tracking = 1;</script></a><a href="z"><style>p { color: red }</style></a></p>
+<a href="https://example.com/outer"><span>Outer <a href="https://example.com/inner"><img src="https://cdn/b.png"></a></span></a>
+<figure><a class="caption-is-link" href="/x">Linked caption</a></figure>
+<blockquote class="tweet-embed">A tweet</blockquote><button class="view-image other">View</button>
+<div class="footnote"><a class="footnote-number" href="#footnote-anchor-1" id="footnote-1">1</a>
+<div class="footnote-content"><p>The note.</p></div></div>
+</div></div>
+'''
+
+WORDPRESS_BODY = '''
+<div class="entry-content">
+<p>Text with <a href="https://example.com">a link</a>, <strong>bold</strong> and <a href="#more"></a>.</p>
+<figure class="wp-block-image size-large"><a href="https://example.com/wp-content/uploads/photo.jpg">
+<img src="https://example.com/wp-content/uploads/photo-1024x683.jpg" srcset="photo-300x200.jpg 300w"
+alt=""></a><figcaption>A <a href="https://example.com/credit">credited</a> photo</figcaption></figure>
+<div class="wp-block-gallery"><a href="https://i0.wp.com/example.com/a.jpg"><span><img src="a.jpg"></span></a>
+<a href="https://example.com/b"><script>document.write('<img src=b.jpg>')</script></a></div>
+<div class="sharedaddy sd-sharing-enabled"><div class="robots-nocontent sd-block sd-social">
+<h3 class="sd-title">Share this:</h3><ul><li><a class="share-twitter" href="?share=twitter">Twitter</a></li></ul>
+</div></div>
+<div id="jp-post-flair" class="sharedaddy sd-like-enabled"><div class="sharedaddy sd-block sd-like">Like</div></div>
+<div id="jp-relatedposts" class="jp-relatedposts"><h3 class="jp-relatedposts-headline"><em>Related</em></h3></div>
+<div class="wpcnt"><div class="wpa"><span class="wpa-about">Advertisements</span></div></div>
+<p><a href="https://example.com/stay"><img src="https://example.com/inline.png"> and text</a></p>
+</div>
+'''
+
+
+def substack_reference(content_elem) -> str:
+    """SubstackScraper._clean_content before the Cleaner."""
+    for fluff in content_elem.select('.share-dialog, .subscribe-widget, .button-wrapper, .embedded-post-wrap, '
+                                     '.embedded-post, .tweet-embed, .instagram-media, .image-link-expand, '
+                                     '.caption-is-link'):
+        fluff.decompose()
+    for btn in content_elem.find_all('button'):
+        if btn.get('aria-label') == 'Link' or 'restack-image' in btn.get('class', []) \
+                or 'view-image' in btn.get('class', []):
+            btn.decompose()
+    for img_link in content_elem.find_all('a'):
+        if img_link.find('img'):
+            img_link.unwrap()
+    for link in content_elem.find_all('a'):
+        if not link.get_text(strip=True) and not link.find('img'):
+            link.decompose()
+    return str(content_elem)
+
+
+def wordpress_reference(content_elem) -> str:
+    """WordPressScraper._clean_content before the Cleaner."""
+    for fluff in content_elem.select('.sharedaddy, .jp-relatedposts, .wpcnt'):
+        fluff.decompose()
+    for img_link in content_elem.find_all('a'):
+        if img_link.find('img'):
+            img_link.unwrap()
+    return str(content_elem)
+
+
+def cleaned(rules, body: str, selector: str, parser: str) -> str:
+    root = BeautifulSoup(body, parser).select_one(selector)
+    Cleaner(rules).clean(root)
+    return str(root)
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_substack_rules_match_reference(parser):
+    expected = substack_reference(BeautifulSoup(SUBSTACK_BODY, parser).select_one('div.available-content'))
+    assert cleaned(SubstackScraper.CLEANING_RULES, SUBSTACK_BODY, 'div.available-content', parser) == expected
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_wordpress_rules_match_reference(parser):
+    expected = wordpress_reference(BeautifulSoup(WORDPRESS_BODY, parser).select_one('div.entry-content'))
+    assert cleaned(WordPressScraper.CLEANING_RULES, WORDPRESS_BODY, 'div.entry-content', parser) == expected
+
+
+@pytest.mark.parametrize('parser', PARSERS)
+def test_empty_ignores_code_and_comments(parser):
+    body = ('<div><a href="a"><script>x = 1</script></a><a href="b"><style>p {}</style></a>'
+            '<a href="c"><!-- note --></a><a href="d"><template>t</template></a><a href="e">text</a></div>')
+    assert cleaned([Rule('empty-links', tags=('a',), when='empty')], body, 'div', parser) \
+        == '<div><a href="e">text</a></div>'
+
+
+def test_hits_count_matches_per_rule():
+    cleaner = Cleaner(WordPressScraper.CLEANING_RULES)
+    for _ in range(2):
+        cleaner.clean(BeautifulSoup(WORDPRESS_BODY, 'html.parser').select_one('div.entry-content'))
+    assert cleaner.hits == {'share-widgets': 8, 'image-links': 6}
+
+
+def test_unknown_action_is_rejected():
+    with pytest.raises(ValueError):
+        Cleaner([Rule('bad', action='hide')])
@@ -0,0 +1,128 @@
+import os
+
+from pipeline import incomplete_crawl
+from scrapers.base_scraper import BaseScraper
+from scrapers.crawl_journal import CrawlJournal
+
+
+def post(number: int) -> dict:
+    return {'url': f'https://example.com/{number}/', 'title': f'Post {number}', 'content': '<p>Body</p>'}
+
+
+def write_journal(path: str) -> int:
+    """A journal with two posts, a failure and a cursor; returns its size."""
+    journal = CrawlJournal(str(path))
+    journal.record_post(post(1))
+    journal.record_failure('https://example.com/2/', {'slug': '2'})
+    journal.record_post(post(3))
+    journal.record_cursor({'page': 2})
+    journal.close()
+    return os.path.getsize(path)
+
+
+def test_resume_replays_records(tmp_path):
+    path = tmp_path / 'blog.jsonl'
+    write_journal(path)
+    journal = CrawlJournal(str(path), resume=True)
+    assert list(journal.records()) == [('https://example.com/1/', 'post'), ('https://example.com/2/', 'failed'),
+                                       ('https://example.com/3/', 'post')]
+    assert journal.failed == ['https://example.com/2/']
+    assert journal.cursor == {'page': 2}
+    assert not journal.complete
+    assert journal.read('https://example.com/3/')['post'] == post(3)
+    assert journal.read('https://example.com/2/')['entry'] == {'slug': '2'}
+    journal.close()
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    path = tmp_path / 'blog.jsonl'
+    size = write_journal(path)
+    # A crash in the middle of writing the next record
+    with open(path, 'ab') as f:
+        f.write(b'{"type": "post", "url": "https://example.com/4/", "post": {"ti')
+
+    journal = CrawlJournal(str(path), resume=True)
+    assert len(journal) == 3
+    assert 'https://example.com/4/' not in journal
+    assert journal.cursor == {'page': 2}
+    assert os.path.getsize(path) == size
+
+    # New records start on a clean line and survive the next resume
+    journal.record_post(post(4))
+    journal.record_post(post(2))
+    journal.record_end()
+    journal.close()
+    journal = CrawlJournal(str(path), resume=True)
+    assert journal.completed('https://example.com/4/')
+    assert journal.completed('https://example.com/2/')
+    assert journal.failed == []
+    assert journal.complete
+    assert journal.read('https://example.com/4/')['post'] == post(4)
+    journal.close()
+
+
+def test_record_torn_before_its_newline_is_dropped(tmp_path):
+    path = tmp_path / 'blog.jsonl'
+    size = write_journal(path)
+    with open(path, 'ab') as f:
+        f.write(b'{"type": "cursor", "cursor": {"page": 3}}')
+
+    journal = CrawlJournal(str(path), resume=True)
+    assert journal.cursor == {'page': 2}
+    assert os.path.getsize(path) == size
+    journal.record_cursor({'page': 3})
+    journal.close()
+    assert CrawlJournal(str(path), resume=True).cursor == {'page': 3}
+
+
+def test_failure_after_completion_keeps_the_post(tmp_path):
+    journal = CrawlJournal(str(tmp_path / 'blog.jsonl'))
+    journal.record_post(post(1))
+    journal.record_failure('https://example.com/1/', None)
+    assert journal.completed('https://example.com/1/')
+    assert journal.failed == []
+    journal.close()
+
+
+def test_missing_journal_resumes_empty(tmp_path):
+    journal = CrawlJournal(str(tmp_path / 'checkpoints' / 'blog.jsonl'), resume=True)
+    assert len(journal) == 0
+    assert journal.cursor is None
+    journal.close()
+
+
+class ListScraper(BaseScraper):
+    """A one-page blog listing posts 3, 2 and 1; the posts in `failing` can't be fetched."""
+
+    def __init__(self, journal, failing=()):
+        super().__init__('https://example.com/', journal=journal)
+        self.failing = set(failing)
+        self.fetched = []
+
+    def _iter_entries(self, cursor):
+        if cursor is None:
+            for number in (3, 2, 1):
+                yield f'https://example.com/{number}/', {'slug': str(number)}, None
+            yield None, None, {'page': 2}
+
+    def _fetch_entry(self, url, entry):
+        self.fetched.append(url)
+        if url in self.failing:
+            return {}
+        return post(int(entry['slug']))
+
+
+def test_failed_posts_are_retried_on_resume(tmp_path):
+    path = str(tmp_path / 'blog.jsonl')
+    scraper = ListScraper(CrawlJournal(path), failing={'https://example.com/2/'})
+    assert [p['url'] for p in scraper.get_posts() if p] == ['https://example.com/3/', 'https://example.com/1/']
+    assert incomplete_crawl(scraper) == ("the crawl is incomplete (1 posts failed), "
+                                         "run again with --resume to continue it")
+    scraper.journal.close()
+
+    scraper = ListScraper(CrawlJournal(path, resume=True))
+    assert [p['url'] for p in scraper.get_posts()] == [post(number)['url'] for number in (3, 2, 1)]
+    assert scraper.fetched == ['https://example.com/2/']
+    assert incomplete_crawl(scraper) is None
+    assert scraper.journal.complete
+    scraper.journal.close()
@@ -0,0 +1,118 @@
+import io
+
+import pytest
+import requests
+
+from scrapers import http_cache
+from scrapers.http_cache import HTTPCache, OfflineCacheMiss
+
+
+class FakeTime:
+    """A clock that ticks one second every time it is read."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(http_cache, 'time', fake)
+    return fake
+
+
+class Server:
+    """Serves `bodies` by URL with an ETag, answering 304 when the client already has it."""
+
+    def __init__(self, bodies, last_modified=None):
+        self.bodies = bodies
+        self.last_modified = last_modified
+        self.requests = []
+
+    def __call__(self, url, params=None, headers=None):
+        self.requests.append((url, dict(headers or {})))
+        body = self.bodies[url]
+        etag = f'"{len(body)}"'
+        response = requests.Response()
+        response.url = url
+        response.raw = io.BytesIO(b'')
+        response.headers['ETag'] = etag
+        if self.last_modified:
+            response.headers['Last-Modified'] = self.last_modified
+        if (headers or {}).get('If-None-Match') == etag:
+            response.status_code = 304
+        else:
+            response.status_code = 200
+            response.headers['Content-Type'] = 'text/html'
+            response.raw = io.BytesIO(body)
+        return response
+
+
+def test_stale_entry_is_revalidated(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    server = Server({'https://example.com/': b'<p>Post</p>'}, last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+    assert cache.get('https://example.com/', server).content == b'<p>Post</p>'
+    assert server.requests[0][1] == {}
+
+    response = cache.get('https://example.com/', server)
+    assert response.status_code == 200
+    assert response.content == b'<p>Post</p>'
+    assert response.headers['Content-Type'] == 'text/html'
+    assert server.requests[1][1] == {'If-None-Match': '"11"',
+                                     'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+
+
+def test_changed_entry_is_replaced(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    server = Server({'https://example.com/': b'<p>Post</p>'})
+    cache.get('https://example.com/', server)
+    server.bodies['https://example.com/'] = b'<p>Edited post</p>'
+    assert cache.get('https://example.com/', server).content == b'<p>Edited post</p>'
+    assert cache.get('https://example.com/', server).content == b'<p>Edited post</p>'
+    assert server.requests[2][1] == {'If-None-Match': '"18"'}
+
+
+def test_fresh_entry_is_served_without_a_request(tmp_path):
+    cache = HTTPCache(str(tmp_path), max_age=60)
+    server = Server({'https://example.com/': b'<p>Post</p>'})
+    cache.get('https://example.com/', server)
+    assert cache.get('https://example.com/', server).content == b'<p>Post</p>'
+    assert len(server.requests) == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = HTTPCache(str(tmp_path), max_bytes=25)
+    server = Server({f'https://example.com/{number}/': b'x' * 10 for number in (1, 2, 3)})
+    cache.get('https://example.com/1/', server)
+    cache.get('https://example.com/2/', server)
+    # Reading 1 again makes 2 the least recently used
+    cache.get('https://example.com/1/', server)
+    cache.get('https://example.com/3/', server)
+    cache.close()
+
+    offline = HTTPCache(str(tmp_path), offline=True)
+    assert offline.get('https://example.com/1/', server).content == b'x' * 10
+    assert offline.get('https://example.com/3/', server).content == b'x' * 10
+    with pytest.raises(OfflineCacheMiss):
+        offline.get('https://example.com/2/', server)
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_offline_mode_never_touches_the_network(tmp_path):
+    server = Server({'https://example.com/': b'<p>Post</p>'})
+    cache = HTTPCache(str(tmp_path))
+    cache.get('https://example.com/', server, params={'page': 2})
+    cache.close()
+    requests_made = len(server.requests)
+
+    offline = HTTPCache(str(tmp_path), offline=True)
+    response = offline.get('https://example.com/', server, params={'page': 2})
+    assert response.content == b'<p>Post</p>'
+    assert response.url == 'https://example.com/?page=2'
+    with pytest.raises(OfflineCacheMiss):
+        offline.get('https://example.com/', server, params={'page': 3})
+    assert len(server.requests) == requests_made
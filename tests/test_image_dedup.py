@@ -0,0 +1,61 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from pdf_generator.image_optimizer import ImageOptimizer, optimize_image
+from pdf_generator.image_profiles import PROFILES
+
+PROFILE = PROFILES['screen']
+
+
+def formula(text: str, width: int = 1400) -> Image.Image:
+    image = Image.new('RGB', (1400, 200), 'white')
+    ImageDraw.Draw(image).text((600, 90), text, fill='black')
+    return image.resize((width, width // 7)) if width != 1400 else image
+
+
+@pytest.fixture
+def optimizer(tmp_path):
+    optimizer = ImageOptimizer(output_dir=str(tmp_path / 'cache'), dedup_distance=ImageOptimizer.DEDUP_DISTANCE)
+    yield optimizer
+    optimizer.close()
+
+
+def add(optimizer, tmp_path, name: str, image: Image.Image) -> str:
+    """Optimize `image` and return the file the PDF would embed for it."""
+    source = str(tmp_path / f'{name}.png')
+    output = str(tmp_path / f'{name}.jpg')
+    image.save(source)
+    result = optimize_image(source, output, PROFILE)
+    fingerprint = {'phash': f'{result.phash:x}', 'aspect': result.aspect, 'contrast': result.contrast}
+    return optimizer._deduplicate(PROFILE, output, fingerprint)
+
+
+def test_resized_copy_shares_the_file(optimizer, tmp_path):
+    first = add(optimizer, tmp_path, 'full', formula('E = mc^2'))
+    assert add(optimizer, tmp_path, 'half', formula('E = mc^2', width=700)) == first
+
+
+def test_similar_text_keeps_its_file(optimizer, tmp_path):
+    # Their hashes are within the distance; only the pixels tell them apart
+    add(optimizer, tmp_path, 'a', formula('E = mc^2'))
+    assert add(optimizer, tmp_path, 'b', formula('E = mc^3')).endswith('b.jpg')
+
+
+def test_blank_images_keep_their_files(optimizer, tmp_path):
+    add(optimizer, tmp_path, 'white', Image.new('RGB', (800, 400), 'white'))
+    assert add(optimizer, tmp_path, 'white2', Image.new('RGB', (800, 400), 'white')).endswith('white2.jpg')
+
+
+def test_crop_keeps_its_file(optimizer, tmp_path):
+    image = formula('E = mc^2')
+    add(optimizer, tmp_path, 'full', image)
+    assert add(optimizer, tmp_path, 'crop', image.crop((0, 0, 1200, 200))).endswith('crop.jpg')
+
+
+def test_dedup_is_off_by_default(tmp_path):
+    optimizer = ImageOptimizer(output_dir=str(tmp_path / 'cache'))
+    try:
+        add(optimizer, tmp_path, 'full', formula('E = mc^2'))
+        assert add(optimizer, tmp_path, 'half', formula('E = mc^2', width=700)).endswith('half.jpg')
+    finally:
+        optimizer.close()
@@ -0,0 +1,48 @@
+import pytest
+
+from pdf_generator.image_urls import canonical_image_url
+
+SUBSTACK_SOURCE = 'https%3A%2F%2Fsubstack-post-media.s3.amazonaws.com%2Fpublic%2Fimages%2Fa.png'
+SOURCE = 'https://substack-post-media.s3.amazonaws.com/public/images/a.png'
+
+
+@pytest.mark.parametrize('url, other', [
+    # The same file over http and https
+    ('http://example.com/wp-content/uploads/photo.jpg', 'https://example.com/wp-content/uploads/photo.jpg'),
+    # Jetpack's proxy of an upload
+    ('https://i0.wp.com/example.com/wp-content/uploads/photo.jpg?ssl=1',
+     'https://example.com/wp-content/uploads/photo.jpg'),
+    ('https://i2.wp.com/Example.com/photo.jpg', 'https://example.com/photo.jpg'),
+    # Other formats and qualities
+    ('https://img.example.com/a.jpg?fm=webp&q=75&auto=format', 'https://img.example.com/a.jpg'),
+    ('https://img.example.com/a.jpg?w=600&fm=webp', 'https://img.example.com/a.jpg?w=600'),
+    # Substack's CDN, with or without encoding transformations
+    (f'https://substackcdn.com/image/fetch/f_auto,q_auto:good,fl_progressive:steep/{SUBSTACK_SOURCE}', SOURCE),
+    (f'https://substackcdn.com/image/fetch/w_1456,c_limit,f_webp,q_auto:good/{SUBSTACK_SOURCE}',
+     f'https://substackcdn.com/image/fetch/w_1456,c_limit,f_auto/{SUBSTACK_SOURCE}'),
+])
+def test_encodings_of_an_image_share_a_url(url, other):
+    assert canonical_image_url(url) == canonical_image_url(other)
+
+
+@pytest.mark.parametrize('url, other', [
+    # WordPress sizes are often crops
+    ('https://example.com/wp-content/uploads/photo-150x150.jpg', 'https://example.com/wp-content/uploads/photo.jpg'),
+    ('https://example.com/wp-content/uploads/photo-1024x683.jpg', 'https://example.com/wp-content/uploads/photo.jpg'),
+    ('https://example.com/wp-content/uploads/photo-scaled.jpg', 'https://example.com/wp-content/uploads/photo.jpg'),
+    # Resize and crop parameters
+    ('https://i0.wp.com/example.com/photo.jpg?resize=300%2C200&ssl=1', 'https://example.com/photo.jpg'),
+    ('https://img.example.com/a.jpg?crop=faces&h=200', 'https://img.example.com/a.jpg'),
+    ('https://img.example.com/a.jpg?w=300', 'https://img.example.com/a.jpg?w=600'),
+    # Substack thumbnails
+    (f'https://substackcdn.com/image/fetch/w_120,h_120,c_fill,f_auto/{SUBSTACK_SOURCE}', SOURCE),
+    (f'https://substackcdn.com/image/fetch/w_120,h_120,c_fill/{SUBSTACK_SOURCE}',
+     f'https://substackcdn.com/image/fetch/w_1456,c_limit/{SUBSTACK_SOURCE}'),
+])
+def test_resized_and_cropped_variants_keep_their_url(url, other):
+    assert canonical_image_url(url) != canonical_image_url(other)
+
+
+def test_different_files_keep_their_url():
+    assert canonical_image_url('https://example.com/a.jpg') != canonical_image_url('https://example.com/b.jpg')
+    assert canonical_image_url('https://example.com/a.jpg') != canonical_image_url('https://other.com/a.jpg')
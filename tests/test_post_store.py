@@ -0,0 +1,73 @@
+from scrapers.base_scraper import BaseScraper
+from scrapers.post_store import PostStore
+from pipeline import scraped_posts
+
+
+class ListScraper(BaseScraper):
+    """A blog whose listing is `urls`, newest first; the posts in `failing` can't be fetched."""
+
+    def __init__(self, urls, post_store, failing=()):
+        super().__init__('https://example.com/', post_store=post_store)
+        self.urls = urls
+        self.failing = set(failing)
+        self.fetched = []
+
+    def _iter_entries(self, cursor):
+        for url in self.urls:
+            if self._is_known(url):
+                return
+            yield url, {}, None
+
+    def _fetch_entry(self, url, entry):
+        self.fetched.append(url)
+        if url in self.failing:
+            return {}
+        return {'url': url, 'title': url, 'content': '<p>Body</p>'}
+
+
+def urls(*numbers):
+    return [f'https://example.com/{number}/' for number in numbers]
+
+
+def run(directory, listing, failing=()):
+    store = PostStore(str(directory))
+    scraper = ListScraper(listing, store, failing)
+    posts = [post['url'] for post in scraped_posts(scraper, store)]
+    return scraper, posts
+
+
+def test_listing_stops_at_a_stored_post(tmp_path):
+    run(tmp_path, urls(3, 2, 1))
+    scraper, posts = run(tmp_path, urls(5, 4, 3, 2, 1))
+    assert scraper.fetched == urls(5, 4)
+    assert posts == urls(5, 4, 3, 2, 1)
+
+
+def test_incomplete_crawl_is_not_stored(tmp_path):
+    run(tmp_path, urls(2, 1))
+    scraper, posts = run(tmp_path, urls(5, 4, 3, 2, 1), failing=urls(4))
+    assert not scraper.complete
+    # This run's PDF still gets the posts it fetched
+    assert posts == urls(5, 3, 2, 1)
+    assert len(PostStore(str(tmp_path))) == 2
+
+    # So the next run fetches the failed post instead of stopping at the newer one
+    scraper, posts = run(tmp_path, urls(5, 4, 3, 2, 1))
+    assert scraper.fetched == urls(5, 4, 3)
+    assert posts == urls(5, 4, 3, 2, 1)
+
+
+def test_post_listed_twice_does_not_stop_the_listing(tmp_path):
+    # An offset page shifted by a new post lists the last post of the previous page again
+    scraper, posts = run(tmp_path, urls(4, 3, 3, 2, 1))
+    assert scraper.fetched == urls(4, 3, 3, 2, 1)
+    assert posts == urls(4, 3, 2, 1)
+
+
+def test_store_keeps_archive_order_across_runs(tmp_path):
+    run(tmp_path, urls(2, 1))
+    run(tmp_path, urls(4, 3, 2, 1))
+    store = PostStore(str(tmp_path))
+    assert [post['url'] for post in store.posts()] == urls(4, 3, 2, 1)
+    assert store.known('https://example.com/4/')
+    assert not store.known('https://example.com/5/')
@@ -0,0 +1,93 @@
+import pytest
+
+from scrapers import rate_limiter
+from scrapers.rate_limiter import HostRateLimiters, RateLimiter
+
+
+class FakeTime:
+    """A clock that only moves when slept on."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(rate_limiter, 'time', fake)
+    return fake
+
+
+def test_requests_are_spaced_by_the_rate(clock):
+    limiter = RateLimiter(rate=2.0)
+    for _ in range(5):
+        limiter.acquire()
+    # The first request uses the initial burst, the next four wait half a second each
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_backoff_pauses_until_its_deadline(clock):
+    limiter = RateLimiter(rate=None)
+    limiter.backoff(3.0)
+    limiter.acquire()
+    assert clock.now == pytest.approx(3.0)
+
+
+def test_success_ramps_the_rate_up_to_max_rate(clock):
+    limiter = RateLimiter(rate=0.5, max_rate=1.0, increase=0.05)
+    limiter.record_success()
+    # The increase is divided by the rate, so the ramp is linear in time
+    assert limiter.rate == pytest.approx(0.6)
+    for _ in range(100):
+        limiter.record_success()
+    assert limiter.rate == 1.0
+
+
+def test_success_without_max_rate_keeps_the_rate(clock):
+    limiter = RateLimiter(rate=0.5)
+    limiter.record_success()
+    assert limiter.rate == 0.5
+
+
+def test_throttle_halves_the_rate_down_to_min_rate(clock):
+    limiter = RateLimiter(rate=1.0, min_rate=0.2)
+    limiter.record_throttle()
+    assert limiter.rate == 0.5
+    limiter.record_throttle()
+    limiter.record_throttle()
+    assert limiter.rate == 0.2
+
+
+def test_unlimited_throttle_starts_from_half_the_observed_rate(clock):
+    limiter = RateLimiter(rate=None)
+    for _ in range(5):
+        limiter.acquire()
+        clock.sleep(0.25)
+    limiter.record_throttle()
+    # Five requests a quarter second apart were four requests a second
+    assert limiter.rate == pytest.approx(2.0)
+    assert limiter.max_rate == pytest.approx(4.0)
+    for _ in range(1000):
+        limiter.record_success()
+    assert limiter.rate == pytest.approx(4.0)
+
+
+def test_unlimited_throttle_without_history_stays_unlimited(clock):
+    limiter = RateLimiter(rate=None)
+    limiter.acquire()
+    limiter.record_throttle()
+    assert limiter.rate is None
+
+
+def test_blogs_of_one_host_share_a_limiter():
+    limiters = HostRateLimiters()
+    first = limiters.for_url('https://example.com/blog/', 0.5)
+    assert limiters.for_url('https://example.com/other/', 2.0) is first
+    assert first.rate == 0.5
+    assert limiters.for_url('https://example.org/', 0.5) is not first
@@ -0,0 +1,156 @@
+import io
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from scrapers import rate_limiter, request_scheduler
+from scrapers.rate_limiter import RateLimiter
+from scrapers.request_scheduler import RequestScheduler
+
+
+def response_with(retry_after=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 429
+    if retry_after is not None:
+        response.headers['Retry-After'] = retry_after
+    return response
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    ('', None),
+    ('120', 120.0),
+    ('1.5', 1.5),
+    ('0', 0.0),
+    # A clock-skewed or bogus negative delay means "now"
+    ('-5', 0.0),
+    ('soon', None),
+])
+def test_retry_after_seconds(value, expected):
+    assert RequestScheduler._retry_after(response_with(value)) == expected
+
+
+def test_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=90)
+    delay = RequestScheduler._retry_after(response_with(format_datetime(when, usegmt=True)))
+    assert 85 <= delay <= 90
+
+
+def test_retry_after_past_date_is_now():
+    assert RequestScheduler._retry_after(response_with('Wed, 21 Oct 2015 07:28:00 GMT')) == 0.0
+
+
+def test_retry_after_date_without_zone_is_utc():
+    when = datetime.now(timezone.utc) + timedelta(seconds=60)
+    delay = RequestScheduler._retry_after(response_with(when.strftime('%a, %d %b %Y %H:%M:%S')))
+    assert 55 <= delay <= 60
+
+
+class FakeTime:
+    """A clock that only moves when slept on, recording every sleep."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(request_scheduler, 'time', fake)
+    monkeypatch.setattr(rate_limiter, 'time', fake)
+    return fake
+
+
+class Server:
+    """Answers requests with `statuses` in turn, then with 200."""
+
+    def __init__(self, *statuses, headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers or {}
+        self.requests = 0
+
+    def __call__(self) -> requests.Response:
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0) if self.statuses else 200
+        response.raw = io.BytesIO(b'')
+        response.headers.update(self.headers)
+        return response
+
+
+def test_server_errors_are_retried(clock):
+    scheduler = RequestScheduler(max_retries=4)
+    server = Server(500, 503, 502)
+    assert scheduler.send('https://example.com/', server).status_code == 200
+    assert server.requests == 4
+    assert scheduler.retries == 3
+
+
+def test_retries_of_a_request_are_capped(clock):
+    scheduler = RequestScheduler(max_retries=2)
+    server = Server(500, 500, 500, 500)
+    # The last response is returned for the caller's raise_for_status
+    assert scheduler.send('https://example.com/', server).status_code == 500
+    assert server.requests == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_total_retry_budget_is_shared_by_requests(clock):
+    scheduler = RequestScheduler(max_retries=4, max_total_retries=3)
+    assert scheduler.send('https://example.com/1/', Server(500, 500)).status_code == 200
+    server = Server(500, 500)
+    assert scheduler.send('https://example.com/2/', server).status_code == 500
+    assert server.requests == 2
+    assert scheduler.retries == 3
+
+
+def test_connection_errors_are_reraised_when_retries_run_out(clock):
+    scheduler = RequestScheduler(max_retries=1)
+    attempts = []
+
+    def refuse():
+        attempts.append(1)
+        raise requests.ConnectionError('refused')
+
+    with pytest.raises(requests.ConnectionError):
+        scheduler.send('https://example.com/', refuse)
+    assert len(attempts) == 2
+
+
+def test_backoff_is_exponential_with_equal_jitter(clock):
+    random.seed(0)
+    scheduler = RequestScheduler(max_retries=6, base_delay=1.0, max_delay=10.0)
+    scheduler.send('https://example.com/', Server(*[500] * 6))
+    # Each wait is between half and all of the capped exponential delay
+    for sleep, delay in zip(clock.sleeps, [1, 2, 4, 8, 10, 10]):
+        assert delay / 2 <= sleep <= delay
+    assert len(clock.sleeps) == 6
+
+
+def test_throttle_backs_off_the_shared_limiter(clock):
+    limiter = RateLimiter(rate=1.0)
+    scheduler = RequestScheduler(limiter)
+    server = Server(429, headers={'Retry-After': '30'})
+    assert scheduler.send('https://example.com/', server).status_code == 200
+    assert limiter.rate == 0.5
+    # The wait is the limiter's pause rather than a sleep of the request
+    assert clock.now >= 30
+
+
+def test_retry_after_beyond_max_delay_gives_up(clock):
+    scheduler = RequestScheduler(max_delay=60.0)
+    server = Server(503, headers={'Retry-After': '3600'})
+    assert scheduler.send('https://example.com/', server).status_code == 503
+    assert server.requests == 1
+    assert clock.sleeps == []